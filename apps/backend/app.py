@@ -1,10 +1,10 @@
-from flask import Flask, request, jsonify
+from flask import Flask, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
 import logging
-from music_services import LastFMService, MusicBrainzService, RecommendationEngine
-from audio_processing import audio_bp
+from warmup import WarmupState, start_warmup
+from service_roles import parse_roles, METADATA, AUDIO
 from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables
@@ -16,95 +16,23 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
-# Initialize ThreadPoolExecutor
-executor = ThreadPoolExecutor(max_workers=4)
-
-# Add to app context
-app.executor = executor
-
-# Initialize services
-lastfm_service = LastFMService(os.getenv('LASTFM_API_KEY'))
-musicbrainz_service = MusicBrainzService(
-    "YourAppName",
-    "1.0",
-    os.getenv('CONTACT_EMAIL', 'your@email.com')
-)
-recommendation_engine = RecommendationEngine(lastfm_service, musicbrainz_service)
-
-# Register the audio processing blueprint
-app.register_blueprint(audio_bp, url_prefix='/api/audio')
-
-# Existing routes
-@app.route('/api/recommendations', methods=['POST'])
-def get_recommendations():
-    logger.info("Received recommendation request")
-    try:
-        data = request.json
-        logger.info(f"Request data: {data}")
-
-        if not data:
-            logger.error("No data provided in request")
-            return jsonify({'status': 'error', 'message': 'No data provided'}), 400
-        
-        if 'title' not in data or 'artist' not in data:
-            logger.error("Missing title or artist in request")
-            return jsonify({'status': 'error', 'message': 'Missing title or artist'}), 400
-
-        # Get optional filters
-        genre_filter = data.get('genres', [])
-        limit = data.get('limit', 10)
-
-        logger.info(f"Making recommendation request with filters: genres={genre_filter}, limit={limit}")
-
-        # Get recommendations
-        recommendations = recommendation_engine.get_recommendations(
-            data['title'],
-            data['artist'],
-            limit=limit,
-            genre_filter=genre_filter
-        )
-
-        logger.info(f"Got recommendations: {recommendations}")
-
-        if not recommendations:
-            logger.warning("No recommendations found")
-            return jsonify({
-                'status': 'success',
-                'recommendations': [],
-                'message': 'No recommendations found for this track.'
-            })
-
-        return jsonify({
-            'status': 'success',
-            'recommendations': recommendations
-        })
-
-    except Exception as e:
-        logger.error(f"Error processing request: {e}")
-        logger.exception("Full traceback:")
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
-
-@app.route('/api/genres', methods=['GET'])
-def get_genres():
-    """Get available genres for filtering"""
-    try:
-        genres = [
-            "Rock", "Pop", "Hip Hop", "Jazz", "Classical", "Electronic",
-            "Folk", "Country", "R&B", "Metal", "Blues", "Reggae"
-        ]
-        return jsonify({
-            'status': 'success',
-            'genres': genres
-        })
-    except Exception as e:
-        logger.error(f"Error getting genres: {e}")
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+
+# Roles served by this process, e.g. SERVICE_ROLES=metadata for a recommendation-only tier
+app.roles = parse_roles(os.getenv('SERVICE_ROLES', ''))
+logger.info(f"Starting with service roles: {app.roles}")
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe, healthy once the warm-up has pushed a clip through the pipeline"""
+    state = app.warmup_state.to_dict()
+    state['roles'] = app.roles
+    ready = app.warmup_state.ready
+    if AUDIO in app.roles:
+        from memory_guard import metrics as memory_metrics
+        # A worker whose memory ratcheted past its limit asks to be replaced
+        state['recycle_requested'] = memory_metrics.recycle_reason
+        ready = ready and memory_metrics.recycle_reason is None
+    return jsonify(state), 200 if ready else 503
 
 # Configuration for file uploads
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
@@ -121,5 +49,100 @@ for directory in [app.config['TEMP_AUDIO_DIR'], app.config['PROCESSED_DIR']]:
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Blueprints are imported per role so each tier only loads what it serves
+if METADATA in app.roles:
+    from recommendations import recommendations_bp
+    app.register_blueprint(recommendations_bp, url_prefix='/api')
+
+# Warm-up state, WARMUP=0 skips the warm-up and reports ready immediately
+app.warmup_state = WarmupState()
+if os.getenv('WARMUP', '1') == '0' or AUDIO not in app.roles:
+    app.warmup_state.set(WarmupState.READY)
+
+if AUDIO in app.roles:
+    from audio_processing import audio_bp
+    from audio_fetcher import DownloadCache, YtDlpFetcher, LocalFetcher
+    from artifact_store import ArtifactStore
+    from job_scheduler import JobScheduler
+    from upload_store import UploadStore
+    from job_broker import make_broker
+
+    # Initialize ThreadPoolExecutor
+    executor = ThreadPoolExecutor(max_workers=4)
+
+    # Add to app context
+    app.executor = executor
+
+    # Register the audio processing blueprint
+    app.register_blueprint(audio_bp, url_prefix='/api/audio')
+
+    # Resolve songs to local audio, LOCAL_AUDIO_DIR swaps YouTube for a local stand-in
+    local_audio_dir = os.getenv('LOCAL_AUDIO_DIR')
+    audio_fetcher = LocalFetcher(local_audio_dir) if local_audio_dir else YtDlpFetcher()
+    app.download_cache = DownloadCache(
+        os.path.join(app.config['UPLOAD_FOLDER'], 'download_cache.json'),
+        audio_fetcher
+    )
+
+    # JOB_BROKER=sqlite hands /process jobs to worker processes (python job_worker.py) instead of the executor
+    app.broker = make_broker(
+        os.getenv('JOB_BROKER', ''),
+        app.config['UPLOAD_FOLDER'],
+        lease_seconds=float(os.getenv('BROKER_LEASE_SECONDS', '60')),
+        max_attempts=int(os.getenv('BROKER_MAX_ATTEMPTS', '3')),
+        max_queue=int(os.getenv('MAX_QUEUED_JOBS', '16')),
+        max_per_client=int(os.getenv('MAX_JOBS_PER_CLIENT', '2')),
+        max_job_seconds=float(os.getenv('MAX_JOB_MINUTES', '60')) * 60
+    )
+    # Every process sharing the broker sweeps expired leases, so a dead worker's job is retried without new traffic
+    if app.broker:
+        app.broker.start_sweeper()
+
+    # Generated files are tracked and garbage collected in the background to bound disk use
+    # With a broker, every process sharing the store also spares the jobs leased by any worker
+    app.artifact_store = ArtifactStore(
+        app.config['UPLOAD_FOLDER'],
+        high_water_bytes=int(os.getenv('ARTIFACT_HIGH_WATER_MB', '5120')) * 1024 ** 2,
+        ttl_seconds=float(os.getenv('ARTIFACT_TTL_HOURS', '24')) * 3600,
+        external_pins=app.broker.active_job_ids if app.broker else None
+    )
+    app.artifact_store.start_gc(interval=float(os.getenv('ARTIFACT_GC_INTERVAL', '60')))
+
+    # Admission control for /process, bounded by concurrency and queue length rather than upload size
+    app.scheduler = JobScheduler(
+        max_running=int(os.getenv('MAX_RUNNING_JOBS', '2')),
+        max_queue=int(os.getenv('MAX_QUEUED_JOBS', '16')),
+        max_per_client=int(os.getenv('MAX_JOBS_PER_CLIENT', '2')),
+        max_job_seconds=float(os.getenv('MAX_JOB_MINUTES', '60')) * 60
+    )
+    app.config['MAX_QUEUE_WAIT'] = float(os.getenv('MAX_QUEUE_WAIT', '600'))
+    # Longest a request waits on the song search behind its cost estimate before assuming a default length
+    app.config['PROBE_TIMEOUT'] = float(os.getenv('PROBE_TIMEOUT_SECONDS', '5'))
+
+    # Resumable direct uploads of audio files, larger than MAX_CONTENT_LENGTH since they are streamed to disk
+    app.upload_store = UploadStore(
+        os.path.join(app.config['UPLOAD_FOLDER'], 'incoming'),
+        app.config['TEMP_AUDIO_DIR'],
+        max_upload_bytes=int(os.getenv('MAX_UPLOAD_MB', '2048')) * 1024 ** 2,
+        chunk_bytes=int(os.getenv('UPLOAD_CHUNK_MB', '8')) * 1024 ** 2,
+        ttl_seconds=float(os.getenv('UPLOAD_TTL_HOURS', '24')) * 3600
+    )
+
+def start_server_warmup(debug: bool) -> None:
+    """Start the warm-up in the process that serves requests (the reloader child in debug mode)"""
+    if debug and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        return
+    if app.warmup_state.begin():
+        start_warmup(os.path.join(app.config['UPLOAD_FOLDER'], 'warmup'), app.warmup_state)
+
+@app.before_request
+def warm_up_serving_process() -> None:
+    """
+    Under a WSGI server (gunicorn app:app) nothing runs __main__, so the first request
+    (usually a readiness probe) starts the warm-up, in the forked worker that serves it
+    """
+    start_server_warmup(debug=False)
+
 if __name__ == '__main__':
+    start_server_warmup(debug=True)
     app.run(debug=True)
\ No newline at end of file
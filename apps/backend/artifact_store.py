@@ -0,0 +1,267 @@
+import os
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process job locks on Windows, runs are still serialized within the process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HIGH_WATER_BYTES = 5 * 1024 ** 3
+DEFAULT_LOW_WATER_RATIO = 0.8
+DEFAULT_TTL_SECONDS = 24 * 3600
+DEFAULT_GC_INTERVAL = 60.0
+
+
+def job_id_for(audio_path: str) -> str:
+    """Job id of a song's artifacts, the source file name without its extension"""
+    return os.path.splitext(os.path.basename(audio_path))[0]
+
+
+@contextmanager
+def atomic_path(path: str) -> Iterator[str]:
+    """
+    Yield a temporary path next to `path` and move it into place once written,
+    so readers never see a partially written artifact
+    The extension is kept so writers that append one (np.savez) still hit the temp file
+    """
+    directory, filename = os.path.split(path)
+    name, ext = os.path.splitext(filename)
+    tmp_path = os.path.join(directory, f".{name}.tmp-{uuid.uuid4().hex}{ext}")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class ArtifactStore:
+    """
+    Tracks generated files (downloads, stems, MIDI, contours, tiles) with their size,
+    last access and owning job, and keeps disk use bounded in a background thread
+    Only registered files are ever deleted, and never while their job is pinned
+    """
+
+    def __init__(self,
+                 root: str,
+                 high_water_bytes: int = DEFAULT_HIGH_WATER_BYTES,
+                 low_water_ratio: float = DEFAULT_LOW_WATER_RATIO,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 external_pins: Optional[Callable[[], Iterable[str]]] = None):
+        self.root = root
+        # Jobs in flight in other processes sharing the store (e.g. broker workers), never collected either
+        self.external_pins = external_pins
+        self.high_water_bytes = high_water_bytes
+        self.low_water_bytes = int(high_water_bytes * low_water_ratio)
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.RLock()
+        self._pins: Dict[str, int] = {}
+        self._job_locks: Dict[str, threading.Lock] = {}
+        self._wake = threading.Event()
+        self._clear_requested = False
+        self._stop = threading.Event()
+        self._thread = None
+
+        os.makedirs(root, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, 'artifacts.db'), check_same_thread=False)
+        with self._db:
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    path TEXT PRIMARY KEY,
+                    job_id TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS artifacts_last_access ON artifacts (last_access)")
+
+    def _key(self, path: str) -> str:
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def register(self, path: str, job_id: str) -> None:
+        """Record (or refresh) a file owned by a job"""
+        if not os.path.isfile(path):
+            return
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("""
+                INSERT INTO artifacts (path, job_id, size, created, last_access) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET job_id = excluded.job_id, size = excluded.size,
+                                                last_access = excluded.last_access
+            """, (self._key(path), job_id, os.path.getsize(path), now, now))
+        if self.total_size() > self.high_water_bytes:
+            self._wake.set()
+
+    def register_dir(self, directory: str, job_id: str) -> None:
+        """Register every file under a job's output directory"""
+        for root, _, files in os.walk(directory):
+            for filename in files:
+                if '.tmp-' not in filename:
+                    self.register(os.path.join(root, filename), job_id)
+
+    def touch(self, path: str) -> None:
+        with self._lock, self._db:
+            self._db.execute("UPDATE artifacts SET last_access = ? WHERE path = ?", (time.time(), self._key(path)))
+
+    def pin(self, job_id: str) -> None:
+        with self._lock:
+            self._pins[job_id] = self._pins.get(job_id, 0) + 1
+
+    def unpin(self, job_id: str) -> None:
+        with self._lock:
+            count = self._pins.get(job_id, 0) - 1
+            if count > 0:
+                self._pins[job_id] = count
+            else:
+                self._pins.pop(job_id, None)
+
+    @contextmanager
+    def pinned(self, job_id: str) -> Iterator[None]:
+        """Protect a job's artifacts from collection while it runs or is being served"""
+        self.pin(job_id)
+        try:
+            yield
+        finally:
+            self.unpin(job_id)
+
+    @contextmanager
+    def exclusive(self, job_id: str) -> Iterator[None]:
+        """
+        Pin a job and hold its directory for one run at a time
+        The job id is the song's file name, so concurrent requests for the same song (in this process
+        or in any worker sharing the store) wait for each other instead of writing the same files
+        """
+        with self._lock:
+            job_lock = self._job_locks.setdefault(job_id, threading.Lock())
+        with self.pinned(job_id), job_lock:
+            if fcntl is None:
+                yield
+                return
+            lock_dir = os.path.join(self.root, '.locks')
+            os.makedirs(lock_dir, exist_ok=True)
+            with open(os.path.join(lock_dir, f"{job_id}.lock"), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def total_size(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+
+    def artifacts(self, job_id: Optional[str] = None) -> List[Dict]:
+        """Per-artifact metadata, including the pin count of the owning job"""
+        query = "SELECT path, job_id, size, created, last_access FROM artifacts"
+        args = ()
+        if job_id is not None:
+            query += " WHERE job_id = ?"
+            args = (job_id,)
+        with self._lock:
+            rows = self._db.execute(query, args).fetchall()
+            return [{
+                'path': path,
+                'job_id': owner,
+                'size': size,
+                'created': created,
+                'last_access': last_access,
+                'pins': self._pins.get(owner, 0)
+            } for path, owner, size, created, last_access in rows]
+
+    def _delete(self, path: str) -> int:
+        full_path = os.path.join(self.root, path)
+        freed = 0
+        try:
+            freed = os.path.getsize(full_path)
+            os.remove(full_path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Failed to remove artifact {full_path}: {e}")
+            return 0
+
+        with self._db:
+            self._db.execute("DELETE FROM artifacts WHERE path = ?", (path,))
+
+        # Drop per-job directories (e.g. processed_audio/<job_id>) once they are empty
+        directory = os.path.dirname(full_path)
+        if len(os.path.normpath(os.path.dirname(path)).split(os.sep)) >= 2:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+        return freed
+
+    def collect(self, clear: bool = False) -> Dict[str, int]:
+        """
+        One garbage collection pass: expire artifacts past the TTL, then evict least
+        recently used ones until disk use is back under the low-water mark
+        With clear=True every unpinned artifact is removed
+        """
+        removed = 0
+        freed = 0
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path, job_id, size, last_access FROM artifacts ORDER BY last_access"
+            ).fetchall()
+        total = sum(row[2] for row in rows)
+        external = set(self.external_pins()) if self.external_pins else set()
+
+        # Past the high-water mark, evict least recently used until under the low-water mark
+        evicting = total > self.high_water_bytes
+        for path, job_id, size, last_access in rows:
+            expired = now - last_access > self.ttl_seconds
+            if not (clear or expired or (evicting and total > self.low_water_bytes)):
+                continue
+
+            # The lock is held per file only, so request threads are never stalled by a full pass
+            with self._lock:
+                if job_id in self._pins or job_id in external:
+                    continue
+                freed += self._delete(path)
+            total -= size
+            removed += 1
+
+        if removed:
+            logger.info(f"Artifact GC removed {removed} files, freed {freed / 1024 ** 2:.1f} MB")
+        return {'removed': removed, 'freed': freed, 'total': max(total, 0)}
+
+    def request_clear(self) -> None:
+        """Ask the GC thread to remove every unpinned artifact without blocking the caller"""
+        self._clear_requested = True
+        self._wake.set()
+
+    def _run(self, interval: float) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            clear, self._clear_requested = self._clear_requested, False
+            try:
+                self.collect(clear=clear)
+            except Exception as e:
+                logger.error(f"Artifact GC error: {e}")
+
+    def start_gc(self, interval: float = DEFAULT_GC_INTERVAL) -> threading.Thread:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(interval,), name='artifact-gc', daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop_gc(self) -> None:
+        self._stop.set()
+        self._wake.set()
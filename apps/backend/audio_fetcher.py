@@ -0,0 +1,267 @@
+import os
+import re
+import json
+import shutil
+import logging
+import threading
+import unicodedata
+import concurrent.futures
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Containers the decoders read directly, so no transcode is needed after download
+AUDIO_EXTENSIONS = ('.opus', '.webm', '.m4a', '.ogg', '.mp3', '.wav', '.flac')
+
+
+def normalize_key(artist: str, title: str) -> str:
+    """Normalize an (artist, title) pair so trivial spelling differences share a cache entry"""
+    def clean(text: str) -> str:
+        text = unicodedata.normalize('NFKC', text or '').casefold()
+        text = re.sub(r'[^\w\s]', ' ', text)
+        return ' '.join(text.split())
+    return f"{clean(artist)}|{clean(title)}"
+
+
+def audio_duration(path: str) -> Optional[float]:
+    """Duration of an audio file in seconds, read from its header where the container allows"""
+    try:
+        import librosa
+        return float(librosa.get_duration(path=path))
+    except Exception as e:
+        logger.warning(f"Could not probe duration of {path}: {e}")
+        return None
+
+
+class AudioFetcher(ABC):
+    """Resolves an (artist, title) pair to a local audio file"""
+
+    @abstractmethod
+    def fetch(self, artist: str, title: str, output_dir: str, media_id: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Fetch audio for a song, skipping the search when a probe already found its media id
+        Returns:
+            Tuple of (media id, path to the downloaded file)
+        """
+
+    def probe(self, artist: str, title: str) -> Tuple[Optional[str], Optional[float]]:
+        """Media id and duration in seconds of the song without fetching it, None for what is unknown"""
+        return None, None
+
+
+class YtDlpFetcher(AudioFetcher):
+    """Searches YouTube and downloads the best audio-only stream in its native container"""
+
+    def __init__(self, search_suffix: str = 'audio'):
+        self.search_suffix = search_suffix
+
+    def _search_query(self, artist: str, title: str) -> str:
+        return f"ytsearch1:{artist} - {title} {self.search_suffix}".strip()
+
+    def probe(self, artist: str, title: str) -> Tuple[Optional[str], Optional[float]]:
+        import yt_dlp
+
+        ydl_opts = {'extract_flat': 'in_playlist', 'quiet': True, 'no_warnings': True}
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(self._search_query(artist, title), download=False)
+            entries = (info or {}).get('entries') or []
+            if not entries:
+                return None, None
+            duration = entries[0].get('duration')
+            return entries[0].get('id'), float(duration) if duration else None
+        except Exception as e:
+            logger.warning(f"Could not probe {artist} - {title}: {e}")
+            return None, None
+
+    def fetch(self, artist: str, title: str, output_dir: str, media_id: Optional[str] = None) -> Tuple[str, str]:
+        import yt_dlp
+
+        os.makedirs(output_dir, exist_ok=True)
+
+        ydl_opts = {
+            # Prefer audio-only streams, keep the source container as-is
+            'format': 'bestaudio[acodec=opus]/bestaudio[ext=m4a]/bestaudio/best',
+            'outtmpl': os.path.join(output_dir, '%(id)s.%(ext)s'),
+            'quiet': True,
+            'no_warnings': True
+        }
+
+        # A probed media id is downloaded directly, otherwise the search runs here
+        query = f"https://www.youtube.com/watch?v={media_id}" if media_id else self._search_query(artist, title)
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(query, download=True)
+            if media_id:
+                video_info = info
+            elif info and info.get('entries'):
+                video_info = info['entries'][0]
+            else:
+                video_info = None
+            if not video_info:
+                raise Exception("No audio found")
+
+            downloads = video_info.get('requested_downloads') or []
+            downloaded_file = downloads[0].get('filepath') if downloads else ydl.prepare_filename(video_info)
+
+            if not downloaded_file or not os.path.exists(downloaded_file):
+                raise Exception(f"File not found at: {downloaded_file}")
+
+            return video_info['id'], downloaded_file
+
+
+class LocalFetcher(AudioFetcher):
+    """
+    Serves songs from a local directory instead of the network
+    Files are matched by their normalized name, either "artist - title.ext" or "title.ext"
+    """
+
+    def __init__(self, source_dir: str):
+        self.source_dir = source_dir
+
+    def _find(self, artist: str, title: str) -> Optional[str]:
+        wanted = {normalize_key(artist, title), normalize_key('', title)}
+
+        for filename in sorted(os.listdir(self.source_dir)):
+            name, ext = os.path.splitext(filename)
+            if ext.lower() not in AUDIO_EXTENSIONS:
+                continue
+            parts = name.split(' - ', 1)
+            key = normalize_key(*parts) if len(parts) == 2 else normalize_key('', name)
+            if key in wanted:
+                return filename
+        return None
+
+    def probe(self, artist: str, title: str) -> Tuple[Optional[str], Optional[float]]:
+        filename = self._find(artist, title)
+        if filename is None:
+            return None, None
+        return self._media_id(filename), audio_duration(os.path.join(self.source_dir, filename))
+
+    @staticmethod
+    def _media_id(filename: str) -> str:
+        return re.sub(r'\W+', '_', os.path.splitext(filename)[0]).strip('_')
+
+    def fetch(self, artist: str, title: str, output_dir: str, media_id: Optional[str] = None) -> Tuple[str, str]:
+        filename = self._find(artist, title)
+        if filename is None:
+            raise Exception(f"No local audio found for {artist} - {title}")
+
+        ext = os.path.splitext(filename)[1]
+        os.makedirs(output_dir, exist_ok=True)
+        media_id = self._media_id(filename)
+        destination = os.path.join(output_dir, f"{media_id}{ext.lower()}")
+        if not os.path.exists(destination):
+            shutil.copyfile(os.path.join(self.source_dir, filename), destination)
+        return media_id, destination
+
+
+class DownloadCache:
+    """
+    Persistent map from normalized (artist, title) to the resolved media id and local file
+    Repeat requests for a song skip both the search and the download; a song probed for its cost
+    but not fetched yet keeps its media id and duration, so neither the probe nor the fetch searches again
+    """
+
+    def __init__(self, index_path: str, fetcher: AudioFetcher):
+        self.index_path = index_path
+        self.fetcher = fetcher
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        # Probes run off the request thread, one per song at a time, and finish (filling the index) even
+        # after a caller stopped waiting for them
+        self._probes: Dict[str, concurrent.futures.Future] = {}
+        self._probe_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='probe')
+        self._entries = self._read_index()
+
+    def _read_index(self) -> Dict[str, Dict]:
+        try:
+            with open(self.index_path, 'r') as infile:
+                return json.load(infile)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable download cache {self.index_path}: {e}")
+            return {}
+
+    def _write_index(self) -> None:
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w') as outfile:
+            json.dump(self._entries, outfile)
+        os.replace(tmp_path, self.index_path)
+
+    def lookup(self, artist: str, title: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(normalize_key(artist, title))
+        if entry and entry.get('path') and os.path.exists(entry['path']):
+            return entry
+        return None
+
+    def _probe(self, key: str, artist: str, title: str) -> Optional[float]:
+        try:
+            media_id, duration = self.fetcher.probe(artist, title)
+            with self._lock:
+                # A fetch that finished meanwhile has the better entry
+                if media_id and not self._entries.get(key, {}).get('path'):
+                    self._entries[key] = {'media_id': media_id, 'duration': duration}
+                    self._write_index()
+            return duration
+        finally:
+            with self._lock:
+                self._probes.pop(key, None)
+
+    def probe(self, artist: str, title: str, timeout: Optional[float] = None) -> Tuple[Optional[float], bool]:
+        """
+        Song duration for cost estimates, without downloading
+        A search taking longer than `timeout` seconds answers None (the caller assumes a default duration)
+        and keeps running in the background, so the fetch and later probes still reuse its result
+        Returns:
+            Tuple of (duration in seconds or None, whether the audio is already cached)
+        """
+        entry = self.lookup(artist, title)
+        if not entry:
+            key = normalize_key(artist, title)
+            with self._lock:
+                probed = self._entries.get(key)
+                if probed and probed.get('media_id'):
+                    return probed.get('duration'), False
+                future = self._probes.get(key)
+                if future is None:
+                    future = self._probes[key] = self._probe_pool.submit(self._probe, key, artist, title)
+            try:
+                return future.result(timeout), False
+            except concurrent.futures.TimeoutError:
+                logger.info(f"Probe of {key} still running after {timeout}s, assuming the default duration")
+                return None, False
+
+        if entry.get('duration') is None:
+            duration = audio_duration(entry['path'])
+            with self._lock:
+                entry['duration'] = duration
+                self._write_index()
+        return entry['duration'], True
+
+    def resolve(self, artist: str, title: str, output_dir: str) -> str:
+        """Return the local audio file for a song, fetching it only on a cache miss"""
+        key = normalize_key(artist, title)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Concurrent requests for the same song wait for a single download
+        with key_lock:
+            entry = self.lookup(artist, title)
+            if entry:
+                logger.info(f"Download cache hit for {key}: {entry['path']}")
+                return entry['path']
+
+            with self._lock:
+                probed = self._entries.get(key) or {}
+            logger.info(f"Download cache miss for {key}, fetching...")
+            media_id, path = self.fetcher.fetch(artist, title, output_dir, probed.get('media_id'))
+
+            with self._lock:
+                # A probed duration stays valid for the same media, the file's header is read otherwise
+                duration = probed.get('duration') if probed.get('media_id') == media_id else None
+                self._entries[key] = {'media_id': media_id, 'path': path, 'duration': duration}
+                self._write_index()
+            return path
@@ -1,13 +1,43 @@
-from flask import Blueprint, request, jsonify, current_app, send_from_directory, copy_current_request_context
+from flask import Blueprint, request, jsonify, current_app, send_from_directory, copy_current_request_context, Response, stream_with_context
 from concurrent.futures import ThreadPoolExecutor
 import os
+import json
+import queue
 import logging
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
 from flask_cors import CORS, cross_origin
-import yt_dlp
-from song_features_retriever import SongFeaturesRetriever
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
+from pitch_trackers import PITCH_TRACKERS, DEFAULT_PITCH_TRACKER
+from viewer_tiles import peak_tile, notes_tile, peaks_path, notes_index_path
+from melody_contour import load_contour, slice_contour, encode_contour, CONTENT_TYPE as CONTOUR_CONTENT_TYPE
+from artifact_store import job_id_for
+from job_scheduler import AdmissionRejected, estimate_cost, QUALITIES, FULL, PREVIEW
+from upload_store import UploadError, parse_checksum
+from output_plan import plan_outputs
+from job_broker import QUEUED, LEASED, DONE, FAILED
+from memory_guard import metrics as memory_metrics
 
 logger = logging.getLogger(__name__)
 audio_bp = Blueprint('audio', __name__)
+sock = Sock()
+
+SSE_KEEPALIVE_SECONDS = 15
+# How often the API polls the broker for events and results of jobs run by workers
+BROKER_POLL_SECONDS = 0.5
+
+# Live sessions are cheap (well under a millisecond of CPU per frame) but hold a thread each
+MAX_LIVE_SESSIONS = int(os.getenv('MAX_LIVE_SESSIONS', '8'))
+_live_sessions = threading.BoundedSemaphore(MAX_LIVE_SESSIONS)
+
+# Full-quality runs started behind a preview, by job id, only the most recent are kept
+MAX_TRACKED_RUNS = 256
+_full_runs = OrderedDict()
+_full_runs_lock = threading.Lock()
+RUN_STATES = {QUEUED: 'queued', LEASED: 'running', DONE: 'done', FAILED: 'failed'}
 
 # Enable CORS for the blueprint
 '''CORS(audio_bp, resources={
@@ -32,54 +62,276 @@ def safe_execute(task, timeout=3000):
         logger.error(f"Execution error: {e}")
         raise
 
+def artifact_url(path: str) -> str:
+    """Download URL of a generated file, relative to the processed directory (<job_id>/<file>)"""
+    relative_path = os.path.relpath(path, current_app.config['PROCESSED_DIR'])
+    return f"/api/audio/downloads/{relative_path.replace(os.sep, '/')}"
+
+def contour_urls(job_id: str, contour_path: str) -> Dict[str, str]:
+    contour_url = f"/api/audio/contour/{job_id}/{os.path.basename(contour_path)}"
+    return {'contour_url': contour_url, 'json_url': f"{contour_url}?format=json"}
+
+def tile_urls(job_id: str, stem_names, notes: bool = True) -> Dict:
+    urls = {
+        'peaks': {
+            name: f"/api/audio/tiles/peaks/{job_id}/{name}"
+            for name in stem_names
+        }
+    }
+    if notes:
+        urls['notes'] = f"/api/audio/tiles/notes/{job_id}"
+    return urls
+
+def stage_event(job_id: str, stage: str, payload: Dict) -> Dict:
+    """Turn the file paths of a finished pipeline stage into the URLs clients fetch them from"""
+    event = {'job_id': job_id}
+    if 'tempo' in payload:
+        event['tempo'] = payload['tempo']
+    if 'stems' in payload:
+        event['stems'] = {name: artifact_url(path) for name, path in payload['stems'].items()}
+    if payload.get('midi_path'):
+        event['midi_url'] = artifact_url(payload['midi_path'])
+    if payload.get('notes_paths'):
+        event['notes_urls'] = {fmt: artifact_url(path) for fmt, path in payload['notes_paths'].items()}
+    if payload.get('multitrack_midi_path'):
+        event['multitrack_midi_url'] = artifact_url(payload['multitrack_midi_path'])
+    if payload.get('contour_path'):
+        event.update(contour_urls(job_id, payload['contour_path']))
+    if 'tile_stems' in payload:
+        event['tiles'] = tile_urls(job_id, payload['tile_stems'])
+    return event
+
+def validate_process_request(data: Optional[Dict]) -> Optional[str]:
+    """Error message for an invalid /process request, None if it is valid"""
+    if data and data.get('upload_id'):
+        upload = current_app.upload_store.get(str(data['upload_id']))
+        if upload is None:
+            return f"Upload not found: {data['upload_id']}"
+        if not upload.complete:
+            return f"Upload is incomplete: {upload.offset} of {upload.size} bytes"
+    elif not data or 'title' not in data or 'artist' not in data:
+        return 'Title and artist required'
+
+    pitch_tracker = data.get('pitch_tracker', DEFAULT_PITCH_TRACKER)
+    if pitch_tracker not in PITCH_TRACKERS:
+        return f"Unknown pitch tracker '{pitch_tracker}', expected one of {sorted(PITCH_TRACKERS)}"
+    if data.get('quality', FULL) not in QUALITIES:
+        return f"Unknown quality '{data['quality']}', expected one of {list(QUALITIES)}"
+    if data.get('outputs') is not None and not isinstance(data['outputs'], list):
+        return "'outputs' must be a list"
+    try:
+        request_plan(data)
+    except ValueError as e:
+        return str(e)
+    return None
+
+def request_plan(data: Dict):
+    """Stages behind the outputs a /process request asks for"""
+    return plan_outputs(data.get('outputs'), bool(data.get('multitrack')), data.get('note_formats') or ())
+
+def client_id_for_request() -> str:
+    return request.headers.get('X-Client-Id') or request.remote_addr or 'anonymous'
+
+def job_cost(data: Dict, client_id: str) -> float:
+    """
+    Admission cost of a job, from the probed song duration
+    A client at its cap or a full queue is rejected first, so no request waits on a search it can't use;
+    a search slower than PROBE_TIMEOUT costs the job at the default duration
+    """
+    (current_app.broker or current_app.scheduler).check_admission(client_id)
+    if data.get('upload_id'):
+        # Uploads were probed as they arrived and need no download
+        duration, cached = current_app.upload_store.get(str(data['upload_id'])).duration, True
+    else:
+        duration, cached = current_app.download_cache.probe(data['artist'], data['title'],
+                                                             current_app.config['PROBE_TIMEOUT'])
+    stages = request_plan(data).stages if data.get('outputs') is not None else None
+    return estimate_cost(duration, cached, data.get('pitch_tracker', DEFAULT_PITCH_TRACKER),
+                         bool(data.get('multitrack')), data.get('quality', FULL), stages)
+
+def rejection_response(e: AdmissionRejected):
+    response = jsonify({'status': 'error', 'message': str(e), 'retry_after': e.retry_after})
+    if e.retry_after:
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response, e.status
+
+def run_process_job(app, data: Dict, on_stage: Optional[Callable[[str, Dict], None]] = None,
+                    on_start: Optional[Callable[[str], None]] = None) -> Dict:
+    """
+    Download (or take the uploaded file of) a song and process it, called on the executor inside an app context
+    (or by a broker worker, see job_worker)
+    on_stage receives (stage, event) with URLs as each pipeline stage finishes, on_start the job id once known
+    """
+    try:
+        temp_dir = app.config['UPLOAD_FOLDER']
+        os.makedirs(temp_dir, exist_ok=True)
+        
+        # Deferred so the audio stack only loads once audio is processed
+        from song_features_retriever import SongFeaturesRetriever
+        artifact_store = app.artifact_store
+        processor = SongFeaturesRetriever(temp_dir, artifact_store)
+        
+        if data.get('upload_id'):
+            audio_path = app.upload_store.audio_path(str(data['upload_id']))
+        else:
+            audio_path = download_audio(data['artist'], data['title'], temp_dir)
+        job_id = job_id_for(audio_path)
+        if on_start:
+            on_start(job_id)
+
+        def stage_done(stage: str, payload: Dict) -> None:
+            if on_stage:
+                on_stage(stage, stage_event(job_id, stage, payload))
+        
+        # Pinned so garbage collection leaves the job's files alone while it runs, and
+        # held so another request for the same song waits instead of writing the same directory
+        with artifact_store.exclusive(job_id):
+            artifact_store.register(audio_path, job_id)
+            results = processor.process_song(
+                audio_path,
+                pitch_tracker=data.get('pitch_tracker', DEFAULT_PITCH_TRACKER),
+                multitrack=bool(data.get('multitrack')),
+                note_formats=data.get('note_formats') or (),
+                job_id=job_id,
+                on_stage=stage_done,
+                quality=data.get('quality', FULL),
+                outputs=data.get('outputs')
+            )
+        
+        response_data = {
+            'status': 'success',
+            'job_id': job_id,
+            'quality': results['quality'],
+            'tempo': results['tempo'],
+            'stems': {
+                name: artifact_url(path)
+                for name, path in results['stems'].items()
+            },
+            'tiles': tile_urls(job_id, results['stems'], notes=bool(results['midi_path'])),
+            'memory': results['memory']
+        }
+
+        if results.get('outputs'):
+            response_data['outputs'] = results['outputs']
+
+        # Jobs that didn't ask for the melody have no transcription
+        if results['midi_path']:
+            response_data['midi_url'] = artifact_url(results['midi_path'])
+            response_data.update(contour_urls(job_id, results['contour_path']))
+
+        if results.get('vocal_activity'):
+            response_data['vocal_activity'] = results['vocal_activity']
+
+        if results.get('excerpt'):
+            response_data['excerpt'] = results['excerpt']
+
+        if results.get('reused_from'):
+            response_data['reused_from'] = results['reused_from']
+
+        if results['multitrack_midi_path']:
+            response_data['multitrack_midi_url'] = artifact_url(results['multitrack_midi_path'])
+
+        if results['notes_paths']:
+            response_data['notes_urls'] = {
+                fmt: artifact_url(path)
+                for fmt, path in results['notes_paths'].items()
+            }
+
+        # The full contour is large, only inline it on request
+        if data.get('include_melody') and results['melody'] is not None:
+            response_data['melody'] = results['melody'].tolist()
+        
+        return response_data
+        
+    except Exception as e:
+        logger.error(f"Error in processing task: {e}")
+        return {'status': 'error', 'message': str(e)}
+
+def set_full_run(job_id: str, **state) -> None:
+    with _full_runs_lock:
+        _full_runs[job_id] = {'job_id': job_id, **state}
+        _full_runs.move_to_end(job_id)
+        while len(_full_runs) > MAX_TRACKED_RUNS:
+            _full_runs.popitem(last=False)
+
+def start_full_run(app, data: Dict, client_id: str, job_id: str) -> Dict:
+    """
+    Queue the full-quality run of a previewed song on its own thread, admitted like any other job
+    It writes to the same job directory, replacing the preview's files, and reports through /jobs/<job_id>
+    """
+    full_data = {**data, 'quality': FULL}
+    try:
+        cost = job_cost(full_data, client_id)
+        task = app.broker.submit(full_data, client_id, cost) if app.broker else None
+    except AdmissionRejected as e:
+        logger.warning(f"Full run of {job_id} rejected: {e}")
+        set_full_run(job_id, state='failed', result={'status': 'error', 'message': str(e)})
+        return {'state': 'failed', 'message': str(e)}
+
+    if task:
+        set_full_run(job_id, state='queued', task_id=task.task_id)
+        return {'state': 'queued', 'status_url': f"/api/audio/jobs/{job_id}", 'task_id': task.task_id}
+
+    set_full_run(job_id, state='queued')
+
+    def run():
+        with app.app_context():
+            try:
+                with app.scheduler.slot(client_id, cost, timeout=app.config['MAX_QUEUE_WAIT']):
+                    set_full_run(job_id, state='running')
+                    result = run_process_job(app, full_data)
+            except AdmissionRejected as e:
+                logger.warning(f"Full run of {job_id} rejected: {e}")
+                result = {'status': 'error', 'message': str(e)}
+            failed = result.get('status') == 'error'
+            set_full_run(job_id, state='failed' if failed else 'done', result=result)
+
+    threading.Thread(target=run, name=f"full-run-{job_id}", daemon=True).start()
+    return {'state': 'queued', 'status_url': f"/api/audio/jobs/{job_id}"}
+
 @audio_bp.route('/process', methods=['POST'])
 def process_audio():
+    """
+    Process a song and answer with its results
+    "outputs" (any of tempo, vocals, instrumental, drums, bass, other, lead_vocals, backing_vocals,
+    midi, contour) limits the job to what they need, without it everything is produced
+    With "quality": "preview" the answer comes from a quick pass over the loudest excerpt,
+    and the full-quality run continues in the background (see /jobs/<job_id>)
+    """
     logger.info("Received audio processing request")
     
     data = request.get_json()
-    if not data or 'title' not in data or 'artist' not in data:
-        return jsonify({'status': 'error', 'message': 'Title and artist required'}), 400
+    error = validate_process_request(data)
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 400
+
+    client_id = client_id_for_request()
 
     try:
         app = current_app._get_current_object()
+
+        if app.broker:
+            return process_with_broker(app, data, client_id)
         
         @copy_current_request_context
         def process_task():
             with app.app_context():
-                try:
-                    temp_dir = app.config['UPLOAD_FOLDER']
-                    os.makedirs(temp_dir, exist_ok=True)
-                    
-                    processor = SongFeaturesRetriever(temp_dir)
-                    
-                    search_query = f"{data['artist']} - {data['title']} audio"
-                    audio_path = download_audio(search_query, temp_dir)
-                    
-                    results = processor.process_song(audio_path)
-                    
-                    base_url = "/api/audio/downloads"
-                    response_data = {
-                        'status': 'success',
-                        'tempo': results['tempo'],
-                        'midi_url': f"{base_url}/{os.path.basename(results['midi_path'])}",
-                        'json_url': f"{base_url}/{os.path.basename(results['json_path'])}",
-                        'melody': results['melody'],
-                        'stems': {
-                            name: f"{base_url}/{os.path.basename(path)}"
-                            for name, path in results['stems'].items()
-                        }
-                    }
-                    
-                    return response_data
-                    
-                except Exception as e:
-                    logger.error(f"Error in processing task: {e}")
-                    return {'status': 'error', 'message': str(e)}
-
-        result = safe_execute(process_task)
+                return run_process_job(app, data)
+
+        # Admission control: cost from the probed song duration, a slot only once it's our turn
+        try:
+            cost = job_cost(data, client_id)
+            with current_app.scheduler.slot(client_id, cost, timeout=current_app.config['MAX_QUEUE_WAIT']):
+                result = safe_execute(process_task)
+        except AdmissionRejected as e:
+            logger.warning(f"Rejected job for {client_id}: {e}")
+            return rejection_response(e)
         
         if result.get('status') == 'error':
             return jsonify(result), 500
+
+        if result['quality'] == PREVIEW:
+            result['full_run'] = start_full_run(app, data, client_id, result['job_id'])
             
         return jsonify(result), 200
         
@@ -87,41 +339,381 @@ def process_audio():
         logger.error(f"Error processing audio: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-def download_audio(search_query: str, output_dir: str) -> str:
-    """Download audio using yt-dlp"""
-    os.makedirs(output_dir, exist_ok=True)
-    
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'outtmpl': os.path.join(output_dir, '%(id)s.%(ext)s'),
-        'quiet': True,
-        'no_warnings': True
-    }
-    
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+def task_outcome(task) -> Tuple[str, Dict]:
+    """Final SSE event of a brokered task: done with its /process response, or error"""
+    if task is None:
+        return 'error', {'status': 'error', 'message': 'Task not found'}
+    if task.status == DONE:
+        return 'done', task.result
+    if task.status == FAILED:
+        return 'error', task.result or {'status': 'error', 'message': task.error}
+    return 'error', {'status': 'error', 'message': 'Timed out waiting for the job', 'task_id': task.task_id}
+
+def broker_wait_seconds(app) -> float:
+    return app.config['MAX_QUEUE_WAIT'] + app.scheduler.max_job_seconds
+
+def process_with_broker(app, data: Dict, client_id: str):
+    """/process through the job broker: queue the job for a worker and wait for its response"""
+    try:
+        task = app.broker.submit(data, client_id, job_cost(data, client_id))
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected job for {client_id}: {e}")
+        return rejection_response(e)
+
+    task = app.broker.wait(task.task_id, broker_wait_seconds(app), BROKER_POLL_SECONDS)
+    if task is not None and not task.terminal:
+        # Still queued or running, the client can poll it
+        return jsonify({'status': 'pending', 'task_id': task.task_id,
+                        'task_url': f"/api/audio/tasks/{task.task_id}"}), 202
+
+    event, result = task_outcome(task)
+    if event == 'error':
+        return jsonify(result), 500
+    if result.get('quality') == PREVIEW:
+        result['full_run'] = start_full_run(app, data, client_id, result['job_id'])
+    return jsonify(result), 200
+
+def sse_message(event: str, payload: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def stream_request_data() -> Optional[Dict]:
+    """/process options from a JSON body, or from the query string for EventSource (GET) clients"""
+    if request.method == 'POST':
+        return request.get_json(silent=True)
+
+    args = request.args
+    if not args:
+        return None
+
+    def flag(name: str) -> bool:
+        return args.get(name, '').lower() in ('1', 'true', 'yes')
+
+    data = {key: args[key] for key in ('artist', 'title', 'upload_id', 'pitch_tracker', 'quality') if key in args}
+    data['multitrack'] = flag('multitrack')
+    data['include_melody'] = flag('include_melody')
+    data['note_formats'] = [fmt for fmt in args.get('note_formats', '').split(',') if fmt]
+    if 'outputs' in args:
+        data['outputs'] = [name for name in args['outputs'].split(',') if name]
+    return data
+
+@audio_bp.route('/process/stream', methods=['GET', 'POST'])
+def process_audio_stream():
+    """
+    Run the same job as /process and stream results as Server-Sent Events while stages finish:
+    `queued`, then `tempo`, `stems`, `vocals`, `midi`, `multitrack`, `contour`, `tiles`,
+    and finally `done` with the full /process response (or `error`)
+    With "quality": "preview" a `preview` event with the preview's /process response comes first,
+    then the full-quality run follows under the same slot
+    """
+    logger.info("Received streaming audio processing request")
+
+    data = stream_request_data()
+    error = validate_process_request(data)
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 400
+
+    client_id = client_id_for_request()
+    preview = data.get('quality', FULL) == PREVIEW
+    full_data = {**data, 'quality': FULL}
+    if current_app.broker:
+        return stream_with_broker(data, full_data, preview, client_id)
+    try:
+        cost = job_cost(full_data, client_id) + (job_cost(data, client_id) if preview else 0.0)
+        ticket = current_app.scheduler.admit(client_id, cost)
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected job for {client_id}: {e}")
+        return rejection_response(e)
+
+    app = current_app._get_current_object()
+    events = queue.Queue()
+
+    @copy_current_request_context
+    def process_task():
+        with app.app_context():
+            try:
+                if preview:
+                    result = run_process_job(app, data)
+                    if result.get('status') == 'error':
+                        events.put(('error', result))
+                        return
+                    events.put(('preview', result))
+                result = run_process_job(app, full_data, lambda stage, event: events.put((stage, event)))
+                events.put(('error' if result.get('status') == 'error' else 'done', result))
+            finally:
+                # The job owns its slot until it finishes, even if the client went away
+                app.scheduler.release(ticket)
+                events.put(None)
+
+    def generate():
+        submitted = False
         try:
-            info = ydl.extract_info(f"ytsearch1:{search_query}", download=True)
-            if not info:
-                raise Exception("No audio found")
-            
-            video_info = info['entries'][0]
-            downloaded_file = os.path.join(output_dir, f"{video_info['id']}.mp3")
-            
-            if not os.path.exists(downloaded_file):
-                raise Exception(f"File not found at: {downloaded_file}")
-                
-            return downloaded_file
-            
-        except Exception as e:
-            logger.error(f"Download error: {e}")
-            raise
+            yield sse_message('queued', {
+                'lane': ticket.lane,
+                'estimated_wait': app.scheduler.stats()['estimated_wait'][ticket.lane]
+            })
+            if not app.scheduler.wait(ticket, app.config['MAX_QUEUE_WAIT']):
+                yield sse_message('error', {'status': 'error', 'message': 'Timed out waiting for a processing slot'})
+                return
 
-@audio_bp.route('/downloads/<filename>')
+            app.executor.submit(process_task)
+            submitted = True
+            while True:
+                try:
+                    item = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # Comment line, keeps proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+                    continue
+                if item is None:
+                    break
+                yield sse_message(*item)
+        finally:
+            if not submitted:
+                app.scheduler.release(ticket)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def relay_task(broker, task_id: str, timeout: float, stages: bool = True):
+    """SSE messages for the stage events of a brokered task until it finishes, returns the task"""
+    deadline = time.time() + timeout
+    seq = 0
+    last_sent = time.time()
+    while True:
+        # Read the state first, so every event published before the task finished is relayed
+        task = broker.get(task_id)
+        for seq, stage, event in broker.events(task_id, seq):
+            if stages:
+                yield sse_message(stage, event)
+                last_sent = time.time()
+        if task is None or task.terminal or time.time() >= deadline:
+            return task
+        if time.time() - last_sent >= SSE_KEEPALIVE_SECONDS:
+            yield ": keep-alive\n\n"
+            last_sent = time.time()
+        time.sleep(BROKER_POLL_SECONDS)
+
+def stream_with_broker(data: Dict, full_data: Dict, preview: bool, client_id: str):
+    """/process/stream through the job broker, relaying the events workers publish"""
+    app = current_app._get_current_object()
+    broker = app.broker
+    try:
+        first = data if preview else full_data
+        task = broker.submit(first, client_id, job_cost(first, client_id))
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected job for {client_id}: {e}")
+        return rejection_response(e)
+
+    def generate():
+        timeout = broker_wait_seconds(app)
+        yield sse_message('queued', {
+            'task_id': task.task_id,
+            'lane': task.lane,
+            'estimated_wait': broker.stats()['estimated_wait']
+        })
+
+        current = task
+        if preview:
+            finished = yield from relay_task(broker, current.task_id, timeout, stages=False)
+            event, result = task_outcome(finished)
+            if event == 'error':
+                yield sse_message(event, result)
+                return
+            yield sse_message('preview', result)
+            try:
+                current = broker.submit(full_data, client_id, job_cost(full_data, client_id))
+            except AdmissionRejected as e:
+                yield sse_message('error', {'status': 'error', 'message': str(e), 'retry_after': e.retry_after})
+                return
+
+        finished = yield from relay_task(broker, current.task_id, timeout)
+        yield sse_message(*task_outcome(finished))
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@sock.route('/live', bp=audio_bp)
+def live_transcription(ws):
+    """
+    Real-time pitch-to-MIDI over a WebSocket
+    Query: sample_rate (default 22050), format (f32 or s16 little-endian mono PCM), midi_min, midi_max
+    The client sends binary PCM messages, and `{"type": "end"}` to flush; the server answers with
+    `ready`, then `note_on` / `note_off` events (stream time and latency_ms) and `done` with timing stats
+    """
+    from live_transcriber import LiveTranscriber, decode_pcm, PCM_FORMATS
+
+    sample_rate = request.args.get('sample_rate', default=22050, type=int)
+    pcm_format = request.args.get('format', 'f32')
+    midi_min = request.args.get('midi_min', default=36, type=int)
+    midi_max = request.args.get('midi_max', default=84, type=int)
+    if pcm_format not in PCM_FORMATS or not 8000 <= sample_rate <= 96000 or not 0 <= midi_min < midi_max <= 127:
+        ws.send(json.dumps({'type': 'error', 'message': 'Invalid sample_rate, format or note range'}))
+        return
+
+    if not _live_sessions.acquire(blocking=False):
+        ws.send(json.dumps({'type': 'error', 'message': 'Too many live sessions'}))
+        return
+    try:
+        transcriber = LiveTranscriber(sample_rate, midi_min, midi_max)
+        ws.send(json.dumps({'type': 'ready', **transcriber.stats()}))
+        while True:
+            message = ws.receive()
+            if message is None:
+                break
+            if isinstance(message, str):
+                if json.loads(message).get('type') == 'end':
+                    for event in transcriber.flush():
+                        ws.send(json.dumps(event))
+                    ws.send(json.dumps({'type': 'done', **transcriber.stats()}))
+                    break
+                continue
+            for event in transcriber.process(decode_pcm(message, pcm_format)):
+                ws.send(json.dumps(event))
+    except ConnectionClosed:
+        logger.info("Live transcription client disconnected")
+    except Exception as e:
+        logger.error(f"Live transcription error: {e}")
+    finally:
+        _live_sessions.release()
+
+# Re-transcription parameters accepted by /retranscribe, mapped to the extractor's arguments
+HMM_PARAMETERS = {
+    'p_stay_note': 'pStayNote',
+    'p_stay_silence': 'pStaySilence',
+    'pitch_acc': 'pitchAcc',
+    'voiced_acc': 'voicedAcc',
+    'onset_acc': 'onsetAcc',
+    'spread': 'spread'
+}
+
+@audio_bp.route('/retranscribe/<job_id>', methods=['POST'])
+def retranscribe_audio(job_id):
+    """
+    Rerun only the HMM stage of a processed song with new parameters,
+    from its cached pitch, onset and RMS features
+    """
+    data = request.get_json(silent=True) or {}
+    job_id = os.path.basename(job_id)
+
+    hmm_params = {}
+    for key, name in HMM_PARAMETERS.items():
+        if key not in data:
+            continue
+        try:
+            value = float(data[key])
+        except (TypeError, ValueError):
+            value = -1.0
+        if not 0.0 <= value <= 1.0:
+            return jsonify({'status': 'error', 'message': f"'{key}' must be a number between 0 and 1"}), 400
+        hmm_params[name] = value
+
+    try:
+        from song_features_retriever import SongFeaturesRetriever
+        artifact_store = current_app.artifact_store
+        processor = SongFeaturesRetriever(current_app.config['UPLOAD_FOLDER'], artifact_store)
+
+        with artifact_store.pinned(job_id):
+            results = processor.retranscribe(job_id, data.get('note_formats') or (), **hmm_params)
+
+        response_data = {'status': 'success', **stage_event(job_id, 'midi', results)}
+        if data.get('include_melody'):
+            response_data['melody'] = results['melody'].tolist()
+        return jsonify(response_data), 200
+    except FileNotFoundError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 404
+    except Exception as e:
+        logger.error(f"Error retranscribing {job_id}: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+def upload_response(upload, status: int = 200):
+    response = jsonify({
+        'status': 'success',
+        **upload.to_dict(),
+        'chunk_size': current_app.upload_store.chunk_bytes,
+        'upload_url': f"/api/audio/uploads/{upload.upload_id}",
+        **({'job_id': job_id_for(upload.path)} if upload.complete else {})
+    })
+    # tus-style headers, so resuming clients can read the offset from a HEAD request
+    response.headers['Upload-Offset'] = str(upload.offset)
+    response.headers['Upload-Length'] = str(upload.size)
+    response.headers['Cache-Control'] = 'no-store'
+    if status == 201:
+        response.headers['Location'] = f"/api/audio/uploads/{upload.upload_id}"
+    return response, status
+
+def upload_error_response(e: UploadError):
+    response = jsonify({'status': 'error', 'message': str(e), 'offset': e.offset})
+    if e.offset is not None:
+        response.headers['Upload-Offset'] = str(e.offset)
+    return response, e.status
+
+@audio_bp.route('/uploads', methods=['POST'])
+def create_upload():
+    """
+    Start a resumable upload: JSON with `filename`, `size` in bytes and optionally the file's `sha256`
+    The file is then sent with PATCH requests at the current offset, in chunks of at most `chunk_size`
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = current_app.upload_store.create(data.get('filename'), data.get('size'),
+                                                 client_id_for_request(), data.get('sha256'))
+        return upload_response(upload, 201)
+    except UploadError as e:
+        return upload_error_response(e)
+
+@audio_bp.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """Upload progress, also answers HEAD so clients can find where to resume"""
+    upload = current_app.upload_store.get(os.path.basename(upload_id))
+    if upload is None:
+        return upload_error_response(UploadError(f"Upload not found: {upload_id}", status=404))
+    return upload_response(upload)
+
+@audio_bp.route('/uploads/<upload_id>', methods=['PATCH'])
+def append_upload(upload_id):
+    """
+    Append the request body at `Upload-Offset`, streamed to disk as it arrives
+    An optional `Upload-Checksum: sha256 <base64>` header verifies the chunk, a mismatch answers 460
+    On a 409 or an interrupted chunk, resume from the offset in the response
+    Once the last byte arrives the file is verified and can be processed with /process {"upload_id": ...}
+    """
+    store = current_app.upload_store
+    try:
+        offset = request.headers.get('Upload-Offset', type=int)
+        if offset is None:
+            raise UploadError("Upload-Offset header required")
+        checksum = parse_checksum(request.headers.get('Upload-Checksum'))
+
+        # Chunks are bounded by the upload's size, not the app-wide request limit
+        request.max_content_length = store.max_upload_bytes
+        upload = store.append(os.path.basename(upload_id), offset, request.stream, request.content_length, checksum)
+        if upload.complete:
+            current_app.artifact_store.register(upload.path, job_id_for(upload.path))
+        return upload_response(upload)
+    except UploadError as e:
+        logger.warning(f"Upload {upload_id} chunk rejected: {e}")
+        return upload_error_response(e)
+
+@audio_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+def delete_upload(upload_id):
+    current_app.upload_store.abort(os.path.basename(upload_id))
+    return '', 204
+
+def download_audio(artist: str, title: str, output_dir: str) -> str:
+    """Resolve a song to a local audio file through the app's download cache"""
+    os.makedirs(output_dir, exist_ok=True)
+
+    try:
+        return current_app.download_cache.resolve(artist, title, output_dir)
+    except Exception as e:
+        logger.error(f"Download error: {e}")
+        raise
+
+@audio_bp.route('/downloads/<path:filename>')
 @cross_origin()
 def download_file(filename):
     try:
@@ -130,12 +722,14 @@ def download_file(filename):
         
         # check in processed directory
         if os.path.exists(os.path.join(processed_dir, filename)):
+            current_app.artifact_store.touch(os.path.join(processed_dir, filename))
             response = send_from_directory(
                 processed_dir,
                 filename,
                 as_attachment=True
             )
         elif os.path.exists(os.path.join(upload_dir, filename)):
+            current_app.artifact_store.touch(os.path.join(upload_dir, filename))
             response = send_from_directory(
                 upload_dir,
                 filename,
@@ -156,13 +750,134 @@ def download_file(filename):
         logger.error(f"Error downloading file: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@audio_bp.route('/contour/<job_id>/<filename>')
+@cross_origin()
+def get_contour(job_id, filename):
+    """Serve a melody contour, optionally restricted to ?start=&end= seconds and reduced to ?points="""
+    try:
+        contour_path = os.path.join(current_app.config['PROCESSED_DIR'],
+                                    os.path.basename(job_id),
+                                    os.path.basename(filename))
+        if not os.path.exists(contour_path):
+            logger.error(f"Contour not found: {filename}")
+            return jsonify({
+                'status': 'error',
+                'message': f'Contour not found: {filename}'
+            }), 404
+
+        start = request.args.get('start', type=float)
+        end = request.args.get('end', type=float)
+        points = request.args.get('points', type=int)
+
+        current_app.artifact_store.touch(contour_path)
+        values, step, _ = load_contour(contour_path)
+        values, step, start = slice_contour(values, step, start, end, points)
+
+        if request.args.get('format') == 'json':
+            return jsonify(values.tolist())
+
+        compress = request.args.get('compress', '1') != '0'
+        return Response(encode_contour(values, step, start, compress), mimetype=CONTOUR_CONTENT_TYPE)
+    except Exception as e:
+        logger.error(f"Error serving contour: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@audio_bp.route('/tiles/peaks/<job_id>/<stem>')
+@cross_origin()
+def get_peak_tile(job_id, stem):
+    """Serve waveform peaks of a stem for ?start=&end= seconds at ?level= (or the level fitting ?points=)"""
+    try:
+        output_dir = os.path.join(current_app.config['PROCESSED_DIR'], os.path.basename(job_id))
+        path = peaks_path(output_dir, os.path.basename(stem))
+        if not os.path.exists(path):
+            return jsonify({'status': 'error', 'message': f'Peaks not found: {stem}'}), 404
+        current_app.artifact_store.touch(path)
+
+        tile = peak_tile(
+            path,
+            start=request.args.get('start', type=float),
+            end=request.args.get('end', type=float),
+            level=request.args.get('level', type=int),
+            points=request.args.get('points', default=2048, type=int)
+        )
+        return jsonify({'status': 'success', **tile})
+    except Exception as e:
+        logger.error(f"Error serving peak tile: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@audio_bp.route('/tiles/notes/<job_id>')
+@cross_origin()
+def get_notes_tile(job_id):
+    """Serve transcribed notes overlapping ?start=&end= seconds"""
+    try:
+        path = notes_index_path(os.path.join(current_app.config['PROCESSED_DIR'], os.path.basename(job_id)))
+        if not os.path.exists(path):
+            return jsonify({'status': 'error', 'message': 'Notes index not found'}), 404
+        current_app.artifact_store.touch(path)
+
+        tile = notes_tile(
+            path,
+            start=request.args.get('start', type=float),
+            end=request.args.get('end', type=float)
+        )
+        return jsonify({'status': 'success', **tile})
+    except Exception as e:
+        logger.error(f"Error serving notes tile: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@audio_bp.route('/jobs/<job_id>')
+@cross_origin()
+def get_full_run(job_id):
+    """State of the full-quality run behind a preview: queued, running, done or failed, with its /process result"""
+    with _full_runs_lock:
+        state = _full_runs.get(os.path.basename(job_id))
+    if state is None:
+        return jsonify({'status': 'error', 'message': f'No full run tracked for {job_id}'}), 404
+
+    # Runs handed to the broker are followed there
+    if state.get('task_id') and current_app.broker:
+        task = current_app.broker.get(state['task_id'])
+        if task is not None:
+            state = {**state, 'state': RUN_STATES[task.status]}
+            if task.terminal:
+                state['result'] = task_outcome(task)[1]
+    return jsonify({'status': 'success', **state})
+
+@audio_bp.route('/tasks/<task_id>')
+@cross_origin()
+def get_task(task_id):
+    """State of a job queued on the broker, with its /process response once a worker finished it"""
+    broker = current_app.broker
+    task = broker.get(os.path.basename(task_id)) if broker else None
+    if task is None:
+        return jsonify({'status': 'error', 'message': f'Task not found: {task_id}'}), 404
+    return jsonify({'status': 'success', **task.to_dict()})
+
+@audio_bp.route('/queue')
+@cross_origin()
+def get_queue():
+    """Scheduler load: running and queued jobs per lane and the estimated wait (the broker's, when jobs go to workers)"""
+    if current_app.broker:
+        return jsonify({'status': 'success', **current_app.broker.stats()})
+    return jsonify({'status': 'success', **current_app.scheduler.stats()})
+
+@audio_bp.route('/metrics')
+@cross_origin()
+def get_metrics():
+    """Worker memory (RSS, per-job peaks, cache sizes) and scheduler load (the broker's, when jobs go to workers)"""
+    broker = current_app.broker
+    return jsonify({
+        'status': 'success',
+        'memory': memory_metrics.to_dict(),
+        'queue': broker.stats() if broker else current_app.scheduler.stats()
+    })
+
 @audio_bp.route('/cleanup', methods=['POST'])
 def cleanup_files():
+    """Ask the artifact GC to drop every file not owned by an in-flight job, without waiting for it"""
     try:
-        with current_app.app_context():
-            processor = SongFeaturesRetriever(current_app.config['UPLOAD_FOLDER'])
-            processor.cleanup()
-            return jsonify({'status': 'success', 'message': 'Cleanup completed'})
+        current_app.artifact_store.request_clear()
+        return jsonify({'status': 'success', 'message': 'Cleanup scheduled'}), 202
     except Exception as e:
         logger.error(f"Error during cleanup: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
\ No newline at end of file
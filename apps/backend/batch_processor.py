@@ -0,0 +1,325 @@
+import os
+import csv
+import sys
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import multiprocessing
+import concurrent.futures
+from typing import Dict, Iterator, List, Optional
+from audio_fetcher import DownloadCache, YtDlpFetcher, LocalFetcher, normalize_key, audio_duration
+from pitch_trackers import PITCH_TRACKERS, DEFAULT_PITCH_TRACKER
+from memory_guard import metrics as memory_metrics
+
+logger = logging.getLogger(__name__)
+
+# Same root the API serves from, so batch outputs land in processed_audio/<job_id>
+DEFAULT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp', 'uploads')
+JOURNAL_FILE = 'batch_journal.db'
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Per-process pipeline, built once per worker so models and JIT caches stay warm across items
+_processor = None
+
+
+def read_manifest(path: str) -> Iterator[Dict[str, str]]:
+    """
+    Items of a manifest, each with either a local 'path' or an 'artist' and 'title'
+    .jsonl: one JSON object per line, .csv: a header with path or artist,title columns,
+    anything else: one local audio path per line
+    """
+    with open(path, 'r', newline='') as infile:
+        if path.endswith('.jsonl'):
+            rows = (json.loads(line) for line in infile if line.strip())
+        elif path.endswith('.csv'):
+            rows = csv.DictReader(infile)
+        else:
+            rows = ({'path': line.strip()} for line in infile if line.strip() and not line.startswith('#'))
+
+        for row in rows:
+            if row.get('path'):
+                yield {'path': os.path.abspath(row['path'])}
+            elif row.get('artist') and row.get('title'):
+                yield {'artist': row['artist'], 'title': row['title']}
+            else:
+                logger.warning(f"Skipping manifest row without path or artist/title: {row}")
+
+
+def item_key(item: Dict[str, str]) -> str:
+    return item['path'] if 'path' in item else normalize_key(item['artist'], item['title'])
+
+
+class BatchJournal:
+    """Per-item checkpoints of a batch run in SQLite, so an interrupted run resumes where it stopped"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS items (
+                    key TEXT PRIMARY KEY,
+                    position INTEGER NOT NULL,
+                    source TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    job_id TEXT,
+                    error TEXT,
+                    seconds REAL,
+                    audio_seconds REAL,
+                    updated REAL NOT NULL
+                )
+            """)
+
+    def add(self, items: List[Dict[str, str]]) -> int:
+        """Add manifest items not journaled yet, returns how many were new"""
+        start = self._db.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM items").fetchone()[0]
+        now = time.time()
+        with self._db:
+            cursor = self._db.executemany(
+                "INSERT OR IGNORE INTO items (key, position, source, status, updated) VALUES (?, ?, ?, ?, ?)",
+                [(item_key(item), start + i, json.dumps(item), PENDING, now) for i, item in enumerate(items)]
+            )
+        return cursor.rowcount
+
+    def reset(self, retry_failed: bool = False) -> None:
+        """Items left running by a crashed run (and optionally failed ones) go back to pending"""
+        statuses = (RUNNING, FAILED) if retry_failed else (RUNNING,)
+        with self._db:
+            self._db.execute(
+                f"UPDATE items SET status = ?, attempts = 0 WHERE status IN ({','.join('?' * len(statuses))})",
+                (PENDING, *statuses)
+            )
+
+    def pending(self) -> List[Dict]:
+        rows = self._db.execute(
+            "SELECT key, source, attempts FROM items WHERE status = ? ORDER BY position", (PENDING,)
+        ).fetchall()
+        return [{'key': key, 'item': json.loads(source), 'attempts': attempts} for key, source, attempts in rows]
+
+    def mark(self, key: str, status: str, **fields) -> None:
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with self._db:
+            self._db.execute(
+                f"UPDATE items SET status = ?, updated = ?{', ' + assignments if assignments else ''} WHERE key = ?",
+                (status, time.time(), *fields.values(), key)
+            )
+
+    def start(self, key: str) -> None:
+        with self._db:
+            self._db.execute("UPDATE items SET status = ?, attempts = attempts + 1, updated = ? WHERE key = ?",
+                             (RUNNING, time.time(), key))
+
+    def counts(self) -> Dict[str, int]:
+        counts = {status: 0 for status in (PENDING, RUNNING, DONE, FAILED)}
+        counts.update(self._db.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall())
+        return counts
+
+    def failures(self) -> List[Dict]:
+        rows = self._db.execute(
+            "SELECT key, attempts, error FROM items WHERE status = ? ORDER BY position", (FAILED,)
+        ).fetchall()
+        return [{'key': key, 'attempts': attempts, 'error': error} for key, attempts, error in rows]
+
+
+def _init_worker(log_level: int) -> None:
+    logging.basicConfig(level=log_level)
+
+
+def _process_item(root: str, audio_path: str, options: Dict) -> Dict:
+    """Run the full pipeline on one song inside a worker process"""
+    global _processor
+    if _processor is None:
+        from song_features_retriever import SongFeaturesRetriever
+        _processor = SongFeaturesRetriever(root)
+
+    start = time.perf_counter()
+    results = _processor.process_song(audio_path, **options)
+    return {
+        'job_id': results['job_id'],
+        'seconds': time.perf_counter() - start,
+        'audio_seconds': audio_duration(audio_path),
+        'peak_rss_mb': results['memory']['peak_rss_mb'],
+        'recycle': memory_metrics.recycle_reason is not None
+    }
+
+
+def _format_seconds(seconds: float) -> str:
+    hours, remainder = divmod(int(seconds), 3600)
+    return f"{hours}:{remainder // 60:02d}:{remainder % 60:02d}"
+
+
+def run_batch(manifest_path: str,
+              root: str = DEFAULT_ROOT,
+              journal_path: Optional[str] = None,
+              workers: int = 1,
+              retries: int = 1,
+              retry_failed: bool = False,
+              local_audio_dir: Optional[str] = None,
+              options: Optional[Dict] = None) -> Dict[str, int]:
+    """
+    Process every manifest item not already done, checkpointing each one in the journal
+    Downloads run in this process (one download cache), pipelines on a spawned process pool
+    Failed items are retried up to `retries` more times within the run
+    """
+    os.makedirs(root, exist_ok=True)
+    journal = BatchJournal(journal_path or os.path.join(root, JOURNAL_FILE))
+    added = journal.add(list(read_manifest(manifest_path)))
+    journal.reset(retry_failed)
+
+    queue = journal.pending()
+    logger.info(f"Manifest {manifest_path}: {added} new items, {len(queue)} to process, journal {journal.path}")
+    if not queue:
+        return journal.counts()
+
+    fetcher = LocalFetcher(local_audio_dir) if local_audio_dir else YtDlpFetcher()
+    download_cache = DownloadCache(os.path.join(root, 'download_cache.json'), fetcher)
+
+    def new_pool() -> concurrent.futures.ProcessPoolExecutor:
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(logging.getLogger().level,)
+        )
+
+    pool = new_pool()
+    recycle = False
+    in_flight = {}
+    total = len(queue)
+    completed = 0
+    succeeded = 0
+    audio_done = 0.0
+    started = time.time()
+
+    def fail(key: str, attempts: int, item: Dict, error: str) -> bool:
+        """Requeue a failed item while it has attempts left, returns whether it is finished"""
+        if attempts <= retries:
+            logger.warning(f"{key} failed (attempt {attempts}), retrying: {error}")
+            journal.mark(key, PENDING, error=error)
+            queue.append({'key': key, 'item': item, 'attempts': attempts})
+            return False
+        logger.error(f"{key} failed after {attempts} attempts: {error}")
+        journal.mark(key, FAILED, error=error)
+        return True
+
+    try:
+        while queue or in_flight:
+            # A worker over its memory limit: drain the pool, then start fresh workers
+            if recycle and not in_flight:
+                logger.warning("Recycling batch workers after a memory limit was crossed")
+                pool.shutdown(wait=True)
+                pool = new_pool()
+                recycle = False
+
+            # Keep the pool busy, downloading the next items while the current ones process
+            while queue and not recycle and len(in_flight) < workers * 2:
+                entry = queue.pop(0)
+                key, item = entry['key'], entry['item']
+                journal.start(key)
+                attempts = entry['attempts'] + 1
+                try:
+                    audio_path = item['path'] if 'path' in item else \
+                        download_cache.resolve(item['artist'], item['title'], root)
+                except Exception as e:
+                    completed += fail(key, attempts, item, f"Download failed: {e}")
+                    continue
+                future = pool.submit(_process_item, root, audio_path, options or {})
+                in_flight[future] = (key, attempts, item)
+
+            if not in_flight:
+                continue
+
+            done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                key, attempts, item = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # A worker killed (e.g. by the OOM killer) breaks the whole pool, start a new one
+                    recycle = recycle or isinstance(e, concurrent.futures.BrokenExecutor)
+                    completed += fail(key, attempts, item, str(e).splitlines()[0] if str(e) else repr(e))
+                    continue
+
+                journal.mark(key, DONE, job_id=result['job_id'], error=None,
+                             seconds=result['seconds'], audio_seconds=result['audio_seconds'])
+                completed += 1
+                succeeded += 1
+                audio_done += result['audio_seconds'] or 0.0
+                recycle = recycle or result['recycle']
+
+                elapsed = time.time() - started
+                rate = completed / elapsed
+                eta = (total - completed) / rate if rate else 0
+                logger.info(f"[{completed}/{total}] {key} -> {result['job_id']} in {result['seconds']:.1f} s, "
+                            f"peak {result['peak_rss_mb']:.0f} MB | "
+                            f"{rate * 60:.2f} songs/min, {audio_done / max(elapsed, 1e-9):.2f}x realtime, "
+                            f"ETA {_format_seconds(eta)}")
+    except KeyboardInterrupt:
+        logger.warning("Interrupted, in-flight items will be retried on the next run")
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown(wait=True)
+
+    counts = journal.counts()
+    logger.info(f"Batch finished: {succeeded} processed this run in {_format_seconds(time.time() - started)}, "
+                f"{counts}")
+    return counts
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Process a manifest of songs into the API's artifact layout")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Process a manifest, resuming from the journal")
+    run_parser.add_argument('manifest', help=".txt (paths), .csv or .jsonl (path or artist/title)")
+    run_parser.add_argument('--root', default=DEFAULT_ROOT, help="Artifact root, the API's upload folder")
+    run_parser.add_argument('--journal', help=f"SQLite journal (default <root>/{JOURNAL_FILE})")
+    run_parser.add_argument('--workers', type=int, default=max((os.cpu_count() or 2) // 2, 1))
+    run_parser.add_argument('--retries', type=int, default=1, help="Extra attempts per failed item in this run")
+    run_parser.add_argument('--retry-failed', action='store_true', help="Retry items failed in earlier runs")
+    run_parser.add_argument('--local-audio-dir', default=os.getenv('LOCAL_AUDIO_DIR'),
+                            help="Resolve artist/title from local files instead of YouTube")
+    run_parser.add_argument('--pitch-tracker', choices=sorted(PITCH_TRACKERS), default=DEFAULT_PITCH_TRACKER)
+    run_parser.add_argument('--multitrack', action='store_true')
+    run_parser.add_argument('--note-formats', default='', help="Comma separated: json,bin")
+
+    status_parser = subparsers.add_parser('status', help="Show journal progress and failures")
+    status_parser.add_argument('--root', default=DEFAULT_ROOT)
+    status_parser.add_argument('--journal')
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command == 'status':
+        journal = BatchJournal(args.journal or os.path.join(args.root, JOURNAL_FILE))
+        print(json.dumps(journal.counts()))
+        for failure in journal.failures():
+            print(f"{failure['key']} ({failure['attempts']} attempts): {failure['error']}")
+        return 0
+
+    counts = run_batch(
+        args.manifest,
+        root=args.root,
+        journal_path=args.journal,
+        workers=args.workers,
+        retries=args.retries,
+        retry_failed=args.retry_failed,
+        local_audio_dir=args.local_audio_dir,
+        options={
+            'pitch_tracker': args.pitch_tracker,
+            'multitrack': args.multitrack,
+            'note_formats': [fmt for fmt in args.note_formats.split(',') if fmt]
+        }
+    )
+    return 1 if counts[FAILED] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+import time
+import sqlite3
+import logging
+import threading
+import numpy as np
+import librosa
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from scipy.ndimage import maximum_filter
+
+logger = logging.getLogger(__name__)
+
+# Fingerprints are taken from a mono 11025 Hz decode, so container, bitrate and channel layout don't matter
+FINGERPRINT_SR = 11025
+N_FFT = 1024
+HOP_LENGTH = 256
+HOP_SECONDS = HOP_LENGTH / FINGERPRINT_SR
+
+# Constellation: spectral peaks that dominate their neighborhood, at most PEAKS_PER_SECOND on average
+PEAK_NEIGHBORHOOD = (21, 21)
+PEAKS_PER_SECOND = 30
+MIN_PEAK_DB = -60.0
+
+# Each anchor peak is paired with the next FAN_OUT peaks less than 64 frames later
+FAN_OUT = 5
+MAX_DELTA_FRAMES = 63
+FREQ_BITS = 9
+DELTA_BITS = 6
+
+# A match is confident when enough hashes agree on one time offset: unrelated recordings
+# rarely line up more than a handful, while a re-encode keeps dozens even under heavy noise
+MIN_MATCHES = 20
+MIN_SCORE = 0.003
+
+
+@dataclass
+class Fingerprint:
+    hashes: np.ndarray
+    offsets: np.ndarray
+    duration: float
+
+
+@dataclass
+class FingerprintMatch:
+    """A previously processed recording; query time 0 is at `offset` seconds of the reference"""
+    job_id: str
+    matched: int
+    score: float
+    offset: float
+    duration: float
+
+    @property
+    def confident(self) -> bool:
+        return self.matched >= MIN_MATCHES and self.score >= MIN_SCORE
+
+
+def fingerprint_audio(audio: np.ndarray, sr: int = FINGERPRINT_SR) -> Fingerprint:
+    """Peak-pair hashes (f1, f2, dt) with their anchor frame, as in landmark-based audio fingerprinting"""
+    if sr != FINGERPRINT_SR:
+        audio = librosa.resample(audio, orig_sr=sr, target_sr=FINGERPRINT_SR)
+    duration = len(audio) / FINGERPRINT_SR
+
+    spectrum = np.abs(librosa.stft(audio, n_fft=N_FFT, hop_length=HOP_LENGTH))
+    spectrum_db = librosa.amplitude_to_db(spectrum, ref=np.max)
+
+    peaks = (spectrum_db == maximum_filter(spectrum_db, size=PEAK_NEIGHBORHOOD)) & (spectrum_db > MIN_PEAK_DB)
+    freqs, frames = np.nonzero(peaks)
+    strengths = spectrum_db[freqs, frames]
+
+    # Keep the strongest peaks, then restore time order
+    limit = max(int(PEAKS_PER_SECOND * duration), 1)
+    if len(frames) > limit:
+        strongest = np.argpartition(strengths, -limit)[-limit:]
+        freqs, frames = freqs[strongest], frames[strongest]
+    order = np.lexsort((freqs, frames))
+    freqs = np.minimum(freqs[order], (1 << FREQ_BITS) - 1)
+    frames = frames[order]
+
+    hashes = []
+    offsets = []
+    for k in range(1, FAN_OUT + 1):
+        anchor_freqs, target_freqs = freqs[:-k], freqs[k:]
+        anchors = frames[:-k]
+        deltas = frames[k:] - anchors
+        valid = (deltas >= 1) & (deltas <= MAX_DELTA_FRAMES)
+        hashes.append((anchor_freqs[valid].astype(np.int64) << (FREQ_BITS + DELTA_BITS))
+                      | (target_freqs[valid].astype(np.int64) << DELTA_BITS)
+                      | deltas[valid])
+        offsets.append(anchors[valid])
+
+    return Fingerprint(np.concatenate(hashes), np.concatenate(offsets).astype(np.int64), duration)
+
+
+def fingerprint_file(audio_path: str) -> Fingerprint:
+    return fingerprint_audio(librosa.load(audio_path, sr=FINGERPRINT_SR, mono=True)[0])
+
+
+class FingerprintIndex:
+    """Inverted index from peak-pair hash to (track, anchor frame), stored in SQLite"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS tracks (
+                    track_id INTEGER PRIMARY KEY,
+                    job_id TEXT UNIQUE NOT NULL,
+                    duration REAL NOT NULL,
+                    hashes INTEGER NOT NULL,
+                    created REAL NOT NULL
+                )
+            """)
+            self._db.execute("CREATE TABLE IF NOT EXISTS hashes (hash INTEGER NOT NULL, track_id INTEGER NOT NULL, "
+                             "offset INTEGER NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS hashes_hash ON hashes (hash)")
+
+    def add(self, job_id: str, fingerprint: Fingerprint) -> None:
+        """Index a processed recording, replacing any earlier fingerprint of the same job"""
+        pairs = np.unique(np.column_stack((fingerprint.hashes, fingerprint.offsets)), axis=0)
+        with self._lock, self._db:
+            self._remove(job_id)
+            track_id = self._db.execute(
+                "INSERT INTO tracks (job_id, duration, hashes, created) VALUES (?, ?, ?, ?)",
+                (job_id, fingerprint.duration, len(pairs), time.time())
+            ).lastrowid
+            self._db.executemany(
+                "INSERT INTO hashes (hash, track_id, offset) VALUES (?, ?, ?)",
+                ((int(h), track_id, int(o)) for h, o in pairs)
+            )
+        logger.info(f"Fingerprinted {job_id}: {len(pairs)} hashes")
+
+    def _remove(self, job_id: str) -> None:
+        row = self._db.execute("SELECT track_id FROM tracks WHERE job_id = ?", (job_id,)).fetchone()
+        if row:
+            self._db.execute("DELETE FROM hashes WHERE track_id = ?", row)
+            self._db.execute("DELETE FROM tracks WHERE track_id = ?", row)
+
+    def remove(self, job_id: str) -> None:
+        with self._lock, self._db:
+            self._remove(job_id)
+
+    def _lookup(self, hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        with self._lock:
+            self._db.execute("CREATE TEMP TABLE IF NOT EXISTS query (hash INTEGER PRIMARY KEY)")
+            self._db.execute("DELETE FROM query")
+            self._db.executemany("INSERT INTO query (hash) VALUES (?)", ((int(h),) for h in hashes))
+            rows = self._db.execute(
+                "SELECT h.hash, h.track_id, h.offset FROM hashes h JOIN query q ON h.hash = q.hash"
+            ).fetchall()
+            self._db.execute("DELETE FROM query")
+        if not rows:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty
+        return tuple(np.array(column, dtype=np.int64) for column in zip(*rows))
+
+    def match(self, fingerprint: Fingerprint, candidates: int = 5) -> List[FingerprintMatch]:
+        """Indexed recordings sharing hashes with the query, best aligned first"""
+        if not len(fingerprint.hashes):
+            return []
+
+        order = np.argsort(fingerprint.hashes, kind='stable')
+        query_hashes = fingerprint.hashes[order]
+        query_offsets = fingerprint.offsets[order]
+
+        db_hashes, db_tracks, db_offsets = self._lookup(np.unique(query_hashes))
+        if not len(db_hashes):
+            return []
+
+        # Expand every indexed hash against each query occurrence of it, keeping the time difference
+        left = np.searchsorted(query_hashes, db_hashes, side='left')
+        counts = np.searchsorted(query_hashes, db_hashes, side='right') - left
+        total = int(counts.sum())
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        query_index = np.repeat(left, counts) + np.arange(total) - starts
+        tracks = np.repeat(db_tracks, counts)
+        deltas = np.repeat(db_offsets, counts) - query_offsets[query_index]
+
+        track_ids, track_hits = np.unique(tracks, return_counts=True)
+        matches = []
+        for track_id in track_ids[np.argsort(-track_hits)][:candidates]:
+            track_deltas = deltas[tracks == track_id]
+            lowest = track_deltas.min()
+            histogram = np.bincount(track_deltas - lowest)
+            # Tolerate a frame of jitter between encodes
+            smoothed = np.convolve(histogram, np.ones(3, dtype=np.int64), mode='same')
+            best = int(np.argmax(smoothed))
+            with self._lock:
+                job_id, duration = self._db.execute(
+                    "SELECT job_id, duration FROM tracks WHERE track_id = ?", (int(track_id),)
+                ).fetchone()
+            matches.append(FingerprintMatch(
+                job_id=job_id,
+                matched=int(smoothed[best]),
+                score=float(smoothed[best]) / len(fingerprint.hashes),
+                offset=float(best + lowest) * HOP_SECONDS,
+                duration=duration
+            ))
+        return sorted(matches, key=lambda m: -m.matched)
+
+    def best_match(self, fingerprint: Fingerprint, exclude: Optional[str] = None) -> Optional[FingerprintMatch]:
+        """The best confident match other than `exclude`, if any"""
+        for match in self.match(fingerprint):
+            if match.job_id != exclude and match.confident:
+                return match
+        return None
@@ -0,0 +1,486 @@
+import os
+import json
+import math
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from job_scheduler import AdmissionRejected, INTERACTIVE, BULK, LANES
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+DEFAULT_LEASE_SECONDS = 60.0
+DEFAULT_MAX_ATTEMPTS = 3
+# Finished tasks and their events are kept this long for clients polling their results
+RESULT_TTL_SECONDS = 24 * 3600
+# Workers not seen for this many lease periods are dropped from the stats
+WORKER_STALE_LEASES = 3
+
+
+def worker_name() -> str:
+    """Default worker id, unique per process"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+@dataclass
+class BrokerTask:
+    task_id: str
+    payload: Dict
+    client_id: str
+    cost: float
+    lane: str
+    status: str
+    attempts: int
+    worker_id: Optional[str] = None
+    job_id: Optional[str] = None
+    result: Optional[Dict] = None
+    error: Optional[str] = None
+    created: float = 0.0
+    started: Optional[float] = None
+    finished: Optional[float] = None
+
+    @property
+    def terminal(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self) -> Dict:
+        task = asdict(self)
+        task.pop('payload')
+        task['state'] = task.pop('status')
+        return task
+
+
+class JobBroker(ABC):
+    """
+    Hands /process jobs from the API tier to separately scaled worker processes
+    Workers claim a task under a lease and keep it alive with heartbeats; a task whose lease runs out
+    (its worker died or hung) goes back to the queue until it has used up its attempts
+    Outputs are not moved through the broker: workers write them to the shared artifact store
+    and the result only carries their URLs
+    """
+
+    lease_seconds = DEFAULT_LEASE_SECONDS
+    _sweeper: Optional[threading.Thread] = None
+
+    @abstractmethod
+    def submit(self, payload: Dict, client_id: str, cost: float) -> BrokerTask:
+        """Queue a job or raise AdmissionRejected"""
+
+    @abstractmethod
+    def check_admission(self, client_id: str) -> None:
+        """Raise AdmissionRejected when submit would turn away a job of this client whatever its cost"""
+
+    @abstractmethod
+    def claim(self, worker_id: str) -> Optional[BrokerTask]:
+        """Lease the next task, interactive lane first and FIFO within a lane, None if no queued task may start"""
+
+    @abstractmethod
+    def heartbeat(self, task_id: str, worker_id: str, job_id: Optional[str] = None) -> bool:
+        """Extend the lease (and record the job the task resolved to), False if the worker lost it"""
+
+    @abstractmethod
+    def publish(self, task_id: str, worker_id: str, stage: str, event: Dict) -> bool:
+        """Record a stage event for clients streaming the task, False (and dropped) if the worker lost the lease"""
+
+    @abstractmethod
+    def events(self, task_id: str, after: int = 0) -> List[Tuple[int, str, Dict]]:
+        """
+        (sequence, stage, event) published after the given sequence number, by the task's current attempt
+        A requeued task starts with a 'requeued' event, the stages of earlier attempts are dropped
+        """
+
+    @abstractmethod
+    def complete(self, task_id: str, worker_id: str, result: Dict) -> bool:
+        """Store the result of a leased task, False if the lease was lost (the result is then dropped)"""
+
+    @abstractmethod
+    def fail(self, task_id: str, worker_id: str, error: str, result: Optional[Dict] = None) -> bool:
+        """Mark a leased task failed with its error (and partial result), False if the lease was lost"""
+
+    @abstractmethod
+    def get(self, task_id: str) -> Optional[BrokerTask]:
+        """The task's current state, None if it is unknown or was purged"""
+
+    @abstractmethod
+    def expire_leases(self) -> int:
+        """Requeue (or fail, once out of attempts) tasks whose lease ran out, returns how many"""
+
+    @abstractmethod
+    def active_job_ids(self) -> Set[str]:
+        """Jobs being processed by any worker, so no artifact store collects their files"""
+
+    @abstractmethod
+    def stats(self) -> Dict:
+        """Queue depth per lane, running and finished tasks, live workers and the estimated wait"""
+
+    def _sweep(self, interval: float, stop: threading.Event) -> None:
+        while not stop.wait(interval):
+            try:
+                self.expire_leases()
+            except Exception as e:
+                logger.error(f"Lease sweep error: {e}")
+
+    def start_sweeper(self, interval: Optional[float] = None) -> threading.Thread:
+        """
+        Expire leases in the background (every half lease by default), so a dead worker's task is
+        retried even while nothing is submitted or claimed
+        """
+        if self._sweeper is None or not self._sweeper.is_alive():
+            self._sweeper_stop = threading.Event()
+            self._sweeper = threading.Thread(target=self._sweep, args=(interval or self.lease_seconds / 2,
+                                                                       self._sweeper_stop),
+                                             name='broker-sweeper', daemon=True)
+            self._sweeper.start()
+        return self._sweeper
+
+    def stop_sweeper(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper_stop.set()
+
+    def wait(self, task_id: str, timeout: Optional[float] = None, poll: float = 0.5) -> Optional[BrokerTask]:
+        """Poll until the task finishes, returns it (or its current state when the timeout passes)"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            task = self.get(task_id)
+            if task is None or task.terminal or (deadline is not None and time.time() >= deadline):
+                return task
+            time.sleep(poll)
+
+
+class SqliteBroker(JobBroker):
+    """
+    Single-machine broker in one SQLite file, shared by the API and worker processes
+    Claims run in an immediate transaction, so two workers never lease the same task, and apply the
+    in-process scheduler's rules across workers: each client runs at most running_per_client jobs at once,
+    and bulk jobs leave reserved_interactive of the live worker slots to the interactive lane
+    """
+
+    def __init__(self,
+                 path: str,
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 max_queue: int = 64,
+                 max_per_client: int = 4,
+                 running_per_client: int = 1,
+                 reserved_interactive: int = 1,
+                 short_job_seconds: float = 120.0,
+                 max_job_seconds: float = 3600.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.max_queue = max_queue
+        self.max_per_client = max_per_client
+        self.running_per_client = running_per_client
+        self.reserved_interactive = reserved_interactive
+        self.short_job_seconds = short_job_seconds
+        self.max_job_seconds = max_job_seconds
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit, transactions are opened explicitly so claims can take the write lock up front
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                client_id TEXT NOT NULL,
+                cost REAL NOT NULL,
+                lane INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker_id TEXT,
+                lease_expires REAL,
+                job_id TEXT,
+                result TEXT,
+                error TEXT,
+                created REAL NOT NULL,
+                started REAL,
+                finished REAL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, lane, created)")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                event TEXT NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS events_task ON events (task_id, seq)")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS workers (
+                worker_id TEXT PRIMARY KEY,
+                last_seen REAL NOT NULL,
+                task_id TEXT
+            )
+        """)
+
+    @contextmanager
+    def _transaction(self, immediate: bool = False) -> Iterator[None]:
+        """One transaction at a time per connection, immediate ones take SQLite's write lock up front"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _task(self, row) -> BrokerTask:
+        (task_id, payload, client_id, cost, lane, status, attempts, worker_id,
+         job_id, result, error, created, started, finished) = row
+        return BrokerTask(
+            task_id=task_id,
+            payload=json.loads(payload),
+            client_id=client_id,
+            cost=cost,
+            lane=LANES[lane],
+            status=status,
+            attempts=attempts,
+            worker_id=worker_id,
+            job_id=job_id,
+            result=json.loads(result) if result else None,
+            error=error,
+            created=created,
+            started=started,
+            finished=finished
+        )
+
+    _COLUMNS = ("task_id, payload, client_id, cost, lane, status, attempts, worker_id, "
+                "job_id, result, error, created, started, finished")
+
+    def _expire_leases(self, now: float) -> int:
+        """Requeue tasks whose worker stopped heartbeating, or fail them once out of attempts"""
+        expired = self._db.execute(
+            "SELECT task_id, worker_id, attempts FROM tasks WHERE status = ? AND lease_expires < ?", (LEASED, now)
+        ).fetchall()
+        for task_id, worker_id, attempts in expired:
+            if attempts < self.max_attempts:
+                logger.warning(f"Lease of task {task_id} held by {worker_id} expired, requeueing "
+                               f"(attempt {attempts} of {self.max_attempts})")
+                self._db.execute("UPDATE tasks SET status = ?, worker_id = NULL, lease_expires = NULL "
+                                 "WHERE task_id = ?", (QUEUED, task_id))
+                # The next attempt starts over, clients joining later only see its stages
+                self._db.execute("DELETE FROM events WHERE task_id = ?", (task_id,))
+                self._insert_event(task_id, 'requeued', {'attempts': attempts})
+            else:
+                logger.error(f"Task {task_id} lost its worker {attempts} times, giving up")
+                self._db.execute("UPDATE tasks SET status = ?, error = ?, finished = ?, lease_expires = NULL "
+                                 "WHERE task_id = ?",
+                                 (FAILED, f"Worker lost {attempts} times", now, task_id))
+        return len(expired)
+
+    def expire_leases(self) -> int:
+        with self._transaction(immediate=True):
+            return self._expire_leases(time.time())
+
+    def _insert_event(self, task_id: str, stage: str, event: Dict) -> None:
+        self._db.execute("INSERT INTO events (task_id, stage, event) VALUES (?, ?, ?)",
+                         (task_id, stage, json.dumps(event)))
+
+    def _live_workers(self, now: float) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM workers WHERE last_seen > ?",
+                                (now - WORKER_STALE_LEASES * self.lease_seconds,)).fetchone()[0]
+
+    def _retry_after(self, now: float, client_id: Optional[str] = None) -> int:
+        """Seconds of queued and running work per live worker, of one client or of everyone"""
+        query = "SELECT COALESCE(SUM(cost), 0) FROM tasks WHERE status IN (?, ?)"
+        args = (QUEUED, LEASED)
+        if client_id is not None:
+            query += " AND client_id = ?"
+            args += (client_id,)
+        work = self._db.execute(query, args).fetchone()[0]
+        return max(int(math.ceil(work / max(self._live_workers(now), 1))), 1)
+
+    def _check_capacity(self, now: float, client_id: str) -> int:
+        """Raise AdmissionRejected for a client at its cap or a full queue, returns the queue length"""
+        in_flight = self._db.execute("SELECT COUNT(*) FROM tasks WHERE client_id = ? AND status IN (?, ?)",
+                                     (client_id, QUEUED, LEASED)).fetchone()[0]
+        if in_flight >= self.max_per_client:
+            raise AdmissionRejected(f"Too many jobs in flight for this client (limit {self.max_per_client})",
+                                    retry_after=self._retry_after(now, client_id))
+        queued = self._db.execute("SELECT COUNT(*) FROM tasks WHERE status = ?", (QUEUED,)).fetchone()[0]
+        if queued >= self.max_queue:
+            raise AdmissionRejected("Processing queue is full", retry_after=self._retry_after(now))
+        return queued
+
+    def check_admission(self, client_id: str) -> None:
+        with self._transaction():
+            self._check_capacity(time.time(), client_id)
+
+    def submit(self, payload: Dict, client_id: str, cost: float) -> BrokerTask:
+        if cost > self.max_job_seconds:
+            raise AdmissionRejected(
+                f"Job too large: estimated {cost:.0f}s, limit {self.max_job_seconds:.0f}s", status=413
+            )
+        lane = INTERACTIVE if cost <= self.short_job_seconds else BULK
+        now = time.time()
+        task_id = uuid.uuid4().hex
+
+        with self._transaction(immediate=True):
+            self._expire_leases(now)
+            queued = self._check_capacity(now, client_id)
+            self._db.execute(
+                "INSERT INTO tasks (task_id, payload, client_id, cost, lane, status, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (task_id, json.dumps(payload), client_id, cost, LANES.index(lane), QUEUED, now)
+            )
+            self._purge(now)
+
+        logger.info(f"Queued task {task_id} for {client_id}: cost {cost:.0f}s, lane {lane}, {queued + 1} queued")
+        return self.get(task_id)
+
+    def _purge(self, now: float) -> None:
+        cutoff = now - RESULT_TTL_SECONDS
+        self._db.execute("DELETE FROM events WHERE task_id IN "
+                         "(SELECT task_id FROM tasks WHERE status IN (?, ?) AND finished < ?)", (DONE, FAILED, cutoff))
+        self._db.execute("DELETE FROM tasks WHERE status IN (?, ?) AND finished < ?", (DONE, FAILED, cutoff))
+        self._db.execute("DELETE FROM workers WHERE last_seen < ?", (cutoff,))
+
+    def _next(self, now: float, worker_id: str) -> Optional[str]:
+        """The next task a worker may start: interactive lane first, FIFO within a lane"""
+        running = dict(self._db.execute("SELECT client_id, COUNT(*) FROM tasks WHERE status = ? GROUP BY client_id",
+                                        (LEASED,)).fetchall())
+        bulk_running = self._db.execute("SELECT COUNT(*) FROM tasks WHERE status = ? AND lane = ?",
+                                        (LEASED, LANES.index(BULK))).fetchone()[0]
+        # Slots are the live workers, counting the one claiming now before its first heartbeat
+        workers = self._live_workers(now)
+        known = self._db.execute("SELECT COUNT(*) FROM workers WHERE worker_id = ? AND last_seen > ?",
+                                 (worker_id, now - WORKER_STALE_LEASES * self.lease_seconds)).fetchone()[0]
+        bulk_slots = max(workers + (not known) - self.reserved_interactive, 1)
+
+        rows = self._db.execute("SELECT task_id, client_id, lane FROM tasks WHERE status = ? ORDER BY lane, created",
+                                (QUEUED,)).fetchall()
+        for task_id, client_id, lane in rows:
+            if running.get(client_id, 0) >= self.running_per_client:
+                continue
+            if LANES[lane] == BULK and bulk_running >= bulk_slots:
+                continue
+            return task_id
+        return None
+
+    def claim(self, worker_id: str) -> Optional[BrokerTask]:
+        now = time.time()
+        with self._transaction(immediate=True):
+            self._expire_leases(now)
+            task_id = self._next(now, worker_id)
+            if task_id:
+                self._db.execute(
+                    "UPDATE tasks SET status = ?, worker_id = ?, lease_expires = ?, attempts = attempts + 1, "
+                    "started = ? WHERE task_id = ?",
+                    (LEASED, worker_id, now + self.lease_seconds, now, task_id)
+                )
+            self._db.execute("INSERT INTO workers (worker_id, last_seen, task_id) VALUES (?, ?, ?) "
+                             "ON CONFLICT(worker_id) DO UPDATE SET last_seen = excluded.last_seen, "
+                             "task_id = excluded.task_id", (worker_id, now, task_id))
+        return self.get(task_id) if task_id else None
+
+    def heartbeat(self, task_id: str, worker_id: str, job_id: Optional[str] = None) -> bool:
+        now = time.time()
+        with self._transaction():
+            updated = self._db.execute(
+                "UPDATE tasks SET lease_expires = ?, job_id = COALESCE(?, job_id) "
+                "WHERE task_id = ? AND worker_id = ? AND status = ?",
+                (now + self.lease_seconds, job_id, task_id, worker_id, LEASED)
+            ).rowcount
+            self._db.execute("UPDATE workers SET last_seen = ? WHERE worker_id = ?", (now, worker_id))
+        return updated == 1
+
+    def publish(self, task_id: str, worker_id: str, stage: str, event: Dict) -> bool:
+        # A worker whose lease expired may still be running, its stages must not mix with the next attempt's
+        with self._transaction():
+            inserted = self._db.execute(
+                "INSERT INTO events (task_id, stage, event) SELECT task_id, ?, ? FROM tasks "
+                "WHERE task_id = ? AND worker_id = ? AND status = ?",
+                (stage, json.dumps(event), task_id, worker_id, LEASED)
+            ).rowcount
+        return inserted == 1
+
+    def events(self, task_id: str, after: int = 0) -> List[Tuple[int, str, Dict]]:
+        with self._lock:
+            rows = self._db.execute("SELECT seq, stage, event FROM events WHERE task_id = ? AND seq > ? ORDER BY seq",
+                                    (task_id, after)).fetchall()
+        return [(seq, stage, json.loads(event)) for seq, stage, event in rows]
+
+    def _finish(self, task_id: str, worker_id: str, status: str, result: Optional[Dict],
+                error: Optional[str]) -> bool:
+        now = time.time()
+        with self._transaction():
+            updated = self._db.execute(
+                "UPDATE tasks SET status = ?, result = ?, error = ?, finished = ?, lease_expires = NULL "
+                "WHERE task_id = ? AND worker_id = ? AND status = ?",
+                (status, json.dumps(result) if result is not None else None, error, now, task_id, worker_id, LEASED)
+            ).rowcount
+            self._db.execute("UPDATE workers SET last_seen = ?, task_id = NULL WHERE worker_id = ?", (now, worker_id))
+        if not updated:
+            logger.warning(f"Task {task_id} is no longer leased by {worker_id}, dropping its {status} result")
+        return updated == 1
+
+    def complete(self, task_id: str, worker_id: str, result: Dict) -> bool:
+        return self._finish(task_id, worker_id, DONE, result, None)
+
+    def fail(self, task_id: str, worker_id: str, error: str, result: Optional[Dict] = None) -> bool:
+        return self._finish(task_id, worker_id, FAILED, result, error)
+
+    def get(self, task_id: str) -> Optional[BrokerTask]:
+        with self._lock:
+            row = self._db.execute(f"SELECT {self._COLUMNS} FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return self._task(row) if row else None
+
+    def active_job_ids(self) -> Set[str]:
+        with self._lock:
+            rows = self._db.execute("SELECT job_id FROM tasks WHERE status = ? AND job_id IS NOT NULL",
+                                    (LEASED,)).fetchall()
+        return {job_id for job_id, in rows}
+
+    def stats(self) -> Dict:
+        now = time.time()
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+            queued = dict(self._db.execute("SELECT lane, COUNT(*) FROM tasks WHERE status = ? GROUP BY lane",
+                                           (QUEUED,)).fetchall())
+            workers = self._live_workers(now)
+            retry_after = self._retry_after(now)
+        return {
+            'broker': 'sqlite',
+            'workers': workers,
+            'running': counts.get(LEASED, 0),
+            'queued': {lane: queued.get(index, 0) for index, lane in enumerate(LANES)},
+            'done': counts.get(DONE, 0),
+            'failed': counts.get(FAILED, 0),
+            'max_queue': self.max_queue,
+            'estimated_wait': retry_after
+        }
+
+
+BROKERS = {
+    'sqlite': SqliteBroker,
+}
+
+
+def make_broker(url: Optional[str], default_dir: str, **options) -> Optional[JobBroker]:
+    """
+    Broker from a JOB_BROKER value: '' keeps processing in the API process,
+    'sqlite' uses <default_dir>/job_broker.db, 'sqlite:///relative.db' and 'sqlite:////absolute.db' a given file
+    """
+    if not url:
+        return None
+    scheme, _, location = url.partition('://')
+    if scheme not in BROKERS:
+        raise ValueError(f"Unknown job broker '{scheme}', expected one of {sorted(BROKERS)}")
+    path = location[1:] if location.startswith('/') else location
+    return BROKERS[scheme](path or os.path.join(default_dir, 'job_broker.db'), **options)
@@ -0,0 +1,228 @@
+import os
+import math
+import time
+import itertools
+import logging
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Lanes, in priority order: short jobs (and download cache hits) never queue behind long ones
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+LANES = (INTERACTIVE, BULK)
+
+# Rough pipeline cost in processing seconds per second of audio, by pitch tracker
+SECONDS_PER_AUDIO_SECOND = {'pyin': 1.0, 'yin': 0.5, 'crepe': 0.7}
+MULTITRACK_FACTOR = 1.5
+# Share of that cost per stage, for jobs that only request some outputs
+STAGE_COST_SHARE = {'tempo': 0.05, 'four_stem': 0.4, 'two_stem': 0.15, 'split_vocals': 0.15, 'transcribe': 0.4}
+DOWNLOAD_SECONDS = 15.0
+# Assumed length when a song's duration can't be probed
+DEFAULT_AUDIO_SECONDS = 240.0
+
+# Quality tiers: a preview transcribes a short excerpt with lighter models, ahead of the full run
+FULL = 'full'
+PREVIEW = 'preview'
+QUALITIES = (FULL, PREVIEW)
+PREVIEW_SECONDS = float(os.getenv('PREVIEW_SECONDS', '30'))
+# Single Demucs model, no vocal split, plain YIN
+PREVIEW_SECONDS_PER_AUDIO_SECOND = 0.3
+
+
+def estimate_cost(duration: Optional[float],
+                  cached: bool,
+                  pitch_tracker: str = 'pyin',
+                  multitrack: bool = False,
+                  quality: str = FULL,
+                  stages: Optional[Sequence[str]] = None) -> float:
+    """
+    Estimated processing seconds for a job, from the probed audio duration and its options
+    stages, when given, are the only pipeline stages the job runs (see output_plan)
+    """
+    seconds = duration if duration else DEFAULT_AUDIO_SECONDS
+    if quality == PREVIEW:
+        cost = min(seconds, PREVIEW_SECONDS) * PREVIEW_SECONDS_PER_AUDIO_SECOND
+    else:
+        cost = seconds * SECONDS_PER_AUDIO_SECOND.get(pitch_tracker, 1.0)
+        if multitrack:
+            cost *= MULTITRACK_FACTOR
+        if stages is not None:
+            cost *= sum(STAGE_COST_SHARE.get(stage, 0.0) for stage in stages)
+    if not cached:
+        cost += DOWNLOAD_SECONDS
+    return cost
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a job is not admitted
+    status is the HTTP status to answer with, retry_after the suggested wait in seconds (if any)
+    """
+
+    def __init__(self, message: str, status: int = 429, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+@dataclass
+class Ticket:
+    client_id: str
+    cost: float
+    lane: str
+    seq: int
+    enqueued: float = field(default_factory=time.time)
+    started: Optional[float] = None
+
+    def remaining(self, now: float) -> float:
+        if self.started is None:
+            return self.cost
+        return max(self.cost - (now - self.started), 0.0)
+
+
+class JobScheduler:
+    """
+    Admission control and priority scheduling in front of the processing pipeline
+    Jobs are admitted with a cost estimate, wait in a bounded queue and run when a slot frees up:
+    - interactive jobs (cost up to short_job_seconds) go first and have slots the bulk lane can't take
+    - each client has a cap on running jobs and on jobs in flight (running + queued)
+    - a full queue, or a client over its cap, is rejected with a Retry-After estimate
+    """
+
+    def __init__(self,
+                 max_running: int = 2,
+                 reserved_interactive: int = 1,
+                 max_queue: int = 16,
+                 max_per_client: int = 2,
+                 running_per_client: int = 1,
+                 short_job_seconds: float = 120.0,
+                 max_job_seconds: float = 3600.0):
+        self.max_running = max_running
+        self.bulk_slots = max(max_running - reserved_interactive, 1)
+        self.max_queue = max_queue
+        self.max_per_client = max_per_client
+        self.running_per_client = running_per_client
+        self.short_job_seconds = short_job_seconds
+        self.max_job_seconds = max_job_seconds
+
+        self._cond = threading.Condition()
+        self._waiting: List[Ticket] = []
+        self._running: List[Ticket] = []
+        self._seq = itertools.count()
+
+    def lane_for(self, cost: float) -> str:
+        return INTERACTIVE if cost <= self.short_job_seconds else BULK
+
+    def _estimated_wait(self, lane: str) -> int:
+        """Seconds until a job entering the lane now would likely start"""
+        now = time.time()
+        ahead = [t for t in self._waiting if LANES.index(t.lane) <= LANES.index(lane)]
+        work = sum(t.remaining(now) for t in self._running) + sum(t.cost for t in ahead)
+        slots = self.max_running if lane == INTERACTIVE else self.bulk_slots
+        return max(int(math.ceil(work / slots)), 1)
+
+    def _check_capacity(self, client_id: str, lane: str) -> None:
+        client_jobs = [t for t in self._running + self._waiting if t.client_id == client_id]
+        if len(client_jobs) >= self.max_per_client:
+            now = time.time()
+            retry_after = max(int(math.ceil(min(t.remaining(now) for t in client_jobs))), 1)
+            raise AdmissionRejected(
+                f"Too many jobs in flight for this client (limit {self.max_per_client})",
+                retry_after=retry_after
+            )
+        if len(self._waiting) >= self.max_queue:
+            raise AdmissionRejected("Processing queue is full", retry_after=self._estimated_wait(lane))
+
+    def check_admission(self, client_id: str) -> None:
+        """
+        Raise AdmissionRejected when a job of this client would be turned away whatever its cost,
+        so callers can skip estimating the cost (a network probe) of a job that can't be queued
+        """
+        with self._cond:
+            self._check_capacity(client_id, INTERACTIVE)
+
+    def admit(self, client_id: str, cost: float) -> Ticket:
+        """Queue a job or raise AdmissionRejected"""
+        with self._cond:
+            if cost > self.max_job_seconds:
+                raise AdmissionRejected(
+                    f"Job too large: estimated {cost:.0f}s, limit {self.max_job_seconds:.0f}s", status=413
+                )
+
+            lane = self.lane_for(cost)
+            self._check_capacity(client_id, lane)
+
+            ticket = Ticket(client_id, cost, lane, next(self._seq))
+            self._waiting.append(ticket)
+            logger.info(f"Admitted job for {client_id}: cost {cost:.0f}s, lane {lane}, "
+                        f"{len(self._waiting)} queued, {len(self._running)} running")
+            return ticket
+
+    def _can_start(self, ticket: Ticket) -> bool:
+        if len(self._running) >= self.max_running:
+            return False
+        if ticket.lane == BULK and sum(t.lane == BULK for t in self._running) >= self.bulk_slots:
+            return False
+        return sum(t.client_id == ticket.client_id for t in self._running) < self.running_per_client
+
+    def _next(self) -> Optional[Ticket]:
+        """The next job to start: interactive lane first, FIFO within a lane"""
+        for ticket in sorted(self._waiting, key=lambda t: (LANES.index(t.lane), t.seq)):
+            if self._can_start(ticket):
+                return ticket
+        return None
+
+    def wait(self, ticket: Ticket, timeout: Optional[float] = None) -> bool:
+        """Block until the job may run, False if it timed out (it is then dropped from the queue)"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._next() is not ticket:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    self._waiting.remove(ticket)
+                    self._cond.notify_all()
+                    return False
+                self._cond.wait(remaining)
+
+            self._waiting.remove(ticket)
+            ticket.started = time.time()
+            self._running.append(ticket)
+            # Another waiter may be startable in a different lane
+            self._cond.notify_all()
+            return True
+
+    def release(self, ticket: Ticket) -> None:
+        with self._cond:
+            if ticket in self._running:
+                self._running.remove(ticket)
+            elif ticket in self._waiting:
+                self._waiting.remove(ticket)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, client_id: str, cost: float, timeout: Optional[float] = None) -> Iterator[Ticket]:
+        """Admit a job, wait for its turn and hold a running slot for the duration of the block"""
+        ticket = self.admit(client_id, cost)
+        try:
+            if not self.wait(ticket, timeout):
+                with self._cond:
+                    retry_after = self._estimated_wait(ticket.lane)
+                raise AdmissionRejected("Timed out waiting for a processing slot", status=503,
+                                        retry_after=retry_after)
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                'running': len(self._running),
+                'queued': {lane: sum(t.lane == lane for t in self._waiting) for lane in LANES},
+                'max_running': self.max_running,
+                'max_queue': self.max_queue,
+                'estimated_wait': {lane: self._estimated_wait(lane) for lane in LANES}
+            }
@@ -0,0 +1,130 @@
+import os
+import sys
+import signal
+import logging
+import argparse
+import threading
+from typing import Dict, List, Optional
+from job_broker import JobBroker, BrokerTask, worker_name
+from memory_guard import metrics as memory_metrics
+
+logger = logging.getLogger(__name__)
+
+# Idle workers poll the broker this often
+POLL_SECONDS = 1.0
+
+
+class JobWorker:
+    """
+    Pulls /process jobs from a broker and runs them with the API's own pipeline (run_process_job)
+    Outputs land in the shared upload folder and artifact store, the broker only carries stage events
+    and the final response with their URLs
+    """
+
+    def __init__(self, app, broker: JobBroker, worker_id: Optional[str] = None, poll_seconds: float = POLL_SECONDS):
+        self.app = app
+        self.broker = broker
+        self.worker_id = worker_id or worker_name()
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        """Stop claiming jobs, the ones running still finish"""
+        self._stop.set()
+
+    def _keep_lease(self, task: BrokerTask, job: Dict, done: threading.Event) -> None:
+        # A third of the lease between heartbeats, so one missed beat doesn't lose the task
+        while not done.wait(self.broker.lease_seconds / 3):
+            if not self.broker.heartbeat(task.task_id, self.worker_id, job.get('job_id')):
+                logger.warning(f"Lost the lease of task {task.task_id}, another worker may rerun it")
+                return
+
+    def run_once(self, worker_id: Optional[str] = None) -> bool:
+        """Claim and run one job, False when the queue was empty"""
+        from audio_processing import run_process_job
+
+        worker_id = worker_id or self.worker_id
+        task = self.broker.claim(worker_id)
+        if task is None:
+            return False
+        logger.info(f"{worker_id} running task {task.task_id} (attempt {task.attempts})")
+
+        job = {}
+        done = threading.Event()
+
+        def on_start(job_id: str) -> None:
+            # Recorded right away, so no artifact store collects the job's files while it runs here
+            job['job_id'] = job_id
+            self.broker.heartbeat(task.task_id, worker_id, job_id)
+
+        heartbeat = threading.Thread(target=self._keep_lease, args=(task, job, done),
+                                     name=f"heartbeat-{task.task_id}", daemon=True)
+        heartbeat.start()
+        try:
+            with self.app.app_context():
+                result = run_process_job(self.app, task.payload,
+                                         lambda stage, event: self.broker.publish(task.task_id, worker_id, stage, event),
+                                         on_start)
+        except Exception as e:
+            logger.error(f"Task {task.task_id} crashed: {e}")
+            result = {'status': 'error', 'message': str(e)}
+        finally:
+            done.set()
+            heartbeat.join()
+
+        if result.get('status') == 'error':
+            self.broker.fail(task.task_id, worker_id, result.get('message', 'Processing failed'), result)
+        else:
+            self.broker.complete(task.task_id, worker_id, result)
+        return True
+
+    def _loop(self, worker_id: str) -> None:
+        while not self._stop.is_set():
+            # A worker past its memory limit finishes its job and exits, to be restarted fresh
+            if memory_metrics.recycle_reason:
+                logger.warning(f"{worker_id} stopping: {memory_metrics.recycle_reason}")
+                self.stop()
+                break
+            try:
+                claimed = self.run_once(worker_id)
+            except Exception as e:
+                logger.error(f"{worker_id} broker error: {e}")
+                claimed = False
+            if not claimed:
+                self._stop.wait(self.poll_seconds)
+
+    def run(self, concurrency: int = 1) -> None:
+        """Run jobs on `concurrency` threads until stopped"""
+        threads: List[threading.Thread] = []
+        for index in range(concurrency):
+            worker_id = self.worker_id if concurrency == 1 else f"{self.worker_id}-{index}"
+            thread = threading.Thread(target=self._loop, args=(worker_id,), name=worker_id)
+            thread.start()
+            threads.append(thread)
+        logger.info(f"Worker {self.worker_id} started with {concurrency} slots")
+        for thread in threads:
+            thread.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Process /process jobs from the job broker (JOB_BROKER)")
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('WORKER_CONCURRENCY', '1')),
+                        help="jobs run at once by this process")
+    parser.add_argument('--worker-id', help="defaults to <hostname>-<pid>")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # Workers only need the audio role of the app: its stores, download cache and pipeline
+    os.environ.setdefault('SERVICE_ROLES', 'audio')
+    from app import app
+
+    if getattr(app, 'broker', None) is None:
+        print("JOB_BROKER is not set, e.g. JOB_BROKER=sqlite")
+        sys.exit(1)
+
+    worker = JobWorker(app, app.broker, args.worker_id)
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    try:
+        worker.run(args.concurrency)
+    except KeyboardInterrupt:
+        worker.stop()
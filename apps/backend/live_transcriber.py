@@ -0,0 +1,354 @@
+import time
+import logging
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from midi_extractor import MidiExtractor
+from pitch_trackers import synthetic_line
+
+logger = logging.getLogger(__name__)
+
+# Analysis frames of about 46 ms every 11.6 ms (1024 / 256 samples at 22050 Hz), at any input rate
+FRAME_SECONDS = 1024 / 22050
+HOP_SECONDS = 256 / 22050
+# Viterbi decisions are committed this many hops after the frame they describe
+LAG_FRAMES = 3
+
+# YIN: cumulative mean normalized difference below this marks a periodic frame
+YIN_THRESHOLD = 0.2
+# Frames quieter than this (dBFS) are unvoiced, whatever their periodicity
+GATE_DB = -45.0
+# Onsets: a jump of a semitone from the recent pitch, or a loudness rise at the same pitch
+ONSET_SEMITONES = 1.0
+ONSET_RISE_DB = 6.0
+ONSET_HOLDOFF_FRAMES = 4
+VELOCITY_RANGE_DB = (-50.0, -6.0)
+
+PCM_FORMATS = {'f32': '<f4', 's16': '<i2'}
+
+
+def decode_pcm(data: bytes, pcm_format: str = 'f32') -> np.ndarray:
+    """Mono PCM samples from a binary message, as float32 in [-1, 1]"""
+    samples = np.frombuffer(data, dtype=PCM_FORMATS[pcm_format])
+    if pcm_format == 's16':
+        return samples.astype(np.float32) / 32768.0
+    return samples.astype(np.float32, copy=False)
+
+
+class IncrementalYin:
+    """
+    YIN pitch tracking over a sliding buffer: every push returns the frames completed by the new samples
+    Each frame yields (f0 in Hz or NaN, voiced, RMS)
+    """
+
+    def __init__(self, sr: int, fmin: float, fmax: float):
+        self.sr = sr
+        self.frame_length = int(2 ** round(np.log2(FRAME_SECONDS * sr)))
+        self.hop_length = max(int(round(HOP_SECONDS * sr)), 1)
+        self.tau_min = max(int(sr / fmax), 2)
+        self.tau_max = min(int(np.ceil(sr / fmin)), self.frame_length // 2)
+        self.window = self.frame_length - self.tau_max
+        self._fft_size = int(2 ** np.ceil(np.log2(self.frame_length + self.window)))
+        self._buffer = np.zeros(0, dtype=np.float32)
+
+    def push(self, samples: np.ndarray) -> List[Tuple[float, bool, float]]:
+        self._buffer = np.concatenate((self._buffer, samples))
+        frames = []
+        start = 0
+        while start + self.frame_length <= len(self._buffer):
+            frames.append(self._analyze(self._buffer[start:start + self.frame_length]))
+            start += self.hop_length
+        self._buffer = self._buffer[start:]
+        return frames
+
+    def _analyze(self, frame: np.ndarray) -> Tuple[float, bool, float]:
+        frame = frame.astype(np.float64)
+        rms = float(np.sqrt(np.mean(frame ** 2)))
+        if 20 * np.log10(rms + 1e-12) < GATE_DB:
+            return np.nan, False, rms
+
+        # Difference function d(tau) = sum (x[j] - x[j + tau])^2 over the window, via FFT correlation
+        spectrum = np.fft.rfft(frame, self._fft_size)
+        head = np.fft.rfft(frame[:self.window], self._fft_size)
+        correlation = np.fft.irfft(spectrum * np.conj(head), self._fft_size)[:self.tau_max + 1]
+        energy = np.concatenate(([0.0], np.cumsum(frame ** 2)))
+        taus = np.arange(self.tau_max + 1)
+        difference = energy[self.window] + energy[taus + self.window] - energy[taus] - 2 * correlation
+        difference[0] = 0.0
+
+        # Cumulative mean normalized difference
+        cumulative = np.cumsum(difference[1:])
+        cmndf = np.ones(self.tau_max + 1)
+        cmndf[1:] = difference[1:] * taus[1:] / np.maximum(cumulative, 1e-12)
+
+        # First dip under the threshold, followed down to its local minimum
+        candidates = np.flatnonzero(cmndf[self.tau_min:] < YIN_THRESHOLD)
+        if not len(candidates):
+            return np.nan, False, rms
+        tau = self.tau_min + int(candidates[0])
+        while tau + 1 <= self.tau_max and cmndf[tau + 1] < cmndf[tau]:
+            tau += 1
+
+        # Parabolic interpolation around the minimum
+        if 0 < tau < self.tau_max:
+            left, centre, right = cmndf[tau - 1], cmndf[tau], cmndf[tau + 1]
+            denominator = left - 2 * centre + right
+            shift = 0.5 * (left - right) / denominator if denominator else 0.0
+        else:
+            shift = 0.0
+        return self.sr / (tau + shift), True, rms
+
+
+class LiveTranscriber:
+    """
+    Online pitch-to-MIDI: incremental YIN, then the note HMM of MidiExtractor decoded with
+    fixed-lag Viterbi, so each frame's state is final LAG_FRAMES hops after it arrives
+    process() takes any number of samples and returns the note_on / note_off events they settled,
+    each with its stream time and the latency since that frame's audio came in
+    """
+
+    def __init__(self,
+                 sr: int = 22050,
+                 midi_min: int = 36,
+                 midi_max: int = 84,
+                 lag_frames: int = LAG_FRAMES,
+                 pStayNote: float = 0.9,
+                 pStaySilence: float = 0.7,
+                 pitchAcc: float = 0.9,
+                 voicedAcc: float = 0.9,
+                 onsetAcc: float = 0.9,
+                 spread: float = 0.2):
+        extractor = MidiExtractor(midi_min, midi_max)
+        self.midi_min = extractor.midiMin
+        self.midi_max = extractor.midiMax
+        self.tracker = IncrementalYin(sr, extractor.noteHzTable[0] * 0.9, extractor.noteHzTable[-1] * 1.1)
+        self.sr = sr
+        self.lag_frames = max(lag_frames, 0)
+        self.pitch_acc = pitchAcc
+        self.voiced_acc = voicedAcc
+        self.onset_acc = onsetAcc
+        self.spread = spread
+
+        with np.errstate(divide='ignore'):
+            self._log_transitions = np.log(extractor.transitionMatrix(pStayNote, pStaySilence))
+        self._notes = np.arange(self.midi_min, self.midi_max + 1)
+        self._n_states = 2 * len(self._notes) + 1
+        self._delta = np.full(self._n_states, -np.inf)
+        self._delta[0] = 0.0
+
+        # Backpointers and RMS of the frames not yet committed
+        self._pending: deque = deque()
+        self._frame = 0
+        self._committed = 0
+        self._recent_midi: deque = deque(maxlen=3)
+        self._recent_db: deque = deque(maxlen=ONSET_HOLDOFF_FRAMES)
+        self._last_onset = -ONSET_HOLDOFF_FRAMES
+        self._active: Optional[int] = None
+        self._samples = 0
+
+        self.frames = 0
+        self.processing_seconds = 0.0
+
+    @property
+    def latency_seconds(self) -> float:
+        """Algorithmic latency: half an analysis frame plus the decoding lag"""
+        hop = self.tracker.hop_length / self.sr
+        return self.tracker.frame_length / 2 / self.sr + self.lag_frames * hop
+
+    def _frame_time(self, frame: int) -> float:
+        return (frame * self.tracker.hop_length + self.tracker.frame_length / 2) / self.sr
+
+    def _is_onset(self, f0: float, voiced: bool, rms: float) -> bool:
+        level = 20 * np.log10(rms + 1e-12)
+        onset = False
+        if voiced and self._frame - self._last_onset >= ONSET_HOLDOFF_FRAMES:
+            midi = 12 * np.log2(f0 / 440.0) + 69
+            if not self._recent_midi:
+                onset = True
+            elif abs(midi - np.median(self._recent_midi)) >= ONSET_SEMITONES:
+                onset = True
+            elif self._recent_db and level - min(self._recent_db) >= ONSET_RISE_DB:
+                onset = True
+        if voiced:
+            self._recent_midi.append(12 * np.log2(f0 / 440.0) + 69)
+        else:
+            self._recent_midi.clear()
+        self._recent_db.append(level)
+        if onset:
+            self._last_onset = self._frame
+        return onset
+
+    def _priors(self, f0: float, voiced: bool, onset: bool) -> np.ndarray:
+        """The offline HMM's observation model for a single frame"""
+        priors = np.empty(self._n_states)
+        priors[0] = 1 - self.voiced_acc if voiced else self.voiced_acc
+        priors[1::2] = self.onset_acc if onset else 1 - self.onset_acc
+        if voiced:
+            distance = np.abs(self._notes - np.round(12 * np.log2(f0 / 440.0) + 69))
+            priors[2::2] = np.where(distance == 0, self.pitch_acc,
+                                    np.where(distance == 1, self.pitch_acc * self.spread, 1 - self.pitch_acc))
+        else:
+            priors[2::2] = 1 - self.pitch_acc
+        return priors
+
+    def _step(self, f0: float, voiced: bool, rms: float) -> None:
+        onset = self._is_onset(f0, voiced, rms)
+        scores = self._delta[:, None] + self._log_transitions
+        backpointer = np.argmax(scores, axis=0)
+        with np.errstate(divide='ignore'):
+            delta = scores[backpointer, np.arange(self._n_states)] + np.log(self._priors(f0, voiced, onset))
+        # Renormalize so the log scores never drift towards -inf on long streams
+        self._delta = delta - delta.max()
+        self._pending.append((backpointer, rms))
+        self._frame += 1
+
+    def _commit(self, keep: int) -> List[Dict]:
+        """Settle all but the last `keep` pending frames by backtracking from the current best state"""
+        events = []
+        if len(self._pending) <= keep:
+            return events
+        state = int(np.argmax(self._delta))
+        path = []
+        for backpointer, rms in reversed(self._pending):
+            path.append((state, rms))
+            state = int(backpointer[state])
+        path.reverse()
+
+        for state, rms in path[:len(path) - keep]:
+            events.extend(self._emit(self._committed, state, rms))
+            self._committed += 1
+            self._pending.popleft()
+        return events
+
+    def _emit(self, frame: int, state: int, rms: float) -> List[Dict]:
+        events = []
+        time_ = round(self._frame_time(frame), 4)
+        note = None if state == 0 else self.midi_min + (state - 1) // 2
+        starts = state % 2 == 1 or (note is not None and note != self._active)
+        if self._active is not None and (note is None or starts):
+            events.append({'type': 'note_off', 'midi': self._active, 'time': time_})
+            self._active = None
+        if note is not None and starts:
+            low, high = VELOCITY_RANGE_DB
+            level = 20 * np.log10(rms + 1e-12)
+            velocity = int(np.clip(1 + 126 * (level - low) / (high - low), 1, 127))
+            events.append({'type': 'note_on', 'midi': note, 'velocity': velocity, 'time': time_})
+            self._active = note
+        return events
+
+    def _stamp(self, events: List[Dict], started: float) -> List[Dict]:
+        """Latency of each event: stream time received after its frame, plus the time spent processing"""
+        received = self._samples / self.sr
+        elapsed = time.perf_counter() - started
+        for event in events:
+            event['latency_ms'] = round((received - event['time'] + elapsed) * 1000, 1)
+        return events
+
+    def process(self, samples: np.ndarray) -> List[Dict]:
+        started = time.perf_counter()
+        self._samples += len(samples)
+        frames = self.tracker.push(np.asarray(samples, dtype=np.float32))
+        for f0, voiced, rms in frames:
+            self._step(f0, voiced, rms)
+        events = self._commit(self.lag_frames)
+        self.frames += len(frames)
+        self.processing_seconds += time.perf_counter() - started
+        return self._stamp(events, started)
+
+    def flush(self) -> List[Dict]:
+        """Settle the remaining frames at the end of the stream and close the sounding note"""
+        started = time.perf_counter()
+        events = self._commit(0)
+        if self._active is not None:
+            events.append({'type': 'note_off', 'midi': self._active,
+                           'time': round(self._frame_time(self._committed), 4)})
+            self._active = None
+        return self._stamp(events, started)
+
+    def stats(self) -> Dict:
+        return {
+            'frames': self.frames,
+            'frame_us': round(self.processing_seconds / max(self.frames, 1) * 1e6, 1),
+            'hop_ms': round(self.tracker.hop_length / self.sr * 1000, 1),
+            'algorithmic_latency_ms': round(self.latency_seconds * 1000, 1)
+        }
+
+
+def synthetic_melody(sr: int = 22050, notes: int = 24, seed: int = 0) -> Tuple[np.ndarray, List[Tuple[float, int]]]:
+    """A sung-like test line: harmonic tones with vibrato and gaps, with their (onset, midi) ground truth"""
+    audio, _, truth = synthetic_line(sr, notes, seed)
+    return audio, truth
+
+
+def benchmark(audio: Optional[np.ndarray] = None, sr: int = 22050, block_ms: float = 10.0) -> Dict:
+    """
+    Stream audio through the live transcriber in blocks of block_ms, as a client would
+    Reports per-frame processing cost and, against the synthetic melody's ground truth,
+    the end-to-end latency from each true onset to the note_on that reports it
+    """
+    truth = None
+    if audio is None:
+        audio, truth = synthetic_melody(sr)
+
+    transcriber = LiveTranscriber(sr)
+    block = max(int(sr * block_ms / 1000), 1)
+    frame_costs = []
+    note_ons = []
+    for start in range(0, len(audio), block):
+        began = time.perf_counter()
+        frames_before = transcriber.frames
+        events = transcriber.process(audio[start:start + block])
+        elapsed = time.perf_counter() - began
+        if transcriber.frames > frames_before:
+            frame_costs.append(elapsed / (transcriber.frames - frames_before))
+        # Emission time on the stream clock: the end of the block just received, plus processing
+        emitted = (start + len(audio[start:start + block])) / sr + elapsed
+        note_ons.extend((event, emitted) for event in events if event['type'] == 'note_on')
+    transcriber.flush()
+
+    costs_us = np.array(frame_costs) * 1e6
+    report = {
+        **transcriber.stats(),
+        'frame_us_p50': round(float(np.percentile(costs_us, 50)), 1),
+        'frame_us_p95': round(float(np.percentile(costs_us, 95)), 1),
+        'frame_us_max': round(float(costs_us.max()), 1),
+        'realtime_factor': round(transcriber.processing_seconds / (len(audio) / sr), 4),
+        'note_ons': len(note_ons)
+    }
+
+    if truth is not None:
+        latencies = []
+        matched = 0
+        for onset, midi in truth:
+            candidates = [emitted - onset for event, emitted in note_ons
+                          if abs(event['midi'] - midi) <= 1 and -0.05 <= event['time'] - onset <= 0.15]
+            if candidates:
+                matched += 1
+                latencies.append(min(candidates))
+        latencies_ms = np.array(latencies) * 1000
+        report.update({
+            'onsets_found': f"{matched}/{len(truth)}",
+            'latency_ms_mean': round(float(latencies_ms.mean()), 1) if matched else None,
+            'latency_ms_p95': round(float(np.percentile(latencies_ms, 95)), 1) if matched else None,
+            'latency_ms_max': round(float(latencies_ms.max()), 1) if matched else None
+        })
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark live pitch-to-MIDI: per-frame cost and end-to-end latency")
+    parser.add_argument('audio', nargs='?', help="audio file to stream (default: a synthetic melody with ground truth)")
+    parser.add_argument('--block-ms', type=float, default=10.0, help="client block size in milliseconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    samples = None
+    if args.audio:
+        import librosa
+        samples = librosa.load(args.audio, sr=22050)[0]
+    for key, value in benchmark(samples, block_ms=args.block_ms).items():
+        print(f"{key:>24}: {value}")
@@ -1,6 +1,7 @@
 import os
-from app import app
+from app import app, start_server_warmup
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
+    start_server_warmup(debug=True)
     app.run(debug=True, host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,115 @@
+import struct
+import zlib
+import numpy as np
+from typing import Optional, Tuple
+from artifact_store import atomic_path
+
+# Binary layout: fixed little-endian header followed by int16 samples
+# magic, version, flags, reserved, count, start (s), step (s), scale (Hz per unit)
+HEADER_FORMAT = '<4sBBHIfff'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAGIC = b'VCNT'
+VERSION = 1
+
+FLAG_DELTA = 0x01
+FLAG_ZLIB = 0x02
+
+CONTENT_TYPE = 'application/octet-stream'
+
+
+def encode_contour(values: np.ndarray, step: float, start: float = 0.0, compress: bool = True) -> bytes:
+    """
+    Quantize a melody contour to int16 and pack it into the binary contour format
+    Args:
+        values: Per-frame contour values in Hz
+        step: Time between consecutive values in seconds
+        start: Time of the first value in seconds
+        compress: Delta-encode and zlib-compress the samples
+    Returns:
+        Encoded contour bytes
+    """
+    values = np.nan_to_num(np.asarray(values, dtype=np.float64))
+    peak = float(np.max(np.abs(values))) if len(values) else 0.0
+    scale = peak / np.iinfo(np.int16).max if peak > 0 else 1.0
+
+    samples = np.round(values / scale).astype(np.int16)
+    flags = 0
+    if compress:
+        # int16 arithmetic wraps, and the cumulative sum on decode wraps back
+        samples = np.diff(samples, prepend=np.int16(0)).astype(np.int16)
+        flags |= FLAG_DELTA | FLAG_ZLIB
+
+    payload = samples.astype('<i2').tobytes()
+    if flags & FLAG_ZLIB:
+        payload = zlib.compress(payload, 6)
+
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, flags, 0, len(samples), start, step, scale)
+    return header + payload
+
+
+def decode_contour(data: bytes) -> Tuple[np.ndarray, float, float]:
+    """
+    Unpack a binary contour
+    Returns:
+        Tuple of (values in Hz, step in seconds, start in seconds)
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError("Contour data too short")
+
+    magic, version, flags, _, count, start, step, scale = struct.unpack_from(HEADER_FORMAT, data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Unsupported contour format")
+
+    payload = data[HEADER_SIZE:]
+    if flags & FLAG_ZLIB:
+        payload = zlib.decompress(payload)
+
+    samples = np.frombuffer(payload, dtype='<i2', count=count)
+    if flags & FLAG_DELTA:
+        samples = np.cumsum(samples, dtype=np.int16)
+
+    return samples.astype(np.float32) * np.float32(scale), step, start
+
+
+def save_contour(path: str, values: np.ndarray, step: float) -> str:
+    """Write a full-resolution contour to disk"""
+    with atomic_path(path) as tmp_path, open(tmp_path, 'wb') as outfile:
+        outfile.write(encode_contour(values, step))
+    return path
+
+
+def load_contour(path: str) -> Tuple[np.ndarray, float, float]:
+    """Read a contour written by save_contour"""
+    with open(path, 'rb') as infile:
+        return decode_contour(infile.read())
+
+
+def slice_contour(values: np.ndarray,
+                  step: float,
+                  start: Optional[float] = None,
+                  end: Optional[float] = None,
+                  points: Optional[int] = None) -> Tuple[np.ndarray, float, float]:
+    """
+    Select a time range of a contour and optionally reduce it to a number of points
+    Args:
+        values: Full contour
+        step: Time between consecutive values in seconds
+        start: Range start in seconds, defaults to the beginning
+        end: Range end in seconds, defaults to the end
+        points: Maximum number of values to return, each the mean of its bucket
+    Returns:
+        Tuple of (values, step, start) describing the selection
+    """
+    first = 0 if start is None else int(np.clip(np.floor(start / step), 0, len(values)))
+    last = len(values) if end is None else int(np.clip(np.ceil(end / step), first, len(values)))
+    selection = values[first:last]
+
+    if points is None or points <= 0 or len(selection) <= points:
+        return selection, step, first * step
+
+    edges = np.linspace(0, len(selection), points + 1).astype(int)[:-1]
+    sums = np.add.reduceat(selection, edges)
+    counts = np.diff(np.append(edges, len(selection)))
+    bucket_step = len(selection) / points
+
+    return sums / counts, step * bucket_step, first * step
@@ -0,0 +1,306 @@
+import os
+import gc
+import sys
+import time
+import logging
+import resource
+import threading
+import tracemalloc
+from collections import OrderedDict, deque
+from typing import Any, Dict, Hashable, List, Optional, Set
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# RSS above which a worker asks to be recycled, MAX_WORKER_RSS_MB=0 disables it
+MAX_WORKER_RSS_BYTES = int(float(os.getenv('MAX_WORKER_RSS_MB', '6144')) * 1024 ** 2)
+# tracemalloc slows allocation-heavy code down noticeably, so it is opt-in
+TRACE_ALLOCATIONS = os.getenv('MEMORY_TRACE', '0') == '1'
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def process_rss_bytes(pid: Optional[int] = None) -> int:
+    """Resident set size of a process, from /proc where available, else this process's peak"""
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        if pid not in (None, os.getpid()):
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def pool_rss_bytes(pool) -> Dict[int, int]:
+    """RSS of each live worker of a ProcessPoolExecutor"""
+    processes = getattr(pool, '_processes', None) or {}
+    return {pid: process_rss_bytes(pid) for pid in list(processes)}
+
+
+def nbytes_of(value: Any) -> int:
+    """Approximate payload size of a cached value: arrays and containers of arrays are counted exactly"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes_of(item) for item in value)
+    if isinstance(value, dict):
+        return sum(nbytes_of(item) for item in value.values())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+class ByteLRUCache:
+    """
+    Thread-safe LRU cache bounded by the total size of its values rather than their count
+    Values larger than the whole budget are returned to the caller but never stored
+    """
+
+    def __init__(self, max_bytes: int, name: str = 'cache'):
+        self.max_bytes = max_bytes
+        self.name = name
+        self._entries: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        metrics.register_cache(self)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any) -> Any:
+        size = nbytes_of(value)
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._sizes.pop(key)
+                del self._entries[key]
+            if size > self.max_bytes:
+                return value
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                oldest, _ = self._entries.popitem(last=False)
+                self.bytes -= self._sizes.pop(oldest)
+        return value
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict:
+        return {
+            'name': self.name,
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+class MemoryTracker:
+    """
+    Samples RSS in a background thread for the duration of a job, optionally with tracemalloc,
+    and records the job in the process-wide memory metrics when it ends
+    RSS and tracemalloc are per process: when jobs overlap (concurrent_jobs > 1) the RSS figures include
+    the other jobs, and allocations are only traced for a job that runs alone from start to end
+    """
+
+    _active_lock = threading.Lock()
+    _active: Set['MemoryTracker'] = set()
+
+    def __init__(self, job: str, interval: float = 0.5, trace: bool = TRACE_ALLOCATIONS):
+        self.job = job
+        self.interval = interval
+        self.trace = trace
+        self.start_rss = 0
+        self.peak_rss = 0
+        self.end_rss = 0
+        self.traced_peak = None
+        self.concurrent_jobs = 1
+        self.seconds = 0.0
+        self._started_tracing = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_time = 0.0
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, process_rss_bytes())
+
+    def __enter__(self) -> 'MemoryTracker':
+        with MemoryTracker._active_lock:
+            MemoryTracker._active.add(self)
+            for tracker in MemoryTracker._active:
+                tracker.concurrent_jobs = max(tracker.concurrent_jobs, len(MemoryTracker._active))
+            alone = len(MemoryTracker._active) == 1
+        # Resetting the peak under a running job would corrupt its figure
+        if alone:
+            if self.trace and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+        self._start_time = time.perf_counter()
+        self.start_rss = self.peak_rss = process_rss_bytes()
+        self._thread = threading.Thread(target=self._sample, name=f'memory-{self.job}', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.seconds = time.perf_counter() - self._start_time
+        self.end_rss = process_rss_bytes()
+        self.peak_rss = max(self.peak_rss, self.end_rss)
+        with MemoryTracker._active_lock:
+            MemoryTracker._active.discard(self)
+        if tracemalloc.is_tracing():
+            if self.concurrent_jobs == 1:
+                self.traced_peak = tracemalloc.get_traced_memory()[1]
+            if self._started_tracing:
+                tracemalloc.stop()
+        metrics.record(self.to_dict())
+
+    def to_dict(self) -> Dict:
+        mb = 1024 ** 2
+        return {
+            'job': self.job,
+            'seconds': round(self.seconds, 3),
+            'start_rss_mb': round(self.start_rss / mb, 1),
+            'peak_rss_mb': round(self.peak_rss / mb, 1),
+            'end_rss_mb': round(self.end_rss / mb, 1),
+            'retained_mb': round((self.end_rss - self.start_rss) / mb, 1),
+            'traced_peak_mb': round(self.traced_peak / mb, 1) if self.traced_peak is not None else None,
+            # Above 1 the RSS figures are shared with the overlapping jobs
+            'concurrent_jobs': self.concurrent_jobs
+        }
+
+
+class MemoryMetrics:
+    """Process-wide memory metrics: recent jobs, registered caches and the recycle flag"""
+
+    def __init__(self, history: int = 50):
+        self._lock = threading.Lock()
+        self.jobs = deque(maxlen=history)
+        self.caches: List[ByteLRUCache] = []
+        self.jobs_total = 0
+        self.recycle_reason: Optional[str] = None
+
+    def register_cache(self, cache: 'ByteLRUCache') -> None:
+        with self._lock:
+            self.caches = [c for c in self.caches if c.name != cache.name] + [cache]
+
+    def record(self, job: Dict) -> None:
+        with self._lock:
+            self.jobs.append(job)
+            self.jobs_total += 1
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'rss_mb': round(process_rss_bytes() / 1024 ** 2, 1),
+                'max_worker_rss_mb': round(MAX_WORKER_RSS_BYTES / 1024 ** 2, 1),
+                'recycle_requested': self.recycle_reason,
+                'jobs_total': self.jobs_total,
+                'recent_jobs': list(self.jobs),
+                'caches': [cache.stats() for cache in self.caches]
+            }
+
+
+metrics = MemoryMetrics()
+
+
+def check_worker_memory(release=None, threshold: int = MAX_WORKER_RSS_BYTES) -> bool:
+    """
+    Called between jobs: past the threshold, drop caches and models (via `release`) and collect
+    If RSS is still too high the process asks to be recycled (reported by /ready and metrics)
+    Returns whether a recycle is requested
+    """
+    if not threshold or process_rss_bytes() <= threshold:
+        return metrics.recycle_reason is not None
+
+    logger.warning(f"Worker RSS {process_rss_bytes() / 1024 ** 2:.0f} MB over {threshold / 1024 ** 2:.0f} MB, "
+                   f"releasing caches")
+    for cache in metrics.caches:
+        cache.clear()
+    if release:
+        release()
+    gc.collect()
+
+    rss = process_rss_bytes()
+    if rss > threshold:
+        metrics.recycle_reason = f"RSS {rss / 1024 ** 2:.0f} MB over {threshold / 1024 ** 2:.0f} MB"
+        logger.error(f"Worker still over its memory limit, requesting recycle: {metrics.recycle_reason}")
+    return metrics.recycle_reason is not None
+
+
+def soak(audio_paths: List[str], iterations: int, temp_dir: str, warmup: int = 2,
+         tolerance_mb: float = 150.0) -> Dict:
+    """
+    Run the pipeline over the given songs `iterations` times in this process and check that
+    RSS stays flat after the first `warmup` jobs (models, JIT caches and pools are loaded by then)
+    """
+    from song_features_retriever import SongFeaturesRetriever
+    processor = SongFeaturesRetriever(temp_dir)
+
+    samples = []
+    for i in range(iterations):
+        path = audio_paths[i % len(audio_paths)]
+        processor.process_song(path)
+        gc.collect()
+        samples.append(process_rss_bytes() / 1024 ** 2)
+        logger.info(f"Soak {i + 1}/{iterations}: {os.path.basename(path)}, RSS {samples[-1]:.0f} MB")
+
+    steady = samples[min(warmup, len(samples) - 1):]
+    growth = steady[-1] - steady[0]
+    # Least-squares slope, robust to a single noisy sample at either end
+    slope = float(np.polyfit(np.arange(len(steady)), steady, 1)[0]) if len(steady) > 1 else 0.0
+    return {
+        'rss_mb': [round(sample, 1) for sample in samples],
+        'growth_mb': round(growth, 1),
+        'slope_mb_per_job': round(slope, 2),
+        'flat': growth <= tolerance_mb and slope * len(steady) <= tolerance_mb
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Soak test: process songs repeatedly and check RSS stays flat")
+    parser.add_argument('audio', nargs='+')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--tolerance-mb', type=float, default=150.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        report = soak(args.audio, args.iterations, temp_dir, args.warmup, args.tolerance_mb)
+    print(f"RSS per job (MB): {report['rss_mb']}")
+    print(f"Growth after warm-up: {report['growth_mb']} MB, slope {report['slope_mb_per_job']} MB/job")
+    if not report['flat']:
+        print(f"FAIL: memory is not flat after warm-up (tolerance {args.tolerance_mb} MB)")
+        sys.exit(1)
+    print("Memory is flat")
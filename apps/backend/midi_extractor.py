@@ -1,30 +1,48 @@
 import numpy as np
-import torchcrepe
 import librosa
-import matplotlib.pyplot as plt
 from tqdm import tqdm
-import midiutil
 import math
 import json
+import logging
+from note_events import NoteEvents, StandardMidiFile
+from pitch_trackers import get_pitch_tracker, DEFAULT_PITCH_TRACKER
+from artifact_store import atomic_path
+from vocal_activity import detect_regions
+
+logger = logging.getLogger(__name__)
+
+# Adaptive range of a song without voiced frames to estimate one from: the default C2 to C6
+DEFAULT_RANGE = (36, 84)
+# Adaptive range: semitones kept on either side of the song's pitch histogram, and the narrowest range used
+RANGE_MARGIN = 2
+MIN_RANGE_SPAN = 12
+# Share of voiced frames ignored at either end of the histogram (octave errors, breaths)
+RANGE_OUTLIER_RATIO = 0.01
+# The quick pass behind the histogram uses plain YIN with this many times the transcription hop
+RANGE_HOP_FACTOR = 4
 
 class MidiExtractor:
 
-    def __init__(self):
+    def __init__(self, midiMin: int = 36, midiMax: int = 84, adaptiveRange: bool = False, vocalGate: bool = False):
+        # Transcribable range, C2 to C6 by default
+        # With adaptiveRange it is only the search range: each song's HMM covers the notes it actually uses
+        # With vocalGate only the regions where the stem carries voice are pitch tracked and decoded
+        self.searchMin = midiMin
+        self.searchMax = midiMax
+        self.adaptiveRange = adaptiveRange
+        self.vocalGate = vocalGate
+        self.originalPitch = None
+        self.notes = None
+        self.features = None
+        self.sampleRate = 22050
+        self.setRange(midiMin, midiMax)
+
+    def setRange(self, midiMin: int, midiMax: int) -> None:
+        """Note range of the HMM: states, priors and the note mapping are all built from it"""
         self.noteMap = {
-            36: 'C2', 37: 'C#2', 38: 'D2', 39: 'D#2', 40: 'E2',
-            41: 'F2', 42: 'F#2', 43: 'G2', 44: 'G#2', 45: 'A2',
-            46: 'A#2', 47: 'B2', 48: 'C3', 49: 'C#3', 50: 'D3',
-            51: 'D#3', 52: 'E3', 53: 'F3', 54: 'F#3', 55: 'G3',
-            56: 'G#3', 57: 'A3', 58: 'A#3', 59: 'B3', 60: 'C4',
-            61: 'C#4', 62: 'D4', 63: 'D#4', 64: 'E4', 65: 'F4',
-            66: 'F#4', 67: 'G4', 68: 'G#4', 69: 'A4', 70: 'A#4',
-            71: 'B4', 72: 'C5', 73: 'C#5', 74: 'D5', 75: 'D#5',
-            76: 'E5', 77: 'F5', 78: 'F#5', 79: 'G5', 80: 'G#5',
-            81: 'A5', 82: 'A#5', 83: 'B5', 84: 'C6'
+            m: librosa.midi_to_note(m, unicode=False) for m in range(midiMin, midiMax + 1)
         }
-        
         self.noteMapHz = {}
-        self.originalPitch = None
 
         keys = list(self.noteMap.keys())
         
@@ -32,6 +50,7 @@ class MidiExtractor:
             self.noteMapHz[k] = librosa.note_to_hz(self.noteMap[k])
 
         self.noteMapValues = list(self.noteMap.values())
+        self.noteHzTable = np.array([self.noteMapHz[k] for k in keys])
 
         self.midiMin = keys[0]
         self.midiMax = keys[-1]
@@ -42,7 +61,7 @@ class MidiExtractor:
         newRange = (newRangeTuple[1] - newRangeTuple[0])
         return (((oldValue - oldRangeTuple[0]) * newRange) / oldRange) + newRangeTuple[0]
         
-    def __transitionMatrix(self, pStayNote: float, pStaySilence: float) -> np.array:
+    def transitionMatrix(self, pStayNote: float, pStaySilence: float) -> np.array:
         nNotes = self.midiMax - self.midiMin + 1
         pL = (1 - pStaySilence) / nNotes
         pLL = (1 - pStayNote) / (nNotes + 1)
@@ -68,6 +87,37 @@ class MidiExtractor:
 
         return transMat
 
+    def estimateRange(self, audio: np.array, frameLength: int, hopLength: int) -> tuple[int, int]:
+        """
+        Note range of a song from a quick pitch histogram over the search range:
+        voiced frames between the outlier percentiles, plus RANGE_MARGIN semitones on each side
+        Without voiced frames the default range is used (within the search range) rather than the
+        whole search range, which would make the HMM needlessly large
+        """
+        pitch, voiced = get_pitch_tracker('yin').track(audio,
+                                                       self.sampleRate,
+                                                       librosa.midi_to_hz(self.searchMin) * 0.9,
+                                                       librosa.midi_to_hz(self.searchMax) * 1.1,
+                                                       frameLength,
+                                                       hopLength * RANGE_HOP_FACTOR
+                                                      )
+        pitch = pitch[np.asarray(voiced, dtype=bool) & np.isfinite(pitch)]
+        if not len(pitch):
+            return max(DEFAULT_RANGE[0], self.searchMin), min(DEFAULT_RANGE[1], self.searchMax)
+
+        midis = np.clip(np.round(librosa.hz_to_midi(pitch)), self.searchMin, self.searchMax).astype(int)
+        cumulative = np.cumsum(np.bincount(midis - self.searchMin)) / len(midis)
+        low = self.searchMin + int(np.searchsorted(cumulative, RANGE_OUTLIER_RATIO))
+        high = self.searchMin + int(np.searchsorted(cumulative, 1 - RANGE_OUTLIER_RATIO))
+
+        low, high = low - RANGE_MARGIN, high + RANGE_MARGIN
+        if high - low < MIN_RANGE_SPAN:
+            centre = (low + high) // 2
+            low, high = centre - MIN_RANGE_SPAN // 2, centre + MIN_RANGE_SPAN - MIN_RANGE_SPAN // 2
+        # Shift rather than clip a range that runs past the search bounds
+        low, high = low - max(high - self.searchMax, 0), high + max(self.searchMin - low, 0)
+        return max(low, self.searchMin), min(high, self.searchMax)
+
     def __detectVocalOnsets(self, frequencies: np.array, t: int = 1) -> np.array:
         threshold = librosa.note_to_hz(self.noteMapValues[-1])
         
@@ -134,160 +184,234 @@ class MidiExtractor:
         
         return onsets
                     
+    def __pitchFeatures(self,
+                        audio: np.array,
+                        frameLength: int,
+                        hopLength: int,
+                        pitchTracker: str = DEFAULT_PITCH_TRACKER) -> dict:
+        # Everything the HMM stage needs from the audio, so it can be rerun without it
+        fMin = librosa.note_to_hz(self.noteMapValues[0])
+        fMax = librosa.note_to_hz(self.noteMapValues[-1])
+        tracker = get_pitch_tracker(pitchTracker)
+
+        # Get RMS energy of the signal
+        rms = librosa.feature.rms(y=audio, frame_length=frameLength, hop_length=hopLength)[0]
+
+        if not self.vocalGate:
+            pitch, voiced = tracker.track(audio, self.sampleRate, fMin*0.9, fMax*1.1, frameLength, hopLength)
+            regions = None
+        else:
+            # Frames outside the active regions are unvoiced, each region is tracked on its own
+            # and lands back on the song's frame grid (a slice starting at frame s maps frame k to s + k)
+            regions = detect_regions(audio, frameLength, hopLength, self.sampleRate, rms)
+            pitch = np.full(len(rms), np.nan)
+            voiced = np.zeros(len(rms), dtype=bool)
+            for start, end in regions:
+                regionPitch, regionVoiced = tracker.track(audio[start * hopLength:end * hopLength],
+                                                          self.sampleRate, fMin*0.9, fMax*1.1,
+                                                          frameLength, hopLength)
+                n = min(len(regionPitch), end - start)
+                pitch[start:start + n] = regionPitch[:n]
+                voiced[start:start + n] = regionVoiced[:n]
+
+        # Calculate onsets positions (cheap next to pitch tracking, and silent frames end its scans at once)
+        onsets = np.array(self.__detectVocalOnsets(pitch), dtype=int)
+
+        features = {'pitch': pitch, 'voiced': np.asarray(voiced, dtype=bool), 'onsets': onsets, 'rms': rms}
+        if regions is not None:
+            features['regions'] = regions
+        return features
+
     def __priorProbabilities(self,
-                           audio: np.array,
-                           frameLength: int,
-                           hopLength: int,
+                           pitch: np.array,
+                           voiced: np.array,
+                           onsets: np.array,
                            pitchAcc: float = 0.9,
                            voicedAcc: float = 0.9,
                            onsetAcc: float = 0.9,
                            spread: float = 0.2) -> np.array:
-        # Some constants
-        fMin = librosa.note_to_hz(self.noteMapValues[0])
-        fMax = librosa.note_to_hz(self.noteMapValues[-1])
         nNotes = self.midiMax - self.midiMin + 1
-        
-        pitch, voiced, _ = librosa.pyin(y=audio,
-                                     fmin=fMin*0.9,
-                                     fmax=fMax*1.1,
-                                     frame_length=frameLength,
-                                     win_length=int(frameLength / 2),
-                                     hop_length=hopLength
-                                    )
+        nFrames = len(pitch)
+
         tuning = librosa.pitch_tuning(pitch)
-        f0_ = np.round(librosa.hz_to_midi(pitch - tuning)).astype(int)
+        f0_ = np.round(librosa.hz_to_midi(pitch - tuning))
 
-        # Calculate onsets positions
-        onsets = self.__detectVocalOnsets(pitch)
-        self.originalPitch = pitch
-        
-        # Init priors matrix
-        priors = np.ones((nNotes * 2 + 1, len(pitch)))
+        priors = np.empty((nNotes * 2 + 1, nFrames))
 
-        for nFrame in range(len(pitch)):
-            if (nFrame < len(voiced) and not voiced[nFrame]) or nFrame > len(voiced):
-                priors[0, nFrame] = voicedAcc
-            else:
-                priors[0, nFrame] = 1 - voicedAcc
+        # State 0 = silence
+        priors[0] = np.where(voiced[:nFrames], 1 - voicedAcc, voicedAcc)
+
+        # Odd states = onsets, the same prior for every note
+        isOnset = np.zeros(nFrames, dtype=bool)
+        isOnset[onsets[onsets < nFrames]] = True
+        priors[1::2] = np.where(isOnset, onsetAcc, 1 - onsetAcc)
+
+        # Even states = sustains, by distance in semitones to the tracked pitch (NaN when unvoiced)
+        distance = np.abs(np.arange(self.midiMin, self.midiMax + 1)[:, None] - f0_[None, :])
+        priors[2::2] = np.where(distance == 0, pitchAcc,
+                                np.where(distance == 1, pitchAcc * spread, 1 - pitchAcc))
 
-            for j in range(nNotes):
-                if nFrame in onsets:
-                    priors[(j * 2) + 1, nFrame] = onsetAcc
-                else:
-                    priors[(j * 2) + 1, nFrame] = 1 - onsetAcc
-
-                if j + self.midiMin == f0_[nFrame]:
-                    priors[(j * 2) + 2, nFrame] = pitchAcc
-                elif np.abs(j + self.midiMin - f0_[nFrame]) == 1:
-                    priors[(j * 2) + 2, nFrame] = pitchAcc * spread
-                else:
-                    priors[(j * 2) + 2, nFrame] = 1 - pitchAcc
-        
         return priors
         
-    def __statesToPianoroll(self, audio: np.array, states: list, frameLength: float, hopLength:float, hopTime: float) -> (list, list):
-        states_ = np.hstack((states, np.zeros(1)))
+    def __statesToPianoroll(self, rms: np.array, originalPitch: np.array, states: np.array, hopTime: float) -> (NoteEvents, np.array):
+        # Append a trailing silence frame so the last note always gets an offset
+        states_ = np.hstack((states, np.zeros(1))).astype(int)
+        nFrames = len(states_)
+
+        # Run-length encode the state path
+        runStarts = np.flatnonzero(np.diff(states_, prepend=-1))
+        runValues = states_[runStarts]
+
+        # Odd states = onsets, a note lasts until the next onset or silence
+        isOnset = runValues % 2 == 1
+        isBoundary = isOnset | (runValues == 0)
+        boundaryStarts = runStarts[isBoundary]
+
+        onsetFrames = runStarts[isOnset]
+        offsetFrames = boundaryStarts[np.searchsorted(boundaryStarts, onsetFrames, side='right')]
+        midis = (runValues[isOnset] - 1) // 2 + self.midiMin
+
+        minRMS = np.min(rms)
+        maxRMS = np.max(rms)
+
+        # Note loudness is the mean RMS of the onset frame and the one after it
+        windowEnds = np.minimum(onsetFrames + 2, len(rms))
+        windows = np.column_stack((onsetFrames, windowEnds)).ravel()
+        rmsSums = np.add.reduceat(np.append(rms, 0), windows)[::2]
+        velocities = self.__rangeConversion(rmsSums / (windowEnds - onsetFrames), (minRMS, maxRMS), (0, 127))
+
+        notes = NoteEvents(onsetFrames * hopTime, offsetFrames * hopTime, midis, velocities.astype(int))
+
+        # Each voiced frame belongs to the most recent onset, except that an onset right
+        # after a sustain still reports the distance to the previous note
+        frames = np.arange(nFrames)
+        onsetMidi = np.full(nFrames, self.midiMin)
+        onsetMidi[onsetFrames] = midis
+        lastOnset = np.maximum.accumulate(np.where(states_ % 2 == 1, frames, 0))
+
+        previous = np.roll(states_, 1)
+        previous[0] = 0
+        retrigger = (states_ % 2 == 1) & (previous != 0) & (previous % 2 == 0)
+        source = np.where(retrigger, frames - 1, frames)
+
+        noteHz = self.noteHzTable[onsetMidi[lastOnset[source]] - self.midiMin]
+        pitch = np.append(originalPitch, np.nan)[:nFrames]
+        melodyWave = np.where(states_ != 0, noteHz - pitch, 0)
+        melodyWave = np.nan_to_num(melodyWave)
+
+        return notes, melodyWave
+
+    def __pianorollToMidi(self, bpm: float, pianoroll: NoteEvents) -> StandardMidiFile:
+        midi = StandardMidiFile(bpm)
+        midi.add_track(pianoroll)
 
-        # Possible states
-        silence = 0
-        onset = 1
-        sustain = 2
-        
-        currentState = silence
-        output = []
-        melodyWave = []
+        return midi
 
-        lastOnset = 0
-        lastOffset = 0
-        lastMidi = 0
+    def extractFeatures(self,
+                        audioPath: str,
+                        Fs: int = 22050,
+                        frameLength: int = 2048,
+                        hopLength: int = 512,
+                        pitchTracker: str = DEFAULT_PITCH_TRACKER
+                       ) -> dict:
+        """Load audio and compute pitch, voicing, onsets and RMS, the expensive part of a transcription"""
+        audio = librosa.load(audioPath, sr=Fs)[0]
+        self.sampleRate = Fs
+
+        if self.adaptiveRange:
+            self.setRange(*self.estimateRange(audio, frameLength, hopLength))
+            logger.info(f"Note range {self.noteMapValues[0]} to {self.noteMapValues[-1]}, "
+                        f"{2 * (self.midiMax - self.midiMin + 1) + 1} HMM states")
+
+        features = self.__pitchFeatures(audio, frameLength, hopLength, pitchTracker)
+        features.update({
+            'sampleRate': Fs,
+            'frameLength': frameLength,
+            'hopLength': hopLength,
+            'midiMin': self.midiMin,
+            'midiMax': self.midiMax,
+            'pitchTracker': pitchTracker
+        })
+        self.features = features
+        return features
+
+    def featuresToMidi(self,
+                       features: dict,
+                       bpm: int,
+                       pStayNote: float = 0.9,
+                       pStaySilence: float = 0.7,
+                       pitchAcc: float = 0.9,
+                       voicedAcc: float = 0.9,
+                       onsetAcc: float = 0.9,
+                       spread: float = 0.2
+                      ) -> (StandardMidiFile, np.array):
+        """Priors, Viterbi decoding and note segmentation on precomputed features"""
+        transMat = self.transitionMatrix(pStayNote, pStaySilence)
 
-        # Get RMS energy of the signal
-        rms = librosa.feature.rms(y=audio, frame_length=frameLength, hop_length=hopLength)
-        minRMS = min(rms[0])
-        maxRMS = max(rms[0])
-
-        currentRMSSum = 0
-        currentRMSNr = 0
-
-        for i, _ in tqdm(enumerate(states_)):
-            if currentState == silence:
-                # Onset found
-                if int(states_[i] % 2) != 0:
-                    lastOnset = i * hopTime
-                    lastMidi = ((states_[i] - 1) / 2) + self.midiMin
-                    lastNote = librosa.midi_to_note(lastMidi)
-                    currentState = onset
-
-                    melodyWave.append(self.noteMapHz[lastMidi] - self.originalPitch[i])
-
-                    currentRMSSum += rms[0][i]
-                    currentRMSNr += 1
-                else:
-                    melodyWave.append(0)
-            elif currentState == onset:
-                if int(states_[i] % 2) == 0:
-                    currentState = sustain
-
-                    melodyWave.append(self.noteMapHz[lastMidi] - self.originalPitch[i])
-
-                    currentRMSSum += rms[0][i]
-                    currentRMSNr += 1
-            elif currentState == sustain:
-                # Onset found
-                if int(states_[i] % 2) != 0:
-                    # Finish last note
-                    lastOffset = i * hopTime
-                    currentNote = [lastOnset, lastOffset, lastMidi, lastNote, 
-                                   int(self.__rangeConversion(currentRMSSum/currentRMSNr, (minRMS, maxRMS), (0, 127)))
-                                  ]
-                    output.append(currentNote)
-                    melodyWave.append(self.noteMapHz[lastMidi] - self.originalPitch[i])
-
-                    # Start new note
-                    lastOnset = i * hopTime
-                    lastMidi = ((states_[i] - 1) / 2) + self.midiMin
-                    lastNote = librosa.midi_to_note(lastMidi)
-                    currentState = onset
-
-                    currentRMSSum = rms[0][i]
-                    currentRMSNr = 1
-                elif states_[i] == 0:
-                    # Silence, end last note
-                    lastOffset = i * hopTime
-                    currentNote = [lastOnset, lastOffset, lastMidi, lastNote,
-                                   int(self.__rangeConversion(currentRMSSum/currentRMSNr, (minRMS, maxRMS), (0, 127)))
-                                  ]
-                    output.append(currentNote)
-                    melodyWave.append(0)
-                    currentState = silence
-
-                    currentRMSSum = 0
-                    currentRMSNr = 0
-                else:
-                    melodyWave.append(self.noteMapHz[lastMidi] - self.originalPitch[i])
-        
-        melodyWave = np.nan_to_num(melodyWave).tolist()
-                    
-        return output, melodyWave
+        priors = self.__priorProbabilities(
+            features['pitch'],
+            features['voiced'],
+            features['onsets'],
+            pitchAcc,
+            voicedAcc,
+            onsetAcc,
+            spread
+        )
+        self.originalPitch = features['pitch']
 
-    def __pianorollToMidi(self, bpm: float, pianoroll: list) -> midiutil.MidiFile:
-        quarterNote = 60 / bpm
+        pInit = np.zeros(transMat.shape[0])
+        pInit[0] = 1
 
-        onsets = np.array([p[0] for p in pianoroll])
-        offsets = np.array([p[1] for p in pianoroll])
-        velocities = np.array([p[4] for p in pianoroll])
+        regions = features.get('regions')
+        if regions is None:
+            states = librosa.sequence.viterbi(priors, transMat, p_init=pInit)
+        else:
+            # Gated features: silence between the vocal regions, each decoded on its own starting from silence
+            states = np.zeros(priors.shape[1], dtype=int)
+            for start, end in regions:
+                states[start:end] = librosa.sequence.viterbi(priors[:, start:end], transMat, p_init=pInit)
+
+        pianoroll, melodyArray = self.__statesToPianoroll(features['rms'],
+                                            features['pitch'],
+                                            states,
+                                            features['hopLength'] / features['sampleRate']
+                                            )
+        self.notes = pianoroll
 
-        onsets = onsets / quarterNote
-        offsets = offsets / quarterNote
-        durations = offsets - onsets
+        midi = self.__pianorollToMidi(bpm, pianoroll)  # Use the provided BPM
+        return midi, melodyArray
 
-        midi = midiutil.MIDIFile(1)
-        midi.addTempo(0, 0, bpm)
+    @staticmethod
+    def saveFeatures(path: str, features: dict, **extra) -> str:
+        with atomic_path(path) as tmpPath:
+            np.savez(tmpPath, **features, **extra)
+        return path
 
-        for i,_ in enumerate(onsets):
-            midi.addNote(0, 0, int(pianoroll[i][2]), onsets[i], durations[i], velocities[i])
+    @staticmethod
+    def loadFeatures(path: str) -> dict:
+        with np.load(path) as data:
+            return {k: data[k].item() if data[k].ndim == 0 else data[k] for k in data.files}
 
-        return midi
+    @staticmethod
+    def shiftFeatures(features: dict, offsetFrames: int, nFrames: int) -> dict:
+        """
+        Features of a recording that starts `offsetFrames` into the one they were computed on
+        and lasts nFrames: frames outside the original are unvoiced silence
+        """
+        source = np.arange(nFrames) + offsetFrames
+        inside = (source >= 0) & (source < len(features['pitch']))
+        clipped = np.clip(source, 0, max(len(features['pitch']) - 1, 0))
+
+        shifted = dict(features)
+        shifted['pitch'] = np.where(inside, features['pitch'][clipped], np.nan)
+        shifted['voiced'] = inside & features['voiced'][clipped]
+        shifted['rms'] = np.where(inside, features['rms'][clipped], 0).astype(features['rms'].dtype)
+        onsets = features['onsets'] - offsetFrames
+        shifted['onsets'] = onsets[(onsets >= 0) & (onsets < nFrames)]
+        if 'regions' in features:
+            regions = np.clip(features['regions'] - offsetFrames, 0, nFrames)
+            shifted['regions'] = regions[regions[:, 1] > regions[:, 0]].reshape(-1, 2)
+        return shifted
 
     def waveToMidi(self,
                     audioPath: str,
@@ -300,72 +424,27 @@ class MidiExtractor:
                    pitchAcc: float = 0.9,
                    voicedAcc: float = 0.9,
                    onsetAcc: float = 0.9,
-                   spread: float = 0.2
-                  ) -> (midiutil.MIDIFile(), list):
+                   spread: float = 0.2,
+                   pitchTracker: str = DEFAULT_PITCH_TRACKER
+                  ) -> (StandardMidiFile, np.array):
 
         print('MIDI: Performing midi transcription...')
-        progress = tqdm(range(7))
+        progress = tqdm(range(2))
 
-        audio = librosa.load(audioPath, sr=Fs)[0]
+        features = self.extractFeatures(audioPath, Fs, frameLength, hopLength, pitchTracker)
         progress.update(1)
         progress.refresh()
-        
-        transMat = self.__transitionMatrix(pStayNote, pStaySilence)
-        progress.update(2)
-        progress.refresh()
 
-        priors = self.__priorProbabilities(
-            audio,
-            frameLength,
-            hopLength,
-            pitchAcc,
-            voicedAcc,
-            onsetAcc,
-            spread
-        )
-        progress.update(3)
-        progress.refresh()
-
-        pInit = np.zeros(transMat.shape[0])
-        pInit[0] = 1
-        progress.update(4)
-        progress.refresh()
-
-        states = librosa.sequence.viterbi(priors, transMat, p_init=pInit)
-        progress.update(5)
-        progress.refresh()
-
-        pianoroll, melodyArray = self.__statesToPianoroll(audio,
-                                            states,
-                                            frameLength,
-                                            hopLength,
-                                            hopLength / Fs
-                                            )
-        progress.update(6)
-        progress.refresh()
-
-        midi = self.__pianorollToMidi(bpm, pianoroll)  # Use the provided BPM
-        progress.update(7)
+        midi, melodyArray = self.featuresToMidi(features,
+                                                bpm,
+                                                pStayNote,
+                                                pStaySilence,
+                                                pitchAcc,
+                                                voicedAcc,
+                                                onsetAcc,
+                                                spread
+                                                )
+        progress.update(1)
         progress.refresh()
 
         return midi, melodyArray
-
-def download_youtube_audio(search_query, output_path):
-    """Helper function to download audio from YouTube"""
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'outtmpl': output_path,
-        'quiet': True,
-        'no_warnings': True
-    }
-    
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(f"ytsearch:{search_query}", download=True)
-        if not info.get('entries'):
-            raise Exception("No video found")
-        return info['entries'][0]
\ No newline at end of file
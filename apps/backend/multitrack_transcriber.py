@@ -0,0 +1,237 @@
+import os
+import logging
+import threading
+import multiprocessing
+import concurrent.futures
+import numpy as np
+import librosa
+from typing import Dict
+from midi_extractor import MidiExtractor
+from note_events import NoteEvents, StandardMidiFile
+from artifact_store import atomic_path
+from pitch_trackers import DEFAULT_PITCH_TRACKER
+from memory_guard import pool_rss_bytes
+
+logger = logging.getLogger(__name__)
+
+DRUM_CHANNEL = 9
+
+# Stem workers are replaced once one of them grows past this
+MAX_STEM_WORKER_RSS_BYTES = int(float(os.getenv('MAX_STEM_WORKER_RSS_MB', '2048')) * 1024 ** 2)
+
+# General MIDI percussion keys for the drum hit classes
+GM_KICK = 36
+GM_SNARE = 38
+GM_CLOSED_HIHAT = 42
+
+# Polyphonic transcription: harmonics summed into each pitch's salience, the most notes kept per frame,
+# the level (below the loudest bin) a note must reach, the jump that re-attacks a held pitch, the shortest note
+POLY_HARMONICS = 4
+POLY_HARMONIC_DECAY = 0.8
+POLY_MAX_VOICES = 4
+POLY_THRESHOLD_DB = -30.0
+POLY_REATTACK_DB = 6.0
+POLY_MIN_NOTE_SECONDS = 0.1
+
+# Per-stem transcription settings: transcriber kind, note range and GM program
+# The "other" stem (guitars, keys, pads) carries chords, so it gets the multi-pitch transcriber
+STEM_PROFILES = {
+    'lead_vocals': {'kind': 'melodic', 'midi_min': 36, 'midi_max': 84, 'program': 53},
+    'backing_vocals': {'kind': 'melodic', 'midi_min': 36, 'midi_max': 84, 'program': 52},
+    'bass': {'kind': 'melodic', 'midi_min': 28, 'midi_max': 67, 'program': 33},
+    'other': {'kind': 'polyphonic', 'midi_min': 36, 'midi_max': 96, 'program': 0},
+    'drums': {'kind': 'drums', 'program': 0},
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> concurrent.futures.ProcessPoolExecutor:
+    """Shared worker pool, spawned so children don't inherit torch/CUDA state"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = min(len(STEM_PROFILES), os.cpu_count() or 1)
+            _pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _pool
+
+
+def recycle_pool_if_needed(threshold: int = MAX_STEM_WORKER_RSS_BYTES) -> bool:
+    """
+    Replace the worker pool when a worker's RSS passed the threshold
+    Work already submitted to the old pool still completes, new work goes to a fresh pool
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or not threshold:
+            return False
+        rss = pool_rss_bytes(_pool)
+        if not rss or max(rss.values()) <= threshold:
+            return False
+        old_pool, _pool = _pool, None
+
+    logger.warning(f"Recycling stem workers, largest RSS {max(rss.values()) / 1024 ** 2:.0f} MB")
+    old_pool.shutdown(wait=False)
+    return True
+
+
+def transcribe_melodic_stem(audio_path: str, bpm: int, midi_min: int, midi_max: int,
+                            pitch_tracker: str = DEFAULT_PITCH_TRACKER) -> NoteEvents:
+    """Monophonic HMM transcription of a pitched stem, narrowed to the notes the stem uses within its profile"""
+    extractor = MidiExtractor(midi_min, midi_max, adaptiveRange=True)
+    extractor.waveToMidi(audioPath=audio_path, bpm=bpm, pitchTracker=pitch_tracker)
+    return extractor.notes
+
+
+def transcribe_polyphonic_stem(audio_path: str, midi_min: int, midi_max: int, sr: int = 22050,
+                               hop_length: int = 512, max_voices: int = POLY_MAX_VOICES) -> NoteEvents:
+    """
+    Multi-pitch transcription of a stem with chords, from harmonic salience on a semitone CQT
+    Each frame keeps up to max_voices salience peaks whose fundamental bin itself sounds (so a chord's
+    shared harmonics don't add sub-octave notes) and that no stronger peak a harmonic below explains, and
+    a note is a run of one pitch over frames, split where the pitch's level jumps by POLY_REATTACK_DB
+    (a re-attack); a note doubled an octave (or twelfth) above a louder one is lost with the overtones
+    """
+    audio = librosa.load(audio_path, sr=sr)[0]
+    n_pitches = midi_max - midi_min + 1
+    harmonics = np.round(12 * np.log2(np.arange(1, POLY_HARMONICS + 1))).astype(int)
+
+    # Harmonics past Nyquist are left out of the CQT and count as silent
+    fmin = float(librosa.midi_to_hz(midi_min))
+    n_bins = min(n_pitches + harmonics[-1], int(12 * np.log2(sr / 2 / fmin)))
+    spectrum = np.abs(librosa.cqt(audio, sr=sr, hop_length=hop_length, fmin=fmin, n_bins=n_bins, bins_per_octave=12))
+    spectrum = np.pad(spectrum, ((0, n_pitches + harmonics[-1] - n_bins), (0, 0)))
+    if not spectrum.size or not spectrum.max():
+        return NoteEvents.empty()
+
+    salience = sum(POLY_HARMONIC_DECAY ** index * spectrum[offset:offset + n_pitches]
+                   for index, offset in enumerate(harmonics))
+    level = librosa.amplitude_to_db(salience, ref=np.max)
+    fundamental = librosa.amplitude_to_db(spectrum[:n_pitches], ref=np.max(spectrum))
+
+    # Peaks along pitch, loud enough, not an overtone of a stronger peak, and the strongest max_voices of each frame
+    padded = np.pad(salience, ((1, 1), (0, 0)))
+    active = ((salience >= padded[:-2]) & (salience > padded[2:]) &
+              (level > POLY_THRESHOLD_DB) & (fundamental > POLY_THRESHOLD_DB))
+    peaks = np.where(active, salience, 0.0)
+    for offset in harmonics[1:]:
+        active &= np.pad(peaks, ((offset, 0), (0, 0)))[:n_pitches] <= salience
+    if n_pitches > max_voices:
+        ranked = np.where(active, salience, 0.0)
+        kth = -np.partition(-ranked, max_voices - 1, axis=0)[max_voices - 1]
+        active &= ranked >= kth
+
+    # A note starts where its pitch turns on or is struck again, and ends at the next start or silence
+    n_frames = salience.shape[1]
+    reattack = np.diff(fundamental, axis=1, prepend=fundamental[:, :1]) > POLY_REATTACK_DB
+    starts = active & (~np.pad(active, ((0, 0), (1, 0)))[:, :-1] | reattack)
+    bounds = np.flatnonzero(np.pad(~active | starts, ((0, 0), (0, 1)), constant_values=True))
+    pitches, onsets = np.nonzero(starts)
+    rows = pitches * (n_frames + 1)
+    ends = bounds[np.searchsorted(bounds, rows + onsets, side='right')] - rows
+
+    keep = ends - onsets >= POLY_MIN_NOTE_SECONDS * sr / hop_length
+    pitches, onsets, ends = pitches[keep], onsets[keep], ends[keep]
+    strength = salience[pitches, onsets]
+    velocities = 1 + 126 * strength / (strength.max() + 1e-9) if len(strength) else strength
+
+    return NoteEvents(librosa.frames_to_time(onsets, sr=sr, hop_length=hop_length),
+                      librosa.frames_to_time(ends, sr=sr, hop_length=hop_length),
+                      midi_min + pitches, velocities).sorted()
+
+
+def transcribe_drum_stem(audio_path: str, sr: int = 22050, hop_length: int = 512,
+                         hit_length: float = 0.1) -> NoteEvents:
+    """
+    Onset-only drum transcription
+    Each detected hit is classified by which frequency band gained the most energy
+    relative to its average, and mapped to kick, snare or closed hi-hat
+    """
+    audio = librosa.load(audio_path, sr=sr)[0]
+
+    envelope = librosa.onset.onset_strength(y=audio, sr=sr, hop_length=hop_length)
+    frames = librosa.onset.onset_detect(onset_envelope=envelope, sr=sr, hop_length=hop_length)
+
+    if not len(frames):
+        return NoteEvents.empty()
+
+    spectrum = np.abs(librosa.stft(audio, n_fft=2048, hop_length=hop_length))
+    freqs = librosa.fft_frequencies(sr=sr, n_fft=2048)
+    bands = np.stack([
+        spectrum[freqs < 150].sum(axis=0),
+        spectrum[(freqs >= 150) & (freqs < 2000)].sum(axis=0),
+        spectrum[freqs >= 5000].sum(axis=0),
+    ])
+    bands = bands / (bands.mean(axis=1, keepdims=True) + 1e-9)
+
+    # Look a couple of frames past the onset so the attack is included
+    frames = np.minimum(frames, bands.shape[1] - 1)
+    attack = np.maximum(bands[:, frames], bands[:, np.minimum(frames + 2, bands.shape[1] - 1)])
+    keys = np.array([GM_KICK, GM_SNARE, GM_CLOSED_HIHAT])[np.argmax(attack, axis=0)]
+
+    strength = envelope[frames]
+    velocities = 1 + 126 * strength / (strength.max() + 1e-9)
+
+    times = librosa.frames_to_time(frames, sr=sr, hop_length=hop_length)
+    return NoteEvents(times, times + hit_length, keys, velocities)
+
+
+def _transcribe_stem(stem_name: str, audio_path: str, bpm: int, pitch_tracker: str) -> NoteEvents:
+    profile = STEM_PROFILES[stem_name]
+    if profile['kind'] == 'drums':
+        return transcribe_drum_stem(audio_path)
+    if profile['kind'] == 'polyphonic':
+        return transcribe_polyphonic_stem(audio_path, profile['midi_min'], profile['midi_max'])
+    return transcribe_melodic_stem(audio_path, bpm, profile['midi_min'], profile['midi_max'], pitch_tracker)
+
+
+def write_multitrack_midi(tracks: Dict[str, NoteEvents], bpm: float, out_path: str) -> str:
+    """Merge per-stem notes into one MIDI file with a track per stem"""
+    midi = StandardMidiFile(bpm)
+    melodic_channel = 0
+    for name in STEM_PROFILES:
+        if name not in tracks:
+            continue
+        if STEM_PROFILES[name]['kind'] == 'drums':
+            midi.add_track(tracks[name], name, DRUM_CHANNEL)
+        else:
+            midi.add_track(tracks[name], name, melodic_channel, STEM_PROFILES[name]['program'])
+            melodic_channel += 1
+
+    with atomic_path(out_path) as tmp_path, open(tmp_path, "wb") as outfile:
+        midi.write(outfile)
+    return out_path
+
+
+def submit_stem_transcriptions(stem_paths: Dict[str, str],
+                                bpm: int,
+                                pitch_tracker: str = DEFAULT_PITCH_TRACKER) -> Dict[concurrent.futures.Future, str]:
+    """
+    Schedule stem transcriptions on the worker pool and return immediately,
+    so the caller can transcribe another stem while these run
+    Stems without a profile are skipped
+    """
+    pool = _get_pool()
+    return {
+        pool.submit(_transcribe_stem, name, path, bpm, pitch_tracker): name
+        for name, path in stem_paths.items()
+        if name in STEM_PROFILES
+    }
+
+
+def collect_stem_transcriptions(futures: Dict[concurrent.futures.Future, str]) -> Dict[str, NoteEvents]:
+    """Wait for scheduled transcriptions, stems that failed are logged and left out"""
+    tracks = {}
+    for future in concurrent.futures.as_completed(futures):
+        name = futures[future]
+        try:
+            tracks[name] = future.result()
+            logger.info(f"Transcribed {name}: {len(tracks[name])} notes")
+        except Exception as e:
+            logger.error(f"Error transcribing {name}: {e}")
+    recycle_pool_if_needed()
+    return tracks
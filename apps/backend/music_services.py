@@ -1,10 +1,42 @@
+import time
 import requests
+import threading
+import contextvars
 import musicbrainzngs
-from typing import Dict, List, Optional
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 from functools import lru_cache
 import logging
 
 logger = logging.getLogger(__name__)
+
+# Seeds per playlist request, and threads fetching their similar tracks and candidate metadata
+MAX_PLAYLIST_SEEDS = 50
+PLAYLIST_WORKERS = 8
+
+
+class UpstreamCalls:
+    """Upstream API calls made on behalf of one request, cache hits excluded"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def add(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+
+_upstream_calls: contextvars.ContextVar = contextvars.ContextVar('upstream_calls', default=None)
+
+
+def _count_call(name: str) -> None:
+    calls = _upstream_calls.get()
+    if calls is not None:
+        calls.add(name)
+
+
 class LastFMService:
     def __init__(self, api_key: str):
         self.api_key = api_key
@@ -20,6 +52,7 @@ class LastFMService:
             'api_key': self.api_key,
             'format': 'json'
         }
+        _count_call('lastfm.track.getInfo')
         try:
             response = requests.get(self.base_url, params=params)
             response.raise_for_status()
@@ -40,6 +73,7 @@ class LastFMService:
             'api_key': self.api_key,
             'format': 'json'
         }
+        _count_call('lastfm.track.getSimilar')
         try:
             response = requests.get(self.base_url, params=params)
             response.raise_for_status()
@@ -71,6 +105,7 @@ class MusicBrainzService:
     @lru_cache(maxsize=100)
     def search_recording(self, title: str, artist: str) -> Optional[Dict]:
         """Search for a recording in MusicBrainz"""
+        _count_call('musicbrainz.search_recordings')
         try:
             result = musicbrainzngs.search_recordings(
                 query=f'recording:"{title}" AND artist:"{artist}"',
@@ -95,6 +130,10 @@ class RecommendationEngine:
 
     def _get_track_genres(self, artist: str, title: str) -> List[str]:
         """Get combined genres from both services"""
+        return self._get_track_metadata(artist, title)[0]
+
+    def _get_track_metadata(self, artist: str, title: str) -> Tuple[List[str], Optional[Dict]]:
+        """Combined genres from both services, and the MusicBrainz recording they came with"""
         genres = set()
         
         # Get LastFM genres
@@ -124,7 +163,20 @@ class RecommendationEngine:
             if genre in genre_mapping:
                 normalized_genres.update(genre_mapping[genre])
         
-        return list(normalized_genres)
+        return list(normalized_genres), mb_track
+
+    @staticmethod
+    def _track_artist(track: Dict) -> str:
+        return track.get('artist', {}).get('name', '') if isinstance(track.get('artist'), dict) else track.get('artist', '')
+
+    def _similar_tracks(self, artist: str, title: str, limit: int) -> List[Dict]:
+        """LastFM similar tracks of a seed, retrying with the raw input like get_recommendations"""
+        response = self.lastfm.get_similar_tracks(self._clean_input(artist), self._clean_input(title), limit)
+        similar_tracks = response.get('similartracks', {}).get('track', [])
+        if not similar_tracks and 'error' in response:
+            response = self.lastfm.get_similar_tracks(artist, title, limit)
+            similar_tracks = response.get('similartracks', {}).get('track', [])
+        return [track for track in similar_tracks if isinstance(track, dict)]
 
     def _matches_genre_filter(self, track_genres: List[str], genre_filter: List[str]) -> bool:
         """Check if track matches any genre in filter"""
@@ -201,4 +253,78 @@ class RecommendationEngine:
         except Exception as e:
             logger.error(f"Error getting recommendations: {e}")
             logger.exception("Full traceback:")
-            return []
\ No newline at end of file
+            return []
+
+    def get_playlist_recommendations(self, seeds: List[Dict], limit: int = 20,
+                                     genre_filter: Optional[List[str]] = None) -> Dict:
+        """
+        Recommendations for a set of seed tracks (a playlist) in one pass
+        Similar tracks of all seeds are fetched concurrently and merged: a candidate's similarity is
+        its match summed over the seeds divided by the number of seeds, so tracks close to several
+        seeds rank first. Seeds and duplicates are dropped, and each remaining candidate's genres
+        and MusicBrainz record are looked up once, concurrently, in rank order
+        Returns the recommendations with the request's latency and upstream call counts
+        """
+        started = time.perf_counter()
+        calls = UpstreamCalls()
+        token = _upstream_calls.set(calls)
+        try:
+            unique_seeds = {}
+            for seed in seeds:
+                key = (self._clean_input(seed['artist']).lower(), self._clean_input(seed['title']).lower())
+                unique_seeds.setdefault(key, seed)
+
+            with ThreadPoolExecutor(max_workers=PLAYLIST_WORKERS) as pool:
+                # Each task runs in a copy of this context, so its upstream calls are counted here
+                futures = [pool.submit(contextvars.copy_context().run, self._similar_tracks,
+                                       seed['artist'], seed['title'], limit * 2)
+                           for seed in unique_seeds.values()]
+                similar_lists = [future.result() for future in futures]
+
+                candidates = {}
+                for similar_tracks in similar_lists:
+                    for track in similar_tracks:
+                        artist, title = self._track_artist(track), track.get('name', '')
+                        key = (artist.strip().lower(), title.strip().lower())
+                        if not artist or not title or key in unique_seeds:
+                            continue
+                        candidate = candidates.setdefault(key, {'title': title, 'artist': artist,
+                                                                'score': 0.0, 'seeds': 0})
+                        candidate['score'] += float(track.get('match', 0.5))
+                        candidate['seeds'] += 1
+
+                ranked = sorted(candidates.values(), key=lambda c: (-c['score'], -c['seeds']))
+                # Same cap on metadata lookups as the single-seed path
+                ranked = ranked[:limit * 3]
+                metadata = list(pool.map(
+                    lambda c, context: context.run(self._get_track_metadata, c['artist'], c['title']),
+                    ranked, [contextvars.copy_context() for _ in ranked]
+                ))
+
+            recommendations = []
+            for candidate, (track_genres, mb_track) in zip(ranked, metadata):
+                if not self._matches_genre_filter(track_genres, genre_filter):
+                    continue
+                recommendations.append({
+                    'title': candidate['title'],
+                    'artist': candidate['artist'],
+                    'similarity': round(candidate['score'] / len(unique_seeds), 4),
+                    'seed_matches': candidate['seeds'],
+                    'genres': sorted(track_genres),
+                    'sources': ['LastFM', 'MusicBrainz'] if mb_track else ['LastFM']
+                })
+                if len(recommendations) >= limit:
+                    break
+        finally:
+            _upstream_calls.reset(token)
+
+        stats = {
+            'seeds': len(unique_seeds),
+            'candidates': len(candidates),
+            'latency_ms': round((time.perf_counter() - started) * 1000, 1),
+            'upstream_calls': dict(calls.counts),
+            'upstream_calls_total': sum(calls.counts.values())
+        }
+        logger.info(f"Playlist recommendations for {stats['seeds']} seeds: {len(recommendations)} results, "
+                    f"{stats['upstream_calls_total']} upstream calls, {stats['latency_ms']} ms")
+        return {'recommendations': recommendations, 'stats': stats}
\ No newline at end of file
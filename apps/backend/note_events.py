@@ -0,0 +1,173 @@
+import struct
+import numpy as np
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Binary export: little-endian header followed by the column arrays
+# magic, version, count, then onset/offset as float32 seconds, midi and velocity as uint8
+EVENTS_HEADER_FORMAT = '<4sBxxxI'
+EVENTS_MAGIC = b'VNTE'
+EVENTS_VERSION = 1
+
+DEFAULT_PPQ = 960
+
+
+@dataclass
+class NoteEvents:
+    """Struct-of-arrays note list, one entry per note, times in seconds"""
+    onset: np.ndarray
+    offset: np.ndarray
+    midi: np.ndarray
+    velocity: np.ndarray
+
+    def __post_init__(self):
+        self.onset = np.asarray(self.onset, dtype=np.float64)
+        self.offset = np.asarray(self.offset, dtype=np.float64)
+        self.midi = np.clip(np.asarray(self.midi), 0, 127).astype(np.uint8)
+        self.velocity = np.clip(np.asarray(self.velocity), 0, 127).astype(np.uint8)
+
+    @classmethod
+    def empty(cls) -> 'NoteEvents':
+        return cls(np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0))
+
+    @classmethod
+    def concatenate(cls, events: Sequence['NoteEvents']) -> 'NoteEvents':
+        if not events:
+            return cls.empty()
+        return cls(np.concatenate([e.onset for e in events]),
+                   np.concatenate([e.offset for e in events]),
+                   np.concatenate([e.midi for e in events]),
+                   np.concatenate([e.velocity for e in events]))
+
+    def __len__(self) -> int:
+        return len(self.onset)
+
+    def __getitem__(self, index) -> 'NoteEvents':
+        return NoteEvents(self.onset[index], self.offset[index], self.midi[index], self.velocity[index])
+
+    def sorted(self) -> 'NoteEvents':
+        return self[np.argsort(self.onset, kind='stable')]
+
+    def shifted(self, seconds: float) -> 'NoteEvents':
+        return NoteEvents(self.onset + seconds, self.offset + seconds, self.midi, self.velocity)
+
+    def note_names(self) -> List[str]:
+        import librosa
+        return [librosa.midi_to_note(int(m)) for m in self.midi]
+
+    def to_dict(self) -> Dict[str, list]:
+        return {
+            'onset': self.onset.tolist(),
+            'offset': self.offset.tolist(),
+            'midi': self.midi.tolist(),
+            'velocity': self.velocity.tolist()
+        }
+
+    def to_bytes(self) -> bytes:
+        return b''.join((
+            struct.pack(EVENTS_HEADER_FORMAT, EVENTS_MAGIC, EVENTS_VERSION, len(self)),
+            self.onset.astype('<f4').tobytes(),
+            self.offset.astype('<f4').tobytes(),
+            self.midi.tobytes(),
+            self.velocity.tobytes()
+        ))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'NoteEvents':
+        magic, version, count = struct.unpack_from(EVENTS_HEADER_FORMAT, data)
+        if magic != EVENTS_MAGIC or version != EVENTS_VERSION:
+            raise ValueError("Unsupported note events format")
+
+        position = struct.calcsize(EVENTS_HEADER_FORMAT)
+        columns = []
+        for dtype in ('<f4', '<f4', 'u1', 'u1'):
+            column = np.frombuffer(data, dtype=dtype, count=count, offset=position)
+            position += column.nbytes
+            columns.append(column)
+        return cls(*columns)
+
+
+def _vlq(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Variable-length quantities for an array of non-negative ints below 2**28
+    Returns an (n, 4) byte matrix, right-aligned, and the mask of used bytes
+    """
+    values = np.asarray(values, dtype=np.int64)
+    shifts = np.array([21, 14, 7, 0])
+    groups = (values[:, None] >> shifts) & 0x7f
+    groups[:, :3] |= 0x80
+
+    lengths = 1 + (values >= 1 << 7) + (values >= 1 << 14) + (values >= 1 << 21)
+    mask = np.arange(4)[None, :] >= (4 - lengths)[:, None]
+    return groups.astype(np.uint8), mask
+
+
+def _vlq_bytes(value: int) -> bytes:
+    groups, mask = _vlq(np.array([value]))
+    return groups[mask].tobytes()
+
+
+def _meta(kind: int, payload: bytes) -> bytes:
+    return b'\x00\xff' + bytes([kind]) + _vlq_bytes(len(payload)) + payload
+
+
+class StandardMidiFile:
+    """
+    Minimal format 1 Standard MIDI File writer
+    Note events of a track are encoded with NumPy in one pass instead of one call per note
+    """
+
+    def __init__(self, bpm: float, ppq: int = DEFAULT_PPQ):
+        self.bpm = bpm
+        self.ppq = ppq
+        self.tracks = []
+
+    def add_track(self, events: NoteEvents, name: Optional[str] = None,
+                  channel: int = 0, program: Optional[int] = None) -> None:
+        self.tracks.append((events, name, channel, program))
+
+    def _encode_notes(self, events: NoteEvents, channel: int) -> bytes:
+        if not len(events):
+            return b''
+
+        ticks_per_second = self.bpm / 60 * self.ppq
+        on_ticks = np.round(events.onset * ticks_per_second).astype(np.int64)
+        off_ticks = np.maximum(np.round(events.offset * ticks_per_second).astype(np.int64), on_ticks)
+
+        n = len(events)
+        ticks = np.concatenate((off_ticks, on_ticks))
+        is_on = np.concatenate((np.zeros(n, dtype=bool), np.ones(n, dtype=bool)))
+        status = np.where(is_on, 0x90 | channel, 0x80 | channel).astype(np.uint8)
+        pitch = np.concatenate((events.midi, events.midi))
+        velocity = np.concatenate((np.zeros(n, dtype=np.uint8), events.velocity))
+
+        # Note-offs sort before note-ons on the same tick so repeated notes aren't cut
+        order = np.lexsort((is_on, ticks))
+        deltas = np.diff(ticks[order], prepend=0)
+
+        vlq, vlq_mask = _vlq(deltas)
+        messages = np.column_stack((status[order], pitch[order], velocity[order]))
+        rows = np.hstack((vlq, messages))
+        mask = np.hstack((vlq_mask, np.ones(messages.shape, dtype=bool)))
+        return rows[mask].tobytes()
+
+    def _encode_track(self, index: int, events: NoteEvents, name: Optional[str],
+                      channel: int, program: Optional[int]) -> bytes:
+        data = b''
+        if name:
+            data += _meta(0x03, name.encode('utf-8'))
+        if index == 0:
+            data += _meta(0x51, int(round(60_000_000 / self.bpm)).to_bytes(3, 'big'))
+        if program is not None:
+            data += bytes([0x00, 0xc0 | channel, program])
+        data += self._encode_notes(events, channel)
+        data += b'\x00\xff\x2f\x00'
+        return b'MTrk' + struct.pack('>I', len(data)) + data
+
+    def to_bytes(self) -> bytes:
+        tracks = self.tracks or [(NoteEvents.empty(), None, 0, None)]
+        header = b'MThd' + struct.pack('>IHHH', 6, 1, len(tracks), self.ppq)
+        return header + b''.join(self._encode_track(i, *track) for i, track in enumerate(tracks))
+
+    def write(self, outfile) -> None:
+        outfile.write(self.to_bytes())
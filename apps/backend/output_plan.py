@@ -0,0 +1,71 @@
+from dataclasses import dataclass
+from typing import FrozenSet, Iterable, Optional, Tuple
+
+# Outputs a /process request can ask for, and what a request without `outputs` gets
+STEM_OUTPUTS = ('vocals', 'instrumental', 'drums', 'bass', 'other', 'lead_vocals', 'backing_vocals')
+OUTPUTS = ('tempo', *STEM_OUTPUTS, 'midi', 'contour')
+DEFAULT_OUTPUTS = ('tempo', 'drums', 'bass', 'other', 'lead_vocals', 'backing_vocals', 'midi', 'contour')
+
+# Separation: four Demucs stems, or a vocal/instrumental split when no drums, bass or other stem is wanted
+FOUR_STEM = 'four_stem'
+TWO_STEM = 'two_stem'
+
+
+@dataclass(frozen=True)
+class OutputPlan:
+    """The pipeline stages a set of requested outputs needs"""
+    outputs: FrozenSet[str]
+    tempo: bool
+    separation: Optional[str]
+    split_vocals: bool
+    transcribe: bool
+    multitrack: bool
+
+    @property
+    def stems(self) -> Tuple[str, ...]:
+        """Requested stems, in a stable order"""
+        return tuple(name for name in STEM_OUTPUTS if name in self.outputs)
+
+    @property
+    def stages(self) -> Tuple[str, ...]:
+        """Stage names, as weighted by the scheduler's cost estimate"""
+        return tuple(stage for stage, needed in (
+            ('tempo', self.tempo),
+            (self.separation, self.separation is not None),
+            ('split_vocals', self.split_vocals),
+            ('transcribe', self.transcribe)
+        ) if needed)
+
+
+def plan_outputs(outputs: Optional[Iterable[str]] = None,
+                 multitrack: bool = False,
+                 note_formats: Iterable[str] = ()) -> OutputPlan:
+    """
+    Work out the stages behind the requested outputs; None asks for everything the full pipeline produces
+    The lead MIDI (and the contour, which comes with it) needs the tempo, the lead/backing split and
+    hence some separation; multi-track MIDI needs all four stems and the backing vocals
+    """
+    outputs = frozenset(DEFAULT_OUTPUTS if outputs is None else outputs)
+    unknown = outputs - set(OUTPUTS)
+    if unknown:
+        raise ValueError(f"Unknown outputs {sorted(unknown)}, expected any of {list(OUTPUTS)}")
+    if not outputs and not multitrack:
+        raise ValueError("At least one output is required")
+
+    transcribe = bool(outputs & {'midi', 'contour'} or note_formats or multitrack)
+    split_vocals = bool(outputs & {'lead_vocals', 'backing_vocals'}) or transcribe
+    if multitrack or outputs & {'drums', 'bass', 'other'}:
+        separation = FOUR_STEM
+    elif split_vocals or outputs & {'vocals', 'instrumental'}:
+        separation = TWO_STEM
+    else:
+        separation = None
+
+    return OutputPlan(
+        outputs=outputs,
+        tempo='tempo' in outputs or transcribe,
+        separation=separation,
+        split_vocals=split_vocals,
+        transcribe=transcribe,
+        multitrack=multitrack
+    )
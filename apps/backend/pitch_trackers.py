@@ -0,0 +1,222 @@
+import sys
+import time
+import logging
+import numpy as np
+import librosa
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+
+class PitchTracker(ABC):
+    """
+    Frame-wise f0 estimation
+    Every backend returns one value per hop (centered frames, like librosa),
+    with NaN pitch wherever the frame is unvoiced
+    """
+    name = None
+
+    @abstractmethod
+    def track(self,
+              audio: np.ndarray,
+              sr: int,
+              fmin: float,
+              fmax: float,
+              frame_length: int,
+              hop_length: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            Tuple of (pitch in Hz, voiced flags)
+        """
+
+
+class PyinTracker(PitchTracker):
+    """Probabilistic YIN, the most accurate and slowest backend"""
+    name = 'pyin'
+
+    def track(self, audio, sr, fmin, fmax, frame_length, hop_length):
+        pitch, voiced, _ = librosa.pyin(y=audio,
+                                        fmin=fmin,
+                                        fmax=fmax,
+                                        sr=sr,
+                                        frame_length=frame_length,
+                                        win_length=int(frame_length / 2),
+                                        hop_length=hop_length
+                                        )
+        return pitch, voiced
+
+
+class YinTracker(PitchTracker):
+    """Plain YIN with an energy gate for voicing, no HMM over pitch candidates"""
+    name = 'yin'
+
+    def __init__(self, top_db: float = 35.0):
+        self.top_db = top_db
+
+    def track(self, audio, sr, fmin, fmax, frame_length, hop_length):
+        pitch = librosa.yin(audio,
+                            fmin=fmin,
+                            fmax=fmax,
+                            sr=sr,
+                            frame_length=frame_length,
+                            win_length=int(frame_length / 2),
+                            hop_length=hop_length
+                            )
+        rms = librosa.feature.rms(y=audio, frame_length=frame_length, hop_length=hop_length)[0]
+        rms_db = librosa.amplitude_to_db(rms, ref=np.max)
+
+        voiced = rms_db > -self.top_db
+        pitch = np.where(voiced, pitch, np.nan)
+        return pitch, voiced
+
+
+class CrepeTracker(PitchTracker):
+    """torchcrepe on CPU, batched, with the tiny model by default"""
+    name = 'crepe'
+
+    def __init__(self, model: str = 'tiny', batch_size: int = 2048, periodicity_threshold: float = 0.21):
+        self.model = model
+        self.batch_size = batch_size
+        self.periodicity_threshold = periodicity_threshold
+
+    def track(self, audio, sr, fmin, fmax, frame_length, hop_length):
+        import torch
+        import torchcrepe
+
+        with torch.no_grad():
+            pitch, periodicity = torchcrepe.predict(torch.from_numpy(audio).float().unsqueeze(0),
+                                                    sr,
+                                                    hop_length,
+                                                    fmin,
+                                                    fmax,
+                                                    self.model,
+                                                    return_periodicity=True,
+                                                    batch_size=self.batch_size,
+                                                    device='cpu'
+                                                    )
+
+        pitch = pitch.squeeze(0).numpy().astype(np.float64)
+        periodicity = periodicity.squeeze(0).numpy()
+
+        # Match librosa's centered frame count
+        n_frames = 1 + len(audio) // hop_length
+        padding = (0, max(n_frames - len(pitch), 0))
+        pitch = np.pad(pitch, padding, mode='edge')[:n_frames]
+        periodicity = np.pad(periodicity, padding, mode='edge')[:n_frames]
+
+        voiced = periodicity >= self.periodicity_threshold
+        pitch = np.where(voiced, pitch, np.nan)
+        return pitch, voiced
+
+
+PITCH_TRACKERS = {
+    PyinTracker.name: PyinTracker,
+    YinTracker.name: YinTracker,
+    CrepeTracker.name: CrepeTracker,
+}
+
+DEFAULT_PITCH_TRACKER = PyinTracker.name
+
+
+def get_pitch_tracker(name: str = DEFAULT_PITCH_TRACKER) -> PitchTracker:
+    if name not in PITCH_TRACKERS:
+        raise ValueError(f"Unknown pitch tracker '{name}', expected one of {sorted(PITCH_TRACKERS)}")
+    return PITCH_TRACKERS[name]()
+
+
+def synthetic_line(sr: int = 22050, notes: int = 24, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, List[Tuple[float, int]]]:
+    """
+    A sung-like test line: harmonic tones with vibrato and gaps
+    Returns the audio, its true f0 per sample (NaN in the gaps) and the (onset, midi) of every note
+    """
+    rng = np.random.default_rng(seed)
+    audio = []
+    f0s = []
+    truth = []
+    position = 0.0
+    for _ in range(notes):
+        midi = int(rng.integers(48, 72))
+        duration = float(rng.uniform(0.2, 0.6))
+        gap = float(rng.choice([0.0, 0.1, 0.25]))
+        t = np.arange(int(duration * sr)) / sr
+        f0 = 440.0 * 2 ** ((midi - 69) / 12) * 2 ** (0.3 * np.sin(2 * np.pi * 5.5 * t) / 12)
+        phase = 2 * np.pi * np.cumsum(f0) / sr
+        tone = sum(np.sin(k * phase) / k for k in range(1, 5)) * 0.3
+        envelope = np.minimum(1, np.minimum(t / 0.02, (duration - t) / 0.03))
+        audio.append(tone * envelope)
+        f0s.append(f0)
+        truth.append((position, midi))
+        position += duration
+        audio.append(np.zeros(int(gap * sr)))
+        f0s.append(np.full(int(gap * sr), np.nan))
+        position += int(gap * sr) / sr
+    audio = np.concatenate(audio)
+    audio += rng.normal(0, 0.002, len(audio))
+    return audio.astype(np.float32), np.concatenate(f0s), truth
+
+
+def benchmark(audio_paths: Optional[List[str]] = None,
+              sr: int = 22050,
+              frame_length: int = 2048,
+              hop_length: int = 512,
+              fmin: float = librosa.note_to_hz('C2') * 0.9,
+              fmax: float = librosa.note_to_hz('C6') * 1.1) -> Dict[str, Dict[str, float]]:
+    """
+    Compare every backend on the synthetic line against its known f0, or on audio_paths against pYIN
+    Reports raw pitch accuracy (within 50 cents on reference voiced frames), mean cents error,
+    voicing agreement and processing seconds per minute of audio
+    """
+    if audio_paths:
+        fixtures = [(librosa.load(path, sr=sr)[0], None) for path in audio_paths]
+    else:
+        audio, f0, _ = synthetic_line(sr)
+        # Centered frames: frame i is centered on sample i * hop_length
+        n_frames = 1 + len(audio) // hop_length
+        fixtures = [(audio, f0[np.minimum(np.arange(n_frames) * hop_length, len(f0) - 1)])]
+
+    totals = {name: {'seconds': 0.0, 'correct': 0, 'reference_voiced': 0, 'cents': 0.0, 'both_voiced': 0,
+                     'voicing_agree': 0, 'frames': 0}
+              for name in PITCH_TRACKERS}
+    audio_seconds = 0.0
+
+    for audio, reference_pitch in fixtures:
+        audio_seconds += len(audio) / sr
+
+        results = {}
+        for name in PITCH_TRACKERS:
+            start = time.perf_counter()
+            results[name] = get_pitch_tracker(name).track(audio, sr, fmin, fmax, frame_length, hop_length)
+            totals[name]['seconds'] += time.perf_counter() - start
+
+        if reference_pitch is None:
+            reference_pitch = results[PyinTracker.name][0]
+        reference_voiced = ~np.isnan(reference_pitch)
+        for name, (pitch, voiced) in results.items():
+            both = reference_voiced & voiced
+            cents = 1200 * np.abs(np.log2(pitch[both] / reference_pitch[both]))
+            totals[name]['correct'] += int(np.sum(cents <= 50))
+            totals[name]['reference_voiced'] += int(np.sum(reference_voiced))
+            totals[name]['cents'] += float(np.sum(cents))
+            totals[name]['both_voiced'] += int(np.sum(both))
+            totals[name]['voicing_agree'] += int(np.sum(reference_voiced == voiced))
+            totals[name]['frames'] += len(voiced)
+
+    report = {}
+    for name, total in totals.items():
+        report[name] = {
+            'raw_pitch_accuracy': total['correct'] / max(total['reference_voiced'], 1),
+            'mean_cents_error': total['cents'] / max(total['both_voiced'], 1),
+            'voicing_agreement': total['voicing_agree'] / max(total['frames'], 1),
+            'seconds_per_minute': total['seconds'] / max(audio_seconds / 60, 1e-9)
+        }
+    return report
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    # Without files, score against the synthetic line's ground truth; with files, against pYIN
+    print(f"Reference: {'pyin' if len(sys.argv) > 1 else 'synthetic ground truth'}")
+    for name, stats in benchmark(sys.argv[1:]).items():
+        print(f"{name:>6}: pitch accuracy {stats['raw_pitch_accuracy']:.3f}, "
+              f"mean error {stats['mean_cents_error']:.1f} cents, "
+              f"voicing agreement {stats['voicing_agreement']:.3f}, "
+              f"{stats['seconds_per_minute']:.2f} s per minute of audio")
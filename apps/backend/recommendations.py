@@ -0,0 +1,129 @@
+from flask import Blueprint, request, jsonify
+import os
+import logging
+import threading
+from music_services import LastFMService, MusicBrainzService, RecommendationEngine, MAX_PLAYLIST_SEEDS
+
+logger = logging.getLogger(__name__)
+recommendations_bp = Blueprint('recommendations', __name__)
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_recommendation_engine() -> RecommendationEngine:
+    """Create the recommendation services on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            lastfm_service = LastFMService(os.getenv('LASTFM_API_KEY'))
+            musicbrainz_service = MusicBrainzService(
+                "YourAppName",
+                "1.0",
+                os.getenv('CONTACT_EMAIL', 'your@email.com')
+            )
+            _engine = RecommendationEngine(lastfm_service, musicbrainz_service)
+        return _engine
+
+@recommendations_bp.route('/recommendations', methods=['POST'])
+def get_recommendations():
+    logger.info("Received recommendation request")
+    try:
+        data = request.json
+        logger.info(f"Request data: {data}")
+
+        if not data:
+            logger.error("No data provided in request")
+            return jsonify({'status': 'error', 'message': 'No data provided'}), 400
+        
+        if 'title' not in data or 'artist' not in data:
+            logger.error("Missing title or artist in request")
+            return jsonify({'status': 'error', 'message': 'Missing title or artist'}), 400
+
+        # Get optional filters
+        genre_filter = data.get('genres', [])
+        limit = data.get('limit', 10)
+
+        logger.info(f"Making recommendation request with filters: genres={genre_filter}, limit={limit}")
+
+        # Get recommendations
+        recommendations = get_recommendation_engine().get_recommendations(
+            data['title'],
+            data['artist'],
+            limit=limit,
+            genre_filter=genre_filter
+        )
+
+        logger.info(f"Got recommendations: {recommendations}")
+
+        if not recommendations:
+            logger.warning("No recommendations found")
+            return jsonify({
+                'status': 'success',
+                'recommendations': [],
+                'message': 'No recommendations found for this track.'
+            })
+
+        return jsonify({
+            'status': 'success',
+            'recommendations': recommendations
+        })
+
+    except Exception as e:
+        logger.error(f"Error processing request: {e}")
+        logger.exception("Full traceback:")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@recommendations_bp.route('/recommendations/batch', methods=['POST'])
+def get_playlist_recommendations():
+    """
+    Recommendations for several seeds at once: {"seeds": [{"title", "artist"}, ...], "limit", "genres"}
+    Candidates similar to several seeds rank first, each candidate is looked up once,
+    and the response reports latency and upstream calls
+    """
+    logger.info("Received playlist recommendation request")
+    try:
+        data = request.get_json(silent=True) or {}
+        seeds = data.get('seeds')
+        if not isinstance(seeds, list) or not seeds:
+            return jsonify({'status': 'error', 'message': 'Missing seeds'}), 400
+        if len(seeds) > MAX_PLAYLIST_SEEDS:
+            return jsonify({'status': 'error', 'message': f'Too many seeds (limit {MAX_PLAYLIST_SEEDS})'}), 400
+        if not all(isinstance(seed, dict) and seed.get('title') and seed.get('artist') for seed in seeds):
+            return jsonify({'status': 'error', 'message': 'Every seed needs a title and artist'}), 400
+
+        result = get_recommendation_engine().get_playlist_recommendations(
+            seeds,
+            limit=data.get('limit', 20),
+            genre_filter=data.get('genres', [])
+        )
+        return jsonify({'status': 'success', **result})
+
+    except Exception as e:
+        logger.error(f"Error processing playlist request: {e}")
+        logger.exception("Full traceback:")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@recommendations_bp.route('/genres', methods=['GET'])
+def get_genres():
+    """Get available genres for filtering"""
+    try:
+        genres = [
+            "Rock", "Pop", "Hip Hop", "Jazz", "Classical", "Electronic",
+            "Folk", "Country", "R&B", "Metal", "Blues", "Reggae"
+        ]
+        return jsonify({
+            'status': 'success',
+            'genres': genres
+        })
+    except Exception as e:
+        logger.error(f"Error getting genres: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
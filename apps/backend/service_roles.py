@@ -0,0 +1,67 @@
+import os
+import sys
+import json
+import subprocess
+from typing import Dict, List
+
+# Independently deployable roles of the backend
+# metadata: recommendations and genres, no audio stack
+# audio: download, separation and transcription worker
+METADATA = 'metadata'
+AUDIO = 'audio'
+ALL_ROLES = (METADATA, AUDIO)
+
+# Modules a role loads on its first real request, measured as its working footprint
+ROLE_PRELOADS = {
+    METADATA: [],
+    AUDIO: ['song_features_retriever'],
+}
+
+_MEASURE_SCRIPT = """
+import json, resource, sys, time
+start = time.perf_counter()
+import app
+import_seconds = time.perf_counter() - start
+import_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+start = time.perf_counter()
+for module in sys.argv[1:]:
+    __import__(module)
+print(json.dumps({
+    'import_seconds': round(import_seconds, 3),
+    'import_max_rss_mb': round(import_rss, 1),
+    'loaded_seconds': round(import_seconds + time.perf_counter() - start, 3),
+    'loaded_max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    'modules': len(sys.modules)
+}))
+"""
+
+
+def parse_roles(value: str) -> List[str]:
+    """Parse a comma separated SERVICE_ROLES value, defaulting to every role"""
+    roles = [role.strip().lower() for role in (value or '').split(',') if role.strip()]
+    unknown = set(roles) - set(ALL_ROLES)
+    if unknown:
+        raise ValueError(f"Unknown service roles {sorted(unknown)}, expected some of {list(ALL_ROLES)}")
+    return roles or list(ALL_ROLES)
+
+
+def measure_role(role: str) -> Dict:
+    """Import the app in a fresh interpreter with a single role and report its time and memory"""
+    env = dict(os.environ, SERVICE_ROLES=role, WARMUP='0')
+    output = subprocess.run(
+        [sys.executable, '-c', _MEASURE_SCRIPT, *ROLE_PRELOADS[role]],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    for role in parse_roles(','.join(sys.argv[1:])):
+        stats = measure_role(role)
+        print(f"{role:>8}: import {stats['import_seconds']:.2f} s / {stats['import_max_rss_mb']:.0f} MB, "
+              f"loaded {stats['loaded_seconds']:.2f} s / {stats['loaded_max_rss_mb']:.0f} MB, "
+              f"{stats['modules']} modules")
@@ -1,14 +1,25 @@
 import librosa
 import os
-from typing import Dict, Tuple
+import time
+import shutil
+from typing import Callable, Dict, Optional, Sequence, Tuple
 import logging
-from demucs.apply import apply_model
-import torch
 import traceback
 import numpy as np
-from midi_extractor import MidiExtractor
-from stem_separator import StemSeparator
+import soundfile as sf
 import json
+from midi_extractor import MidiExtractor
+from pitch_trackers import DEFAULT_PITCH_TRACKER
+from stem_separator import StemSeparator, PREVIEW_SEPARATION_MODEL
+from melody_contour import save_contour
+from artifact_store import ArtifactStore, atomic_path, job_id_for
+from memory_guard import ByteLRUCache, MemoryTracker, check_worker_memory
+from multitrack_transcriber import submit_stem_transcriptions, collect_stem_transcriptions, write_multitrack_midi
+from viewer_tiles import build_peak_pyramids, build_notes_index, notes_index_path
+from fingerprint_index import Fingerprint, FingerprintIndex, FingerprintMatch, fingerprint_file
+from vocal_activity import activity_stats
+from output_plan import OutputPlan, plan_outputs, FOUR_STEM, TWO_STEM
+from job_scheduler import FULL, PREVIEW, PREVIEW_SECONDS
 
 logging.basicConfig(
     level=logging.INFO,
@@ -16,23 +27,98 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Pitch, onsets and RMS of the lead vocals, kept so the HMM stage can be rerun alone
+FEATURES_FILE = "features.npz"
+
+# Pitch search range of the lead vocal, C1 to C7: the HMM itself only covers each song's own range
+LEAD_SEARCH_RANGE = (24, 96)
+
+# Only the regions where the lead stem carries voice are transcribed, VOCAL_GATE=0 transcribes every frame
+VOCAL_GATE = os.getenv('VOCAL_GATE', '1') == '1'
+
+# Decoded songs at their native rate, shared across processors and bounded by size
+AUDIO_CACHE_BYTES = int(float(os.getenv('SONG_AUDIO_CACHE_MB', '256')) * 1024 ** 2)
+_audio_cache = ByteLRUCache(AUDIO_CACHE_BYTES, 'song_audio')
+
+# Uploads matching an already processed recording reuse its stems and features, FINGERPRINT_DEDUPE=0 disables it
+FINGERPRINT_DEDUPE = os.getenv('FINGERPRINT_DEDUPE', '1') == '1'
+FINGERPRINTS_FILE = "fingerprints.db"
+# Offsets below this are treated as the same start, so files are linked rather than re-cut
+ALIGNED_SECONDS = 0.05
+REUSED_STEMS = ('drums', 'bass', 'other', 'lead_vocals', 'backing_vocals')
+# Separated stems are MP3, the mixed instrumental WAV; the first existing one is a job's stem file
+STEM_EXTENSIONS = ('.mp3', '.wav')
+
+# Previews transcribe the loudest PREVIEW_SECONDS of a song, cut to a wav in the job directory while they run
+PREVIEW_EXCERPT_FILE = "preview_excerpt.wav"
+PREVIEW_PITCH_TRACKER = 'yin'
+# Candidate excerpt starts are this far apart
+EXCERPT_STEP_SECONDS = 0.1
+
+def select_excerpt(audio: np.ndarray, sr: int, seconds: float) -> Tuple[int, int]:
+    """Sample range of the highest-energy window of `seconds`, the whole song if it is shorter"""
+    length = int(seconds * sr)
+    if len(audio) <= length:
+        return 0, len(audio)
+    energy = np.concatenate(([0.0], np.cumsum(np.square(audio, dtype=np.float64))))
+    starts = np.arange(0, len(audio) - length + 1, max(int(EXCERPT_STEP_SECONDS * sr), 1))
+    start = int(starts[np.argmax(energy[starts + length] - energy[starts])])
+    return start, start + length
+
 class SongFeaturesRetriever:
-    def __init__(self, temp_dir: str):
+    def __init__(self, temp_dir: str, artifact_store: Optional[ArtifactStore] = None):
         self.temp_dir = temp_dir
-        self.midi_extractor = MidiExtractor()
+        self.artifact_store = artifact_store
+        self.midi_extractor = MidiExtractor(*LEAD_SEARCH_RANGE, adaptiveRange=True, vocalGate=VOCAL_GATE)
         self.stem_separator = StemSeparator()
-        self._audio_cache = {}
+        self._audio_cache = _audio_cache
+        self._fingerprints = None
         
     def _load_audio(self, audio_path: str) -> Tuple[np.ndarray, int]:
-        if audio_path not in self._audio_cache:
-            y, sr = librosa.load(audio_path, sr=None)  # Use native sampling rate
-            self._audio_cache[audio_path] = (y, sr)
-        return self._audio_cache[audio_path]
+        y_sr = self._audio_cache.get(audio_path)
+        if y_sr is None:
+            y_sr = self._audio_cache.put(audio_path, librosa.load(audio_path, sr=None))  # Use native sampling rate
+        return y_sr
     
-    def process_song(self, audio_path: str, artist: str = None, title: str = None) -> Dict:
+    def process_song(self, audio_path: str, artist: str = None, title: str = None,
+                     pitch_tracker: str = DEFAULT_PITCH_TRACKER, multitrack: bool = False,
+                     note_formats: Sequence[str] = (), job_id: Optional[str] = None,
+                     on_stage: Optional[Callable[[str, Dict], None]] = None, quality: str = FULL,
+                     outputs: Optional[Sequence[str]] = None) -> Dict:
         """
         Main processing pipeline with enhanced error handling and logging
+        on_stage is called with (stage name, partial results) as each stage finishes
+        The job's RSS (and tracemalloc peak with MEMORY_TRACE=1) is reported under 'memory'
+        quality=PREVIEW only transcribes the loudest excerpt, see _process_preview
+        outputs selects what to produce (see output_plan), only the stages they need run; None produces everything
         """
+        job_id = job_id or job_id_for(audio_path)
+        try:
+            with MemoryTracker(job_id) as tracker:
+                if quality == PREVIEW:
+                    result = self._process_preview(audio_path, artist, title, note_formats, job_id)
+                else:
+                    result = self._process_song(audio_path, artist, title, pitch_tracker,
+                                                plan_outputs(outputs, multitrack, note_formats),
+                                                note_formats, job_id, on_stage)
+            result['quality'] = quality
+            result['memory'] = tracker.to_dict()
+            return result
+        finally:
+            # Separation models are reloaded for every song, keeping them between jobs only costs memory
+            self.stem_separator.release_models()
+            check_worker_memory(release=self.stem_separator.cleanup)
+
+    def _process_song(self, audio_path: str, artist: Optional[str], title: Optional[str],
+                      pitch_tracker: str, plan: OutputPlan, note_formats: Sequence[str],
+                      job_id: str, on_stage: Optional[Callable[[str, Dict], None]]) -> Dict:
+        def stage_done(stage: str, **payload) -> None:
+            if on_stage:
+                try:
+                    on_stage(stage, payload)
+                except Exception as e:
+                    logger.warning(f"Stage callback failed for {stage}: {e}")
+
         logger.info(f"Starting song processing for {audio_path}")
         
         try:
@@ -40,73 +126,152 @@ class SongFeaturesRetriever:
             if not os.path.exists(audio_path):
                 raise FileNotFoundError(f"Audio file not found: {audio_path}")
 
-            # Create output directory
-            output_dir = os.path.join(self.temp_dir, 'processed_audio')
+            # Create the job's output directory
+            output_dir = self.job_dir(job_id)
             os.makedirs(output_dir, exist_ok=True)
             logger.info(f"Created output directory: {output_dir}")
 
+            # A different upload or encode of a recording processed before skips separation
+            # (not worth a decode and fingerprint when the job separates nothing)
+            fingerprint = self._fingerprint(audio_path) if plan.separation else None
+            if fingerprint is not None:
+                match = self.fingerprints.best_match(fingerprint, exclude=job_id)
+                reused = match and self._reuse_match(match, fingerprint, audio_path, output_dir, job_id,
+                                                     plan, note_formats, stage_done)
+                if reused:
+                    reused['metadata'] = {'artist': artist, 'title': title}
+                    return reused
+
             # Extract tempo with validation
-            tempo = self._extract_tempo(audio_path)
-            if not tempo or tempo <= 0:
-                logger.warning(f"Invalid tempo detected ({tempo}), using default of 120 BPM")
-                tempo = 120.0
-            else:
-                logger.info(f"Detected tempo: {tempo} BPM")
+            tempo = None
+            if plan.tempo:
+                tempo = self._extract_tempo(audio_path)
+                if not tempo or tempo <= 0:
+                    logger.warning(f"Invalid tempo detected ({tempo}), using default of 120 BPM")
+                    tempo = 120.0
+                else:
+                    logger.info(f"Detected tempo: {tempo} BPM")
+                stage_done('tempo', tempo=tempo)
             
-            # Process stems
-            logger.info("Separating audio stems...")
-            stem_paths = self.stem_separator.separate_stems(audio_path, output_dir)
-            logger.info("Stems separated successfully")
+            # Process stems, with a vocal/instrumental model when no drums, bass or other stem is needed
+            stem_paths = {}
+            if plan.separation == FOUR_STEM:
+                logger.info("Separating audio stems...")
+                stem_paths = self.stem_separator.separate_stems(audio_path, output_dir)
+                if 'instrumental' in plan.outputs:
+                    stem_paths['instrumental'] = self.stem_separator.mix_stems(
+                        [stem_paths['drums'], stem_paths['bass'], stem_paths['other']],
+                        os.path.join(output_dir, "instrumental.wav")
+                    )
+            elif plan.separation == TWO_STEM:
+                logger.info("Separating vocals from the instrumental...")
+                stem_paths = self.stem_separator.separate_vocals(audio_path, output_dir)
+            if plan.separation:
+                logger.info("Stems separated successfully")
+                stage_done('stems', stems=dict(stem_paths))
             
             # Process vocals
-            logger.info("Processing vocals...")
-            vocals_path = stem_paths.get('vocals')
-            logger.info(vocals_path)
-            if not vocals_path or not os.path.exists(vocals_path):
-                raise ValueError("Vocals stem not found or invalid")
-                
-            enhanced_vocals = self.stem_separator.enhance_vocals(vocals_path, output_dir)
-            logger.info("Vocals enhanced successfully")
-            
-            # Generate MIDI with full parameter set
-            logger.info("Generating MIDI from vocals...")
-            midi, melody = self.midi_extractor.waveToMidi(
-                audioPath=enhanced_vocals['lead_vocals'],
-                bpm=int(round(tempo)),  # Convert tempo to integer
-                Fs=22050,
-                frameLength=2048,
-                hopLength=512,
-                pStayNote=0.9,
-                pStaySilence=0.7,
-                pitchAcc=0.9,
-                voicedAcc=0.9,
-                onsetAcc=0.9,
-                spread=0.2
-            )
-            logger.info("MIDI generation completed")
+            enhanced_vocals = {}
+            if plan.split_vocals:
+                logger.info("Processing vocals...")
+                vocals_path = stem_paths.get('vocals')
+                logger.info(vocals_path)
+                if not vocals_path or not os.path.exists(vocals_path):
+                    raise ValueError("Vocals stem not found or invalid")
+
+                enhanced_vocals = self.stem_separator.enhance_vocals(vocals_path, output_dir)
+                logger.info("Vocals enhanced successfully")
+                stage_done('vocals', stems=dict(enhanced_vocals))
             
-            # Save MIDI
-            midi_path = os.path.join(output_dir, "transcribed.mid")
-            with open(midi_path, "wb") as outfile:
-                midi.writeFile(outfile)
-            logger.info(f"MIDI file saved to: {midi_path}")
-
-            # Save contour JSON
-            json_path = os.path.join(output_dir, "contour.json")
-            with open(json_path, "w") as outfile:
-                json.dump(melody, outfile)
-            logger.info(f"JSON file saved to: {json_path}")
-
-            del stem_paths['vocals']
-            stem_paths['lead_vocals'] = enhanced_vocals['lead_vocals']
-            stem_paths['backing_vocals'] = enhanced_vocals['backing_vocals']
+            # Other stems are transcribed on the worker pool while the lead runs here
+            stem_futures = {}
+            if plan.multitrack:
+                logger.info("Scheduling transcription of the remaining stems...")
+                stem_futures = submit_stem_transcriptions({
+                    'drums': stem_paths['drums'],
+                    'bass': stem_paths['bass'],
+                    'other': stem_paths['other'],
+                    'backing_vocals': enhanced_vocals['backing_vocals']
+                }, int(round(tempo)), pitch_tracker)
+
+            midi_path, notes_paths, multitrack_midi_path, contour_path = None, {}, None, None
+            melody, vocal_activity = None, None
+            if plan.transcribe:
+                # Generate MIDI with full parameter set
+                logger.info("Generating MIDI from vocals...")
+                transcription_start = time.perf_counter()
+                midi, melody = self.midi_extractor.waveToMidi(
+                    audioPath=enhanced_vocals['lead_vocals'],
+                    bpm=int(round(tempo)),  # Convert tempo to integer
+                    Fs=22050,
+                    frameLength=2048,
+                    hopLength=512,
+                    pStayNote=0.9,
+                    pStaySilence=0.7,
+                    pitchAcc=0.9,
+                    voicedAcc=0.9,
+                    onsetAcc=0.9,
+                    spread=0.2,
+                    pitchTracker=pitch_tracker
+                )
+                vocal_activity = self._vocal_activity(self.midi_extractor.features,
+                                                      time.perf_counter() - transcription_start)
+                logger.info("MIDI generation completed")
+                MidiExtractor.saveFeatures(os.path.join(output_dir, FEATURES_FILE),
+                                           self.midi_extractor.features, bpm=int(round(tempo)))
+
+                # Save MIDI and export the same note events for the frontend
+                midi_path, notes_paths = self._write_transcription(output_dir, midi, self.midi_extractor.notes,
+                                                                   note_formats)
+                logger.info(f"MIDI file saved to: {midi_path}")
+                stage_done('midi', midi_path=midi_path, notes_paths=dict(notes_paths))
+
+                if plan.multitrack:
+                    tracks = collect_stem_transcriptions(stem_futures)
+                    tracks['lead_vocals'] = self.midi_extractor.notes
+                    multitrack_midi_path = write_multitrack_midi(
+                        tracks, int(round(tempo)), os.path.join(output_dir, "multitrack.mid")
+                    )
+                    logger.info(f"Multi-track MIDI file saved to: {multitrack_midi_path}")
+                    stage_done('multitrack', multitrack_midi_path=multitrack_midi_path)
+
+                # Save binary contour
+                contour_path = save_contour(os.path.join(output_dir, "contour.bin"), melody, 512 / 22050)
+                logger.info(f"Contour file saved to: {contour_path}")
+                stage_done('contour', contour_path=contour_path)
+
+            # Only the requested stems are returned and tiled
+            stem_paths.update(enhanced_vocals)
+            stem_paths = {name: stem_paths[name] for name in plan.stems if name in stem_paths}
+
+            # Precompute viewer tiles so clients only fetch the visible range
+            if stem_paths or plan.transcribe:
+                logger.info("Building viewer tiles...")
+                build_peak_pyramids(stem_paths, output_dir)
+                if plan.transcribe:
+                    build_notes_index(self.midi_extractor.notes, notes_index_path(output_dir))
+                logger.info("Viewer tiles built")
+                stage_done('tiles', tile_stems=list(stem_paths))
+
+            if self.artifact_store:
+                self.artifact_store.register(audio_path, job_id)
+                self.artifact_store.register_dir(output_dir, job_id)
+            # Only jobs with every stem and cached features can stand in for later uploads
+            if fingerprint is not None and plan.transcribe and set(REUSED_STEMS) <= set(stem_paths):
+                self.fingerprints.add(job_id, fingerprint)
 
             result = {
+                'job_id': job_id,
+                'output_dir': output_dir,
                 'tempo': tempo,
                 'midi_path': midi_path,
-                'json_path': json_path,
+                'multitrack_midi_path': multitrack_midi_path,
+                'notes_paths': notes_paths,
+                'contour_path': contour_path,
                 'melody': melody,
                 'stems': stem_paths,
+                'outputs': sorted(plan.outputs),
+                'vocal_activity': vocal_activity,
                 'metadata': {
                     'artist': artist,
                     'title': title
@@ -120,6 +285,319 @@ class SongFeaturesRetriever:
             logger.error(error_msg)
             raise Exception(error_msg)
             
+    def _process_preview(self, audio_path: str, artist: Optional[str], title: Optional[str],
+                         note_formats: Sequence[str], job_id: str) -> Dict:
+        """
+        Quick transcription of the song's loudest PREVIEW_SECONDS: a single Demucs model,
+        no lead/backing split and YIN instead of pYIN, times relative to the excerpt
+        Files go to the job directory under the names the full pipeline uses, so a full run replaces them;
+        no features are cached and no fingerprint is indexed, so nothing is ever reused from a preview
+        """
+        logger.info(f"Starting preview of {audio_path}")
+
+        try:
+            if not os.path.exists(audio_path):
+                raise FileNotFoundError(f"Audio file not found: {audio_path}")
+
+            output_dir = self.job_dir(job_id)
+            os.makedirs(output_dir, exist_ok=True)
+
+            y, sr = self._load_audio(audio_path)
+            start, end = select_excerpt(y, sr, PREVIEW_SECONDS)
+            logger.info(f"Preview excerpt: {start / sr:.1f}s to {end / sr:.1f}s")
+            excerpt_path = os.path.join(output_dir, PREVIEW_EXCERPT_FILE)
+            with atomic_path(excerpt_path) as tmp_path:
+                sf.write(tmp_path, y[start:end], sr, format='WAV')
+
+            try:
+                tempo = self._extract_tempo(excerpt_path)
+                if not tempo or tempo <= 0:
+                    logger.warning(f"Invalid tempo detected ({tempo}), using default of 120 BPM")
+                    tempo = 120.0
+                stem_paths = self.stem_separator.separate_stems(excerpt_path, output_dir, PREVIEW_SEPARATION_MODEL)
+            finally:
+                os.remove(excerpt_path)
+            stem_paths['lead_vocals'] = stem_paths.pop('vocals')
+
+            midi, melody = self.midi_extractor.waveToMidi(
+                audioPath=stem_paths['lead_vocals'],
+                bpm=int(round(tempo)),
+                Fs=22050,
+                frameLength=2048,
+                hopLength=512,
+                pitchTracker=PREVIEW_PITCH_TRACKER
+            )
+            midi_path, notes_paths = self._write_transcription(output_dir, midi, self.midi_extractor.notes,
+                                                               note_formats)
+            contour_path = save_contour(os.path.join(output_dir, "contour.bin"), melody, 512 / 22050)
+            build_peak_pyramids(stem_paths, output_dir)
+            build_notes_index(self.midi_extractor.notes, notes_index_path(output_dir))
+
+            if self.artifact_store:
+                self.artifact_store.register(audio_path, job_id)
+                self.artifact_store.register_dir(output_dir, job_id)
+
+            logger.info("Preview completed")
+            return {
+                'job_id': job_id,
+                'output_dir': output_dir,
+                'tempo': tempo,
+                'midi_path': midi_path,
+                'multitrack_midi_path': None,
+                'notes_paths': notes_paths,
+                'contour_path': contour_path,
+                'melody': melody,
+                'stems': stem_paths,
+                'excerpt': {'start': start / sr, 'end': end / sr},
+                'metadata': {
+                    'artist': artist,
+                    'title': title
+                }
+            }
+
+        except Exception as e:
+            error_msg = f"Error in song preview: {str(e)}\n{traceback.format_exc()}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+
+    @staticmethod
+    def _vocal_activity(features: dict, transcription_seconds: float) -> Optional[Dict]:
+        """Regions the lead transcription covered and the share of the track it skipped, None without gating"""
+        if 'regions' not in features:
+            return None
+        stats = activity_stats(features['regions'], len(features['rms']),
+                               features['hopLength'] / features['sampleRate'])
+        stats['transcription_seconds'] = transcription_seconds
+        logger.info(f"Vocal activity: {stats['regions']} regions, {stats['skipped_ratio']:.0%} of "
+                    f"{stats['total_seconds']:.0f}s skipped, transcribed in {transcription_seconds:.1f}s")
+        return stats
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.temp_dir, 'processed_audio', job_id)
+
+    @property
+    def fingerprints(self) -> FingerprintIndex:
+        if self._fingerprints is None:
+            index_dir = os.path.join(self.temp_dir, 'processed_audio')
+            os.makedirs(index_dir, exist_ok=True)
+            self._fingerprints = FingerprintIndex(os.path.join(index_dir, FINGERPRINTS_FILE))
+        return self._fingerprints
+
+    def _fingerprint(self, audio_path: str) -> Optional[Fingerprint]:
+        """Fingerprint of the decoded upload, None when dedupe is off or the audio can't be fingerprinted"""
+        if not FINGERPRINT_DEDUPE:
+            return None
+        try:
+            return fingerprint_file(audio_path)
+        except Exception as e:
+            logger.warning(f"Fingerprinting failed for {audio_path}: {e}")
+            return None
+
+    def _reuse_match(self, match: FingerprintMatch, fingerprint: Fingerprint, audio_path: str, output_dir: str,
+                     job_id: str, plan: OutputPlan, note_formats: Sequence[str],
+                     stage_done: Callable) -> Optional[Dict]:
+        """
+        Build a job from a previously processed recording of the same audio
+        Stems are linked when both start together, otherwise cut or padded to the new start, and
+        the lead is retranscribed from the shifted cached features, so no separation runs;
+        like the full pipeline, only the plan's stems are produced and nothing is transcribed without MIDI
+        Returns None (and the caller processes the song normally) when the match can't be used
+        """
+        reference_dir = self.job_dir(match.job_id)
+        features_path = os.path.join(reference_dir, FEATURES_FILE)
+        if not os.path.exists(features_path) or any(self._stem_file(reference_dir, name) is None
+                                                     for name in REUSED_STEMS):
+            logger.info(f"Fingerprint match {match.job_id} has been collected, dropping it from the index")
+            self.fingerprints.remove(match.job_id)
+            return None
+
+        # Vocals and instrumental stems only exist when the reference job asked for them
+        reference_stems = {name: self._stem_file(reference_dir, name) for name in plan.stems}
+        missing = [name for name, path in reference_stems.items() if path is None]
+        if missing:
+            logger.debug(f"Not reusing {match.job_id} for {job_id}: it has no {', '.join(missing)} stem")
+            return None
+
+        aligned = abs(match.offset) < ALIGNED_SECONDS
+        reference_multitrack = os.path.join(reference_dir, "multitrack.mid")
+        # Per-stem notes aren't cached, so a shifted multi-track transcription needs the full pipeline
+        if plan.multitrack and not (aligned and os.path.exists(reference_multitrack)):
+            logger.debug(f"Not reusing {match.job_id} for {job_id}: multi-track MIDI needs an aligned match "
+                         f"with a cached multitrack.mid (offset {match.offset:.2f}s)")
+            return None
+
+        logger.info(f"{job_id} matches {match.job_id} ({match.matched} hashes, offset {match.offset:.2f}s), "
+                    f"reusing its stems")
+        midi_path, notes_paths, multitrack_midi_path, contour_path = None, {}, None, None
+        melody, vocal_activity, tempo = None, None, None
+        if self.artifact_store:
+            self.artifact_store.pin(match.job_id)
+        try:
+            features = MidiExtractor.loadFeatures(features_path)
+            if plan.tempo:
+                tempo = float(features['bpm'])
+                stage_done('tempo', tempo=tempo)
+
+            if aligned:
+                stem_paths = {name: self._link(path, output_dir) for name, path in reference_stems.items()}
+            else:
+                stem_paths = {name: self._shift_stem(path, output_dir, match.offset, fingerprint.duration)
+                              for name, path in reference_stems.items()}
+            separated = {name: path for name, path in stem_paths.items()
+                         if name not in ('lead_vocals', 'backing_vocals')}
+            stage_done('stems', stems=separated)
+            if plan.split_vocals:
+                stage_done('vocals', stems={name: path for name, path in stem_paths.items()
+                                            if name in ('lead_vocals', 'backing_vocals')})
+
+            if plan.transcribe:
+                transcription_start = time.perf_counter()
+                if aligned:
+                    self._link(features_path, output_dir)
+                else:
+                    hop_time = features['hopLength'] / features['sampleRate']
+                    features = MidiExtractor.shiftFeatures(features, int(round(match.offset / hop_time)),
+                                                           int(fingerprint.duration / hop_time) + 1)
+                    MidiExtractor.saveFeatures(os.path.join(output_dir, FEATURES_FILE), features)
+
+                extractor = MidiExtractor(features['midiMin'], features['midiMax'])
+                midi, melody = extractor.featuresToMidi(features, int(round(tempo)))
+                vocal_activity = self._vocal_activity(features, time.perf_counter() - transcription_start)
+                midi_path, notes_paths = self._write_transcription(output_dir, midi, extractor.notes, note_formats)
+                stage_done('midi', midi_path=midi_path, notes_paths=dict(notes_paths))
+
+                if plan.multitrack:
+                    multitrack_midi_path = self._link(reference_multitrack, output_dir)
+                    stage_done('multitrack', multitrack_midi_path=multitrack_midi_path)
+
+                contour_path = save_contour(os.path.join(output_dir, "contour.bin"), melody,
+                                            features['hopLength'] / features['sampleRate'])
+                stage_done('contour', contour_path=contour_path)
+
+            if stem_paths or plan.transcribe:
+                build_peak_pyramids(stem_paths, output_dir)
+                if plan.transcribe:
+                    build_notes_index(extractor.notes, notes_index_path(output_dir))
+                stage_done('tiles', tile_stems=list(stem_paths))
+        finally:
+            if self.artifact_store:
+                self.artifact_store.unpin(match.job_id)
+
+        if self.artifact_store:
+            self.artifact_store.register(audio_path, job_id)
+            self.artifact_store.register_dir(output_dir, job_id)
+        # Later uploads can match this job directly, whichever of the two is collected first
+        if plan.transcribe and set(REUSED_STEMS) <= set(stem_paths):
+            self.fingerprints.add(job_id, fingerprint)
+
+        return {
+            'job_id': job_id,
+            'output_dir': output_dir,
+            'tempo': tempo,
+            'midi_path': midi_path,
+            'multitrack_midi_path': multitrack_midi_path,
+            'notes_paths': notes_paths,
+            'contour_path': contour_path,
+            'melody': melody,
+            'stems': stem_paths,
+            'outputs': sorted(plan.outputs),
+            'vocal_activity': vocal_activity,
+            'reused_from': {'job_id': match.job_id, 'offset': match.offset, 'matched': match.matched}
+        }
+
+    @staticmethod
+    def _stem_file(directory: str, name: str) -> Optional[str]:
+        """A job's file of the named stem, None when it has none"""
+        for ext in STEM_EXTENSIONS:
+            path = os.path.join(directory, f"{name}{ext}")
+            if os.path.exists(path):
+                return path
+        return None
+
+    @staticmethod
+    def _link(path: str, output_dir: str) -> str:
+        """Hard link a file of another job into this one, copying where links aren't supported"""
+        target = os.path.join(output_dir, os.path.basename(path))
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copy2(path, target)
+        return target
+
+    @staticmethod
+    def _shift_stem(path: str, output_dir: str, offset: float, duration: float) -> str:
+        """Cut (positive offset) or pad (negative offset) a stem so it lines up with the new upload"""
+        audio, sr = sf.read(path, always_2d=True)
+        start = int(round(offset * sr))
+        length = int(round(duration * sr))
+        shifted = np.zeros((length, audio.shape[1]), dtype=audio.dtype)
+        source = audio[max(start, 0):max(start + length, 0)]
+        destination = max(-start, 0)
+        source = source[:max(length - destination, 0)]
+        shifted[destination:destination + len(source)] = source
+
+        out_path = os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + ".wav")
+        with atomic_path(out_path) as tmp_path:
+            sf.write(tmp_path, shifted, sr, format='WAV')
+        return out_path
+
+    def _write_transcription(self, output_dir: str, midi, notes, note_formats: Sequence[str]) -> Tuple[str, Dict[str, str]]:
+        """Write the lead MIDI file and the requested note exports, returns their paths"""
+        midi_path = os.path.join(output_dir, "transcribed.mid")
+        with atomic_path(midi_path) as tmp_path, open(tmp_path, "wb") as outfile:
+            midi.write(outfile)
+
+        notes_paths = {}
+        if 'json' in note_formats:
+            notes_paths['json'] = os.path.join(output_dir, "notes.json")
+            with atomic_path(notes_paths['json']) as tmp_path, open(tmp_path, "w") as outfile:
+                json.dump(notes.to_dict(), outfile)
+        if 'bin' in note_formats:
+            notes_paths['bin'] = os.path.join(output_dir, "notes.bin")
+            with atomic_path(notes_paths['bin']) as tmp_path, open(tmp_path, "wb") as outfile:
+                outfile.write(notes.to_bytes())
+        return midi_path, notes_paths
+
+    def retranscribe(self, job_id: str, note_formats: Sequence[str] = (), **hmm_params) -> Dict:
+        """
+        Rerun only prior construction, Viterbi and note segmentation of a processed song,
+        with new HMM parameters (pStayNote, pStaySilence, pitchAcc, voicedAcc, onsetAcc, spread)
+        Pitch, onsets and RMS come from the features cached by process_song, so no audio is touched
+        The lead MIDI, note exports, contour and notes index of the job are replaced
+        """
+        output_dir = self.job_dir(job_id)
+        features_path = os.path.join(output_dir, FEATURES_FILE)
+        if not os.path.exists(features_path):
+            raise FileNotFoundError(f"No cached features for job {job_id}")
+
+        features = MidiExtractor.loadFeatures(features_path)
+        extractor = MidiExtractor(features['midiMin'], features['midiMax'])
+        midi, melody = extractor.featuresToMidi(features, features['bpm'], **hmm_params)
+
+        # Keep previously exported note formats in sync with the new transcription
+        note_formats = set(note_formats) | {
+            fmt for fmt in ('json', 'bin') if os.path.exists(os.path.join(output_dir, f"notes.{fmt}"))
+        }
+        midi_path, notes_paths = self._write_transcription(output_dir, midi, extractor.notes, note_formats)
+        contour_path = save_contour(os.path.join(output_dir, "contour.bin"), melody,
+                                    features['hopLength'] / features['sampleRate'])
+        build_notes_index(extractor.notes, notes_index_path(output_dir))
+
+        if self.artifact_store:
+            self.artifact_store.register_dir(output_dir, job_id)
+
+        logger.info(f"Retranscribed {job_id} with {hmm_params}: {len(extractor.notes)} notes")
+        return {
+            'job_id': job_id,
+            'tempo': features['bpm'],
+            'midi_path': midi_path,
+            'notes_paths': notes_paths,
+            'contour_path': contour_path,
+            'melody': melody
+        }
+
     def _extract_tempo(self, audio_path: str) -> float:
         """Extract tempo from audio file with improved error handling"""
         logger.info("Extracting tempo from audio file...")
@@ -132,22 +610,3 @@ class SongFeaturesRetriever:
             error_msg = f"Error extracting tempo: {str(e)}\n{traceback.format_exc()}"
             logger.error(error_msg)
             raise Exception(error_msg)
-
-    def cleanup(self) -> None:
-        """Clean up temporary files with improved error handling"""
-        logger.info(f"Starting cleanup of directory: {self.temp_dir}")
-        try:
-            file_count = 0
-            for root, dirs, files in os.walk(self.temp_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    try:
-                        os.remove(file_path)
-                        file_count += 1
-                    except Exception as e:
-                        logger.warning(f"Failed to remove file {file_path}: {str(e)}")
-            logger.info(f"Cleanup completed. Removed {file_count} files.")
-        except Exception as e:
-            error_msg = f"Error during cleanup: {str(e)}\n{traceback.format_exc()}"
-            logger.error(error_msg)
-            raise Exception(error_msg)
\ No newline at end of file
@@ -7,13 +7,23 @@ import soundfile as sf
 import os
 import logging
 import concurrent.futures
-from functools import lru_cache
 from typing import Dict, Optional
 from torch.cuda.amp import autocast
 from audio_separator.separator import Separator
+from memory_guard import ByteLRUCache
 
 logger = logging.getLogger(__name__)
 
+# Decoded audio shared by all separators, bounded by size (44.1 kHz stereo float32 is ~21 MB a minute)
+AUDIO_CACHE_BYTES = int(float(os.getenv('STEM_AUDIO_CACHE_MB', '256')) * 1024 ** 2)
+_audio_cache = ByteLRUCache(AUDIO_CACHE_BYTES, 'stem_audio')
+
+# The fine-tuned Demucs bag runs four models, previews use the single base model (about 4x faster)
+SEPARATION_MODEL = 'htdemucs_ft.yaml'
+PREVIEW_SEPARATION_MODEL = 'htdemucs.yaml'
+# Vocal/instrumental MDX-Net model, for jobs that need no drums, bass or other stem
+TWO_STEM_MODEL = 'UVR-MDX-NET-Voc_FT.onnx'
+
 class StemSeparator:
     def __init__(self, device='cuda' if torch.cuda.is_available() else 'cpu'):
         """
@@ -24,16 +34,17 @@ class StemSeparator:
         self.device = device
         self.model = None
         self.model_name = 'htdemucs'
-        self._audio_cache = {}  # Cache for loaded audio files
+        self._audio_cache = _audio_cache  # Cache for loaded audio files
         logger.info(f"Initializing StemSeparator with device: {device}")
-        self._load_model()  # Load model on initialization
+        # The Demucs model is only used by separate_stems_alt, which loads it on demand
         self.separator = None
         
-    @lru_cache(maxsize=1)  # Cache the model to avoid reloading
     def _load_model(self) -> None:
         """
-        Load the Demucs model with caching to avoid repeated loading
+        Load the Demucs model once, later calls reuse it until release_models()
         """
+        if self.model is not None:
+            return
         try:
             logger.info("Loading Demucs model...")
             self.model = get_model(name=self.model_name)
@@ -60,10 +71,10 @@ class StemSeparator:
         """
         Load audio with caching to avoid reloading the same file
         """
-        if audio_path not in self._audio_cache:
-            y_sr = librosa.load(audio_path, sr=44100, mono=False)
-            self._audio_cache[audio_path] = y_sr
-        return self._audio_cache[audio_path]
+        y_sr = self._audio_cache.get(audio_path)
+        if y_sr is None:
+            y_sr = self._audio_cache.put(audio_path, librosa.load(audio_path, sr=44100, mono=False))
+        return y_sr
         
     def _save_stem(self, stem_data: np.ndarray, stem_name: str, 
                    output_dir: str, sr: int) -> tuple:
@@ -162,8 +173,7 @@ class StemSeparator:
             logger.error(f"Error in vocal enhancement: {e}")
             raise
     
-    @lru_cache(maxsize=1)
-    def separate_stems(self, audio_path: str, output_dir: str) -> Dict[str, str]:
+    def separate_stems(self, audio_path: str, output_dir: str, model_filename: str = SEPARATION_MODEL) -> Dict[str, str]:
         outputNames = {
             "Vocals": "vocals",
             "Drums": "drums",
@@ -173,7 +183,7 @@ class StemSeparator:
         
         self.separator = Separator(output_dir=output_dir, output_format='mp3')
 
-        self.separator.load_model(model_filename='htdemucs_ft.yaml')
+        self.separator.load_model(model_filename=model_filename)
         self.separator.separate(audio_path, outputNames)
 
         return { 'vocals': os.path.join(output_dir, f'{outputNames["Vocals"]}.mp3'), 
@@ -182,6 +192,36 @@ class StemSeparator:
                 'other': os.path.join(output_dir, f'{outputNames["Other"]}.mp3'),                
                 }
 
+    def separate_vocals(self, audio_path: str, output_dir: str, model_filename: str = TWO_STEM_MODEL) -> Dict[str, str]:
+        outputNames = {
+            "Vocals": "vocals",
+            "Instrumental": "instrumental",
+        }
+
+        self.separator = Separator(output_dir=output_dir, output_format='mp3')
+
+        self.separator.load_model(model_filename=model_filename)
+        self.separator.separate(audio_path, outputNames)
+
+        return {
+            'vocals': os.path.join(output_dir, f'{outputNames["Vocals"]}.mp3'),
+            'instrumental': os.path.join(output_dir, f'{outputNames["Instrumental"]}.mp3')
+        }
+
+    @staticmethod
+    def mix_stems(stem_paths, output_path: str) -> str:
+        """Sum stems into one file, such as drums, bass and other into the instrumental"""
+        mix = None
+        for path in stem_paths:
+            audio, sr = sf.read(path, always_2d=True, dtype='float32')
+            if mix is None:
+                mix = audio
+            else:
+                length = max(len(mix), len(audio))
+                mix = np.pad(mix, ((0, length - len(mix)), (0, 0))) + np.pad(audio, ((0, length - len(audio)), (0, 0)))
+        sf.write(output_path, np.clip(mix, -1.0, 1.0), sr, subtype='PCM_16')
+        return output_path
+
     def enhance_vocals(self, vocals_path: str, output_dir: str) -> str:
         outputNames = {
             "Vocals": "lead_vocals",
@@ -196,6 +236,17 @@ class StemSeparator:
             'backing_vocals': os.path.join(output_dir, f'{outputNames["Instrumental"]}.mp3')
         }
             
+    def release_models(self) -> None:
+        """
+        Drop the loaded separation models, they are reloaded by the next separation anyway
+        """
+        self.separator = None
+        self.model = None
+
+        # Clear CUDA cache if using GPU
+        if self.device == 'cuda':
+            torch.cuda.empty_cache()
+
     def cleanup(self) -> None:
         """
         Cleanup resources and cached data
@@ -203,10 +254,7 @@ class StemSeparator:
         try:
             # Clear audio cache
             self._audio_cache.clear()
-            
-            # Clear CUDA cache if using GPU
-            if self.device == 'cuda':
-                torch.cuda.empty_cache()
+            self.release_models()
                 
         except Exception as e:
             logger.error(f"Error during cleanup: {e}")
@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+
+librosa = pytest.importorskip('librosa')
+pytest.importorskip('tqdm')
+
+from midi_extractor import MidiExtractor
+
+MIDI_MIN, MIDI_MAX = 48, 60
+HOP_TIME = 512 / 22050
+
+# Viterbi paths the HMM can produce: silence -> onset -> sustains of that note,
+# then silence or a direct onset of another note (or the same one struck again)
+STATE_PATHS = {
+    'empty': [0, 0, 0, 0],
+    'single': [0, 0, 1, 2, 2, 2, 0, 0],
+    'legato': [0, 3, 4, 4, 7, 8, 8, 8, 0],
+    'retrigger': [5, 6, 6, 5, 6, 0, 0, 1, 2],
+    'ends_in_note': [0, 25, 26, 26, 26],
+    'back_to_back': [1, 2, 0, 1, 2, 0, 25, 26, 0],
+}
+
+
+def note_states(midi: int) -> tuple:
+    onset = (midi - MIDI_MIN) * 2 + 1
+    return onset, onset + 1
+
+
+def reference_pianoroll(extractor: MidiExtractor, rms: np.ndarray, pitch: np.ndarray, states: list):
+    """Frame-by-frame state machine the vectorized conversion replaced"""
+    states_ = list(states) + [0]
+    pitch_ = np.append(pitch, np.nan)
+    notes, melody = [], []
+    current, onset, midi, rms_sum, rms_count = 'silence', 0, 0, 0.0, 0
+
+    def finish(offset):
+        velocity = (rms_sum / rms_count - rms.min()) * 127 / (rms.max() - rms.min())
+        notes.append((onset * HOP_TIME, offset * HOP_TIME, midi, int(velocity)))
+
+    for i, state in enumerate(states_):
+        hz = extractor.noteMapHz[midi] if midi else 0.0
+        if current == 'silence':
+            if state % 2:
+                onset, midi, current = i, (state - 1) // 2 + MIDI_MIN, 'onset'
+                melody.append(extractor.noteMapHz[midi] - pitch_[i])
+                rms_sum, rms_count = rms[i], 1
+            else:
+                melody.append(0.0)
+        elif current == 'onset':
+            current = 'sustain'
+            melody.append(hz - pitch_[i])
+            rms_sum, rms_count = rms_sum + rms[i], rms_count + 1
+        elif state % 2:
+            finish(i)
+            # The struck frame still reports the distance to the note it ends
+            melody.append(hz - pitch_[i])
+            onset, midi, current = i, (state - 1) // 2 + MIDI_MIN, 'onset'
+            rms_sum, rms_count = rms[i], 1
+        elif state == 0:
+            finish(i)
+            melody.append(0.0)
+            current = 'silence'
+        else:
+            melody.append(hz - pitch_[i])
+
+    return notes, np.nan_to_num(melody)
+
+
+def reference_priors(extractor: MidiExtractor, pitch, voiced, onsets, pitchAcc=0.9, voicedAcc=0.9,
+                     onsetAcc=0.9, spread=0.2) -> np.ndarray:
+    """Per-frame, per-state priors as the original loop built them"""
+    n_notes = extractor.midiMax - extractor.midiMin + 1
+    f0 = np.round(librosa.hz_to_midi(pitch - librosa.pitch_tuning(pitch)))
+    priors = np.ones((n_notes * 2 + 1, len(pitch)))
+    for frame in range(len(pitch)):
+        priors[0, frame] = 1 - voicedAcc if voiced[frame] else voicedAcc
+        for j in range(n_notes):
+            priors[j * 2 + 1, frame] = onsetAcc if frame in onsets else 1 - onsetAcc
+            if np.isnan(f0[frame]):
+                priors[j * 2 + 2, frame] = 1 - pitchAcc
+            elif j + extractor.midiMin == f0[frame]:
+                priors[j * 2 + 2, frame] = pitchAcc
+            elif abs(j + extractor.midiMin - f0[frame]) == 1:
+                priors[j * 2 + 2, frame] = pitchAcc * spread
+            else:
+                priors[j * 2 + 2, frame] = 1 - pitchAcc
+    return priors
+
+
+@pytest.fixture
+def extractor() -> MidiExtractor:
+    return MidiExtractor(MIDI_MIN, MIDI_MAX)
+
+
+@pytest.mark.parametrize('name', sorted(STATE_PATHS))
+def test_states_to_pianoroll_matches_reference(extractor, name):
+    states = np.array(STATE_PATHS[name])
+    rng = np.random.default_rng(len(states))
+    rms = rng.uniform(0.01, 0.5, len(states))
+    pitch = librosa.midi_to_hz(rng.uniform(MIDI_MIN, MIDI_MAX, len(states)))
+    pitch[states == 0] = np.nan
+
+    notes, melody = extractor._MidiExtractor__statesToPianoroll(rms, pitch, states, HOP_TIME)
+    expected_notes, expected_melody = reference_pianoroll(extractor, rms, pitch, states)
+
+    assert len(notes) == len(expected_notes)
+    for index, (onset, offset, midi, velocity) in enumerate(expected_notes):
+        assert notes.onset[index] == pytest.approx(onset)
+        assert notes.offset[index] == pytest.approx(offset)
+        assert notes.midi[index] == midi
+        assert notes.velocity[index] == velocity
+    np.testing.assert_allclose(melody, expected_melody)
+
+
+def test_states_to_pianoroll_note_states(extractor):
+    onset, sustain = note_states(55)
+    notes, _ = extractor._MidiExtractor__statesToPianoroll(np.array([0.1, 0.4, 0.3, 0.2]), np.full(4, 196.0),
+                                                           np.array([0, onset, sustain, sustain]), HOP_TIME)
+    assert list(notes.midi) == [55]
+    assert notes.offset[0] == pytest.approx(4 * HOP_TIME)
+
+
+def test_prior_probabilities_match_reference(extractor):
+    rng = np.random.default_rng(0)
+    n_frames = 40
+    pitch = librosa.midi_to_hz(rng.uniform(MIDI_MIN - 2, MIDI_MAX + 2, n_frames))
+    voiced = rng.uniform(size=n_frames) > 0.3
+    pitch[~voiced] = np.nan
+    onsets = np.array([0, 7, 19, 33, n_frames + 5])
+
+    priors = extractor._MidiExtractor__priorProbabilities(pitch, voiced, onsets, pitchAcc=0.8, voicedAcc=0.85,
+                                                          onsetAcc=0.7, spread=0.3)
+    expected = reference_priors(extractor, pitch, voiced, set(onsets.tolist()), pitchAcc=0.8, voicedAcc=0.85,
+                                onsetAcc=0.7, spread=0.3)
+    np.testing.assert_allclose(priors, expected)
@@ -0,0 +1,394 @@
+import os
+import time
+import uuid
+import base64
+import struct
+import sqlite3
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, Optional
+
+from audio_fetcher import audio_duration
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_UPLOAD_BYTES = 2 * 1024 ** 3
+DEFAULT_CHUNK_BYTES = 8 * 1024 ** 2
+DEFAULT_TTL_SECONDS = 24 * 3600
+
+# Request bodies are copied to disk in blocks of this size, never held whole in memory
+BLOCK_BYTES = 256 * 1024
+# Enough to reach the format chunk of a WAV or the STREAMINFO block of a FLAC file
+PROBE_BYTES = 64 * 1024
+
+AUDIO_EXTENSIONS = {'wav', 'flac', 'mp3', 'ogg', 'm4a', 'aiff'}
+
+RECEIVING = 'receiving'
+COMPLETE = 'complete'
+
+
+class UploadError(Exception):
+    """Raised when an upload request can't be honoured, status is the HTTP status to answer with"""
+
+    def __init__(self, message: str, status: int = 400, offset: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+@dataclass
+class Upload:
+    upload_id: str
+    filename: str
+    size: int
+    offset: int
+    status: str
+    client_id: str
+    created: float
+    updated: float
+    expected_sha256: Optional[str] = None
+    sha256: Optional[str] = None
+    format: Optional[str] = None
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+    duration: Optional[float] = None
+    path: Optional[str] = None
+
+    @property
+    def complete(self) -> bool:
+        return self.status == COMPLETE
+
+    def to_dict(self) -> Dict:
+        return {
+            'upload_id': self.upload_id,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': self.offset,
+            'status': self.status,
+            'sha256': self.sha256,
+            'format': self.format,
+            'sample_rate': self.sample_rate,
+            'channels': self.channels,
+            'duration': self.duration
+        }
+
+
+def probe_header(head: bytes) -> Dict:
+    """
+    Container format from the first bytes of a file, plus sample rate, channels and
+    duration where the header carries them (WAV, FLAC)
+    Returns {} when the bytes are not a supported audio format
+    """
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        info = {'format': 'wav'}
+        position = 12
+        byte_rate = None
+        while position + 8 <= len(head):
+            chunk_id, chunk_size = head[position:position + 4], struct.unpack('<I', head[position + 4:position + 8])[0]
+            body = head[position + 8:position + 8 + chunk_size]
+            if chunk_id == b'fmt ' and len(body) >= 16:
+                _, channels, sample_rate, byte_rate = struct.unpack('<HHII', body[:12])
+                info.update(channels=channels, sample_rate=sample_rate)
+            elif chunk_id == b'data':
+                # Streamed WAVs leave the data size at 0 or 0xFFFFFFFF
+                if byte_rate and chunk_size not in (0, 0xFFFFFFFF):
+                    info['duration'] = chunk_size / byte_rate
+                break
+            # Chunks are padded to an even size
+            position += 8 + chunk_size + (chunk_size & 1)
+        return info
+
+    if head[:4] == b'fLaC':
+        info = {'format': 'flac'}
+        # The first metadata block is always STREAMINFO: 34 bytes after a 4-byte block header
+        if len(head) >= 42:
+            packed = int.from_bytes(head[18:26], 'big')
+            sample_rate = packed >> 44
+            channels = ((packed >> 41) & 0x7) + 1
+            total_samples = packed & ((1 << 36) - 1)
+            info.update(sample_rate=sample_rate, channels=channels)
+            if sample_rate and total_samples:
+                info['duration'] = total_samples / sample_rate
+        return info
+
+    if head[:4] == b'FORM' and head[8:12] in (b'AIFF', b'AIFC'):
+        return {'format': 'aiff'}
+    if head[:4] == b'OggS':
+        return {'format': 'ogg'}
+    if head[4:8] == b'ftyp':
+        return {'format': 'm4a'}
+    if head[:3] == b'ID3' or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return {'format': 'mp3'}
+    return {}
+
+
+def parse_checksum(header: Optional[str]) -> Optional[bytes]:
+    """SHA-256 digest from an `Upload-Checksum: sha256 <base64>` header"""
+    if not header:
+        return None
+    algorithm, _, value = header.strip().partition(' ')
+    if algorithm.lower() != 'sha256':
+        raise UploadError(f"Unsupported checksum algorithm '{algorithm}', expected sha256")
+    try:
+        return base64.b64decode(value.strip(), validate=True)
+    except ValueError:
+        raise UploadError("Malformed Upload-Checksum header")
+
+
+class UploadStore:
+    """
+    Resumable uploads of audio files, streamed to disk a block at a time
+    An upload is created with its total size, then appended to in chunks at its current offset,
+    so an interrupted transfer resumes from the last byte received
+    The whole-file SHA-256 and the format probe are computed as bytes arrive, and a complete
+    upload is moved into the audio directory under a content-addressed name, ready to process
+    """
+
+    def __init__(self,
+                 root: str,
+                 audio_dir: str,
+                 max_upload_bytes: int = DEFAULT_MAX_UPLOAD_BYTES,
+                 chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.root = root
+        self.audio_dir = audio_dir
+        self.max_upload_bytes = max_upload_bytes
+        self.chunk_bytes = chunk_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._receiving: Dict[str, threading.Lock] = {}
+        # Running hash of each upload and the offset it covers, rebuilt from disk after a restart
+        self._hashers: Dict[str, tuple] = {}
+
+        os.makedirs(root, exist_ok=True)
+        os.makedirs(audio_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, 'uploads.db'), check_same_thread=False)
+        with self._db:
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS uploads (
+                    upload_id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    offset INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    client_id TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    expected_sha256 TEXT,
+                    sha256 TEXT,
+                    format TEXT,
+                    sample_rate INTEGER,
+                    channels INTEGER,
+                    duration REAL,
+                    path TEXT
+                )
+            """)
+
+    def _part_path(self, upload_id: str) -> str:
+        return os.path.join(self.root, f"{upload_id}.part")
+
+    def _save(self, upload: Upload) -> None:
+        upload.updated = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (upload.upload_id, upload.filename, upload.size, upload.offset, upload.status, upload.client_id,
+                 upload.created, upload.updated, upload.expected_sha256, upload.sha256, upload.format,
+                 upload.sample_rate, upload.channels, upload.duration, upload.path)
+            )
+
+    def get(self, upload_id: str) -> Optional[Upload]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM uploads WHERE upload_id = ?", (upload_id,)).fetchone()
+        return Upload(*row) if row else None
+
+    def create(self, filename: str, size: int, client_id: str, sha256: Optional[str] = None) -> Upload:
+        self.expire()
+        filename = os.path.basename(filename or '')
+        extension = os.path.splitext(filename)[1].lstrip('.').lower()
+        if extension not in AUDIO_EXTENSIONS:
+            raise UploadError(f"Unsupported file type '{extension}', expected one of {sorted(AUDIO_EXTENSIONS)}",
+                              status=415)
+        if not isinstance(size, int) or size <= 0:
+            raise UploadError("'size' must be a positive number of bytes")
+        if size > self.max_upload_bytes:
+            raise UploadError(f"Upload too large: {size} bytes, limit {self.max_upload_bytes}", status=413)
+        if sha256 is not None and (len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256.lower())):
+            raise UploadError("'sha256' must be a hex digest")
+
+        now = time.time()
+        upload = Upload(uuid.uuid4().hex, filename, size, 0, RECEIVING, client_id, now, now,
+                        expected_sha256=sha256.lower() if sha256 else None)
+        open(self._part_path(upload.upload_id), 'wb').close()
+        self._save(upload)
+        logger.info(f"Created upload {upload.upload_id} for {client_id}: {filename}, {size} bytes")
+        return upload
+
+    def _hasher(self, upload: Upload):
+        """Hash of the bytes received so far, re-read from the part file if it isn't in memory"""
+        hasher, offset = self._hashers.get(upload.upload_id, (None, None))
+        if hasher is None or offset != upload.offset:
+            hasher = hashlib.sha256()
+            with open(self._part_path(upload.upload_id), 'rb') as part:
+                remaining = upload.offset
+                while remaining:
+                    block = part.read(min(BLOCK_BYTES, remaining))
+                    if not block:
+                        break
+                    hasher.update(block)
+                    remaining -= len(block)
+        return hasher
+
+    def append(self, upload_id: str, offset: int, stream: BinaryIO,
+               length: Optional[int] = None, checksum: Optional[bytes] = None) -> Upload:
+        """
+        Append a chunk read from `stream` at `offset`, which must be the upload's current offset
+        With a checksum the chunk is kept only if its SHA-256 matches, otherwise whatever arrived
+        before a disconnect is kept and the client resumes from the returned offset
+        """
+        upload = self.get(upload_id)
+        if upload is None:
+            raise UploadError(f"Upload not found: {upload_id}", status=404)
+        if upload.complete:
+            raise UploadError("Upload is already complete", status=409, offset=upload.offset)
+        if offset != upload.offset:
+            raise UploadError(f"Offset mismatch: expected {upload.offset}", status=409, offset=upload.offset)
+        if length is not None and offset + length > upload.size:
+            raise UploadError(f"Chunk runs past the declared size of {upload.size} bytes", status=413,
+                              offset=upload.offset)
+
+        with self._lock:
+            receiving = self._receiving.setdefault(upload_id, threading.Lock())
+        if not receiving.acquire(blocking=False):
+            raise UploadError("Upload is already receiving a chunk", status=409, offset=upload.offset)
+        try:
+            return self._append(upload, stream, checksum)
+        finally:
+            receiving.release()
+
+    def _append(self, upload: Upload, stream: BinaryIO, checksum: Optional[bytes]) -> Upload:
+        whole = self._hasher(upload)
+        # A checksummed chunk is hashed into a copy, which replaces the whole-file hash once verified
+        hasher = whole.copy() if checksum is not None else whole
+        chunk_hasher = hashlib.sha256() if checksum is not None else None
+        start = upload.offset
+        received = 0
+        head = b''
+        if upload.format is None:
+            with open(self._part_path(upload.upload_id), 'rb') as part:
+                head = part.read(min(start, PROBE_BYTES))
+
+        with open(self._part_path(upload.upload_id), 'r+b') as part:
+            part.seek(start)
+            part.truncate()
+            try:
+                while start + received < upload.size:
+                    block = stream.read(min(BLOCK_BYTES, upload.size - start - received))
+                    if not block:
+                        break
+                    part.write(block)
+                    received += len(block)
+                    hasher.update(block)
+                    if chunk_hasher is not None:
+                        chunk_hasher.update(block)
+
+                    # Probe the format from the first bytes so bad files are refused before the rest arrives
+                    if upload.format is None:
+                        head += block[:PROBE_BYTES - len(head)]
+                        if len(head) >= PROBE_BYTES or start + received >= upload.size:
+                            self._probe(upload, head)
+            except UploadError:
+                part.truncate(start)
+                raise
+            except Exception as e:
+                # Client went away mid-chunk: unverifiable data is dropped, the rest is kept for the resume
+                if chunk_hasher is not None:
+                    received = 0
+                part.truncate(start + received)
+                upload.offset = start + received
+                self._hashers[upload.upload_id] = (whole if chunk_hasher is not None else hasher, upload.offset)
+                self._save(upload)
+                logger.warning(f"Upload {upload.upload_id} interrupted at {upload.offset} bytes: {e}")
+                raise UploadError(f"Upload interrupted: {e}", offset=upload.offset)
+
+            if chunk_hasher is not None and chunk_hasher.digest() != checksum:
+                part.truncate(start)
+                raise UploadError("Chunk checksum mismatch", status=460, offset=start)
+
+        upload.offset = start + received
+        self._hashers[upload.upload_id] = (hasher, upload.offset)
+        if upload.offset >= upload.size:
+            self._finish(upload, hasher.hexdigest())
+        self._save(upload)
+        return upload
+
+    def _probe(self, upload: Upload, head: bytes) -> None:
+        info = probe_header(head)
+        if not info:
+            self.abort(upload.upload_id)
+            raise UploadError("Not a supported audio file", status=415)
+        upload.format = info['format']
+        upload.sample_rate = info.get('sample_rate')
+        upload.channels = info.get('channels')
+        upload.duration = info.get('duration')
+        logger.info(f"Upload {upload.upload_id} is {upload.format}"
+                    + (f", {upload.duration:.1f}s" if upload.duration else ""))
+
+    def _finish(self, upload: Upload, digest: str) -> None:
+        """Verify the whole-file hash and move the upload to its content-addressed audio path"""
+        self._hashers.pop(upload.upload_id, None)
+        if upload.expected_sha256 and digest != upload.expected_sha256:
+            self.abort(upload.upload_id)
+            raise UploadError(f"SHA-256 mismatch: received {digest}", status=422)
+
+        path = os.path.join(self.audio_dir, f"upload_{digest[:16]}.{upload.format}")
+        if os.path.exists(path):
+            # Same bytes uploaded before, its job and artifacts are shared
+            os.remove(self._part_path(upload.upload_id))
+        else:
+            os.replace(self._part_path(upload.upload_id), path)
+
+        upload.sha256 = digest
+        upload.path = path
+        upload.status = COMPLETE
+        if upload.duration is None:
+            upload.duration = audio_duration(path)
+        logger.info(f"Upload {upload.upload_id} complete: {path}")
+
+    def audio_path(self, upload_id: str) -> str:
+        """Path of a completed upload, for the processing pipeline"""
+        upload = self.get(upload_id)
+        if upload is None:
+            raise UploadError(f"Upload not found: {upload_id}", status=404)
+        if not upload.complete:
+            raise UploadError(f"Upload is incomplete: {upload.offset} of {upload.size} bytes", status=409,
+                              offset=upload.offset)
+        if not os.path.exists(upload.path):
+            raise UploadError("Uploaded file has expired, upload it again", status=410)
+        return upload.path
+
+    def abort(self, upload_id: str) -> None:
+        """Drop an upload and its partial data, completed files are left to the artifact GC"""
+        self._hashers.pop(upload_id, None)
+        part_path = self._part_path(upload_id)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM uploads WHERE upload_id = ?", (upload_id,))
+            self._receiving.pop(upload_id, None)
+
+    def expire(self) -> int:
+        """Abort uploads that received nothing for ttl_seconds, returns how many"""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            stale = [row[0] for row in self._db.execute(
+                "SELECT upload_id FROM uploads WHERE updated < ?", (cutoff,)
+            ).fetchall()]
+        for upload_id in stale:
+            self.abort(upload_id)
+        if stale:
+            logger.info(f"Expired {len(stale)} stale uploads")
+        return len(stale)
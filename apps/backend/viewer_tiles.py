@@ -0,0 +1,164 @@
+import os
+import concurrent.futures
+import numpy as np
+import librosa
+from typing import Dict, Optional
+from note_events import NoteEvents
+from artifact_store import atomic_path
+
+PEAKS_SR = 22050
+BASE_BLOCK = 256  # Samples per peak at level 0, each level above halves the resolution
+MIN_LEVEL_PEAKS = 512  # Stop building levels once a whole track fits in this many peaks
+NOTE_BUCKET_SECONDS = 10.0
+
+
+def peaks_path(output_dir: str, stem_name: str) -> str:
+    return os.path.join(output_dir, f"{stem_name}.peaks.npz")
+
+
+def notes_index_path(output_dir: str) -> str:
+    return os.path.join(output_dir, "notes.index.npz")
+
+
+def build_peak_pyramid(audio_path: str, out_path: str) -> str:
+    """
+    Precompute min/max waveform peaks at every zoom level for a stem
+    Level 0 holds one peak pair per BASE_BLOCK samples, level n per BASE_BLOCK * 2**n
+    """
+    audio = librosa.load(audio_path, sr=PEAKS_SR, mono=True)[0]
+
+    n_blocks = int(np.ceil(len(audio) / BASE_BLOCK))
+    padded = np.zeros(max(n_blocks, 1) * BASE_BLOCK, dtype=np.float32)
+    padded[:len(audio)] = audio
+    blocks = padded.reshape(-1, BASE_BLOCK)
+
+    mins = blocks.min(axis=1)
+    maxs = blocks.max(axis=1)
+    levels = {}
+    level = 0
+    while True:
+        # int8 is plenty for drawing and keeps tiles small
+        levels[f"min_{level}"] = np.round(np.clip(mins, -1, 1) * 127).astype(np.int8)
+        levels[f"max_{level}"] = np.round(np.clip(maxs, -1, 1) * 127).astype(np.int8)
+        if len(mins) <= MIN_LEVEL_PEAKS:
+            break
+        if len(mins) % 2:
+            mins = np.append(mins, mins[-1])
+            maxs = np.append(maxs, maxs[-1])
+        mins = mins.reshape(-1, 2).min(axis=1)
+        maxs = maxs.reshape(-1, 2).max(axis=1)
+        level += 1
+
+    with atomic_path(out_path) as tmp_path:
+        np.savez(tmp_path, sr=PEAKS_SR, block=BASE_BLOCK, levels=level + 1, duration=len(audio) / PEAKS_SR, **levels)
+    return out_path
+
+
+def build_peak_pyramids(stem_paths: Dict[str, str], output_dir: str) -> Dict[str, str]:
+    """Build peak pyramids for all stems in parallel"""
+    pyramid_paths = {}
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        future_to_stem = {
+            executor.submit(build_peak_pyramid, path, peaks_path(output_dir, name)): name
+            for name, path in stem_paths.items()
+        }
+        for future in concurrent.futures.as_completed(future_to_stem):
+            pyramid_paths[future_to_stem[future]] = future.result()
+    return pyramid_paths
+
+
+def build_notes_index(notes: NoteEvents, out_path: str, bucket_seconds: float = NOTE_BUCKET_SECONDS) -> str:
+    """
+    Store transcribed notes with a time-bucketed index
+    Bucket b lists every note overlapping [b * bucket_seconds, (b + 1) * bucket_seconds)
+    as note_ids[bucket_offsets[b]:bucket_offsets[b + 1]]
+    """
+    notes = notes.sorted()
+    duration = float(notes.offset.max()) if len(notes) else 0.0
+    n_buckets = int(np.floor(duration / bucket_seconds)) + 1
+
+    first = np.floor(notes.onset / bucket_seconds).astype(int)
+    last = np.maximum(np.ceil(notes.offset / bucket_seconds).astype(int) - 1, first)
+    spans = last - first + 1
+
+    note_ids = np.repeat(np.arange(len(notes)), spans)
+    buckets = np.repeat(first, spans) + (np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans, spans))
+    order = np.argsort(buckets, kind='stable')
+    bucket_offsets = np.concatenate(([0], np.cumsum(np.bincount(buckets, minlength=n_buckets))))
+
+    with atomic_path(out_path) as tmp_path:
+        np.savez(tmp_path,
+                 bucket_seconds=bucket_seconds,
+                 bucket_offsets=bucket_offsets,
+                 note_ids=note_ids[order],
+                 onset=notes.onset,
+                 offset=notes.offset,
+                 midi=notes.midi,
+                 velocity=notes.velocity)
+    return out_path
+
+
+def peak_tile(path: str,
+              start: Optional[float] = None,
+              end: Optional[float] = None,
+              level: Optional[int] = None,
+              points: int = 2048) -> Dict:
+    """
+    Read the peaks covering a time range
+    Without an explicit level, picks the finest level that returns at most `points` peaks
+    """
+    with np.load(path) as pyramid:
+        sr = int(pyramid['sr'])
+        block = int(pyramid['block'])
+        n_levels = int(pyramid['levels'])
+        duration = float(pyramid['duration'])
+
+        start = 0.0 if start is None else max(start, 0.0)
+        end = duration if end is None else min(end, duration)
+        end = max(end, start)
+
+        if level is None:
+            samples = (end - start) * sr
+            level = int(np.ceil(np.log2(max(samples / (block * max(points, 1)), 1))))
+        level = int(np.clip(level, 0, n_levels - 1))
+
+        step = block * 2 ** level / sr
+        first = int(np.floor(start / step))
+        last = int(np.ceil(end / step))
+
+        return {
+            'level': level,
+            'levels': n_levels,
+            'start': first * step,
+            'step': step,
+            'min': pyramid[f"min_{level}"][first:last].tolist(),
+            'max': pyramid[f"max_{level}"][first:last].tolist()
+        }
+
+
+def notes_tile(path: str, start: Optional[float] = None, end: Optional[float] = None) -> Dict:
+    """Read the notes overlapping a time range"""
+    with np.load(path) as index:
+        bucket_seconds = float(index['bucket_seconds'])
+        bucket_offsets = index['bucket_offsets']
+        n_buckets = len(bucket_offsets) - 1
+
+        start = 0.0 if start is None else max(start, 0.0)
+        end = n_buckets * bucket_seconds if end is None else max(end, start)
+
+        first_bucket = min(int(start // bucket_seconds), n_buckets)
+        last_bucket = min(int(end // bucket_seconds) + 1, n_buckets)
+        ids = np.unique(index['note_ids'][bucket_offsets[first_bucket]:bucket_offsets[last_bucket]])
+
+        onsets = index['onset'][ids]
+        offsets = index['offset'][ids]
+        ids = ids[(offsets > start) & (onsets < end)]
+
+        return {
+            'start': start,
+            'end': end,
+            'onset': index['onset'][ids].tolist(),
+            'offset': index['offset'][ids].tolist(),
+            'midi': index['midi'][ids].tolist(),
+            'velocity': index['velocity'][ids].tolist()
+        }
@@ -0,0 +1,122 @@
+import sys
+import time
+import logging
+import numpy as np
+import librosa
+from typing import Dict, List, Optional
+
+# A frame carries voice when its RMS is within ACTIVE_DB of the stem's loudest frame and its
+# spectrum is tonal: separation bleed and the noise floor of a silent stem are quiet or flat
+ACTIVE_DB = -40.0
+MAX_FLATNESS = 0.2
+# Pauses shorter than this stay inside a region (breaths, consonants), shorter blips are dropped,
+# and each region is padded so pitch tracking and decoding start and end in silence
+MERGE_GAP_SECONDS = 0.5
+MIN_REGION_SECONDS = 0.08
+PAD_SECONDS = 0.2
+
+
+def active_regions(active: np.ndarray, frames_per_second: float) -> np.ndarray:
+    """Frame ranges [start, end) of a per-frame activity mask, after merging gaps, dropping blips and padding"""
+    n_frames = len(active)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], np.asarray(active, dtype=np.int8), [0]))))
+    starts, ends = edges[::2], edges[1::2]
+
+    if len(starts):
+        # A region continues over any gap up to MERGE_GAP_SECONDS
+        begins = np.concatenate(([True], starts[1:] - ends[:-1] > MERGE_GAP_SECONDS * frames_per_second))
+        first = np.flatnonzero(begins)
+        starts, ends = starts[first], np.maximum.reduceat(ends, first)
+
+    keep = ends - starts >= MIN_REGION_SECONDS * frames_per_second
+    pad = int(round(PAD_SECONDS * frames_per_second))
+    starts = np.maximum(starts[keep] - pad, 0)
+    ends = np.minimum(ends[keep] + pad, n_frames)
+    return np.column_stack((starts, ends)).astype(np.int64).reshape(-1, 2)
+
+
+def detect_regions(audio: np.ndarray,
+                   frame_length: int,
+                   hop_length: int,
+                   sr: int,
+                   rms: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Vocal activity of a separated vocal stem from RMS and spectral flatness,
+    on the same centered frames as pitch tracking; pass `rms` when it is already computed
+    """
+    if rms is None:
+        rms = librosa.feature.rms(y=audio, frame_length=frame_length, hop_length=hop_length)[0]
+    flatness = librosa.feature.spectral_flatness(y=audio, n_fft=frame_length, hop_length=hop_length)[0]
+
+    n_frames = min(len(rms), len(flatness))
+    level = librosa.amplitude_to_db(rms[:n_frames], ref=np.max)
+    active = (level > ACTIVE_DB) & (flatness[:n_frames] < MAX_FLATNESS)
+    return active_regions(active, sr / hop_length)
+
+
+def activity_stats(regions: np.ndarray, n_frames: int, hop_time: float) -> Dict:
+    """Share of a track the transcription covered and skipped"""
+    active = int(np.sum(regions[:, 1] - regions[:, 0])) if len(regions) else 0
+    return {
+        'regions': len(regions),
+        'active_seconds': active * hop_time,
+        'total_seconds': n_frames * hop_time,
+        'skipped_ratio': 1 - active / max(n_frames, 1)
+    }
+
+
+def benchmark(audio_paths: List[str], pitch_tracker: str = 'pyin', bpm: int = 120) -> Dict[str, float]:
+    """
+    Transcribe lead vocal stems with and without gating
+    Reports the transcription seconds of both, the share of frames skipped, and how many
+    ungated notes the gated run reproduces (same pitch, onset within 50 ms)
+    """
+    from midi_extractor import MidiExtractor
+
+    totals = {'full_seconds': 0.0, 'gated_seconds': 0.0, 'frames': 0, 'skipped': 0.0, 'notes': 0, 'matched': 0}
+    for path in audio_paths:
+        runs = {}
+        for gated in (False, True):
+            extractor = MidiExtractor(vocalGate=gated)
+            start = time.perf_counter()
+            extractor.waveToMidi(path, bpm, pitchTracker=pitch_tracker)
+            runs[gated] = (time.perf_counter() - start, extractor)
+
+        (full_seconds, full), (gated_seconds, gated) = runs[False], runs[True]
+        n_frames = len(gated.features['rms'])
+        stats = activity_stats(gated.features['regions'], n_frames,
+                               gated.features['hopLength'] / gated.features['sampleRate'])
+
+        matched = 0
+        for onset, midi in zip(full.notes.onset, full.notes.midi):
+            same = gated.notes.midi == midi
+            matched += int(np.any(np.abs(gated.notes.onset[same] - onset) <= 0.05))
+
+        totals['full_seconds'] += full_seconds
+        totals['gated_seconds'] += gated_seconds
+        totals['frames'] += n_frames
+        totals['skipped'] += stats['skipped_ratio'] * n_frames
+        totals['notes'] += len(full.notes)
+        totals['matched'] += matched
+        logging.info(f"{path}: {full_seconds:.1f}s ungated, {gated_seconds:.1f}s gated, "
+                     f"{stats['skipped_ratio']:.0%} of frames skipped in {stats['regions']} regions")
+
+    return {
+        'full_seconds': totals['full_seconds'],
+        'gated_seconds': totals['gated_seconds'],
+        'time_saved_ratio': 1 - totals['gated_seconds'] / max(totals['full_seconds'], 1e-9),
+        'skipped_ratio': totals['skipped'] / max(totals['frames'], 1),
+        'note_recall': totals['matched'] / max(totals['notes'], 1)
+    }
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2:
+        print(f"Usage: python {sys.argv[0]} <lead vocal stem> [<lead vocal stem> ...]")
+        sys.exit(1)
+
+    report = benchmark(sys.argv[1:])
+    print(f"Transcription {report['full_seconds']:.1f}s ungated, {report['gated_seconds']:.1f}s gated "
+          f"({report['time_saved_ratio']:.0%} saved), {report['skipped_ratio']:.0%} of frames skipped, "
+          f"{report['note_recall']:.1%} of notes reproduced")
@@ -0,0 +1,124 @@
+import os
+import time
+import logging
+import threading
+import traceback
+import numpy as np
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+WARMUP_SR = 44100
+WARMUP_SECONDS = 4.0
+
+
+class WarmupState:
+    """Tracks the startup warm-up so readiness can be reported over HTTP"""
+
+    PENDING = 'pending'
+    WARMING = 'warming'
+    READY = 'ready'
+    FAILED = 'failed'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.status = self.PENDING
+        self.error: Optional[str] = None
+        self.stages: Dict[str, float] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def set(self, status: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            self.status = status
+            self.error = error
+            if status == self.WARMING:
+                self.started_at = time.time()
+            elif status in (self.READY, self.FAILED):
+                self.finished_at = time.time()
+
+    def begin(self) -> bool:
+        """Move from pending to warming, False if another caller already started (or skipped) the warm-up"""
+        with self._lock:
+            if self.status != self.PENDING:
+                return False
+            self.status = self.WARMING
+            self.started_at = time.time()
+            return True
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = round(seconds, 3)
+
+    @property
+    def ready(self) -> bool:
+        return self.status == self.READY
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'status': self.status,
+                'error': self.error,
+                'stages': dict(self.stages),
+                'duration': round(self.finished_at - self.started_at, 3)
+                if self.started_at and self.finished_at else None
+            }
+
+
+def synthesize_clip(path: str, sr: int = WARMUP_SR, seconds: float = WARMUP_SECONDS) -> str:
+    """
+    Write a short stereo test clip: a sung-like harmonic melody over a bass line and clicks,
+    enough for every pipeline stage to find something to work on
+    """
+    import soundfile as sf
+
+    t = np.arange(int(sr * seconds)) / sr
+    melody = np.repeat([60, 62, 64, 65, 67, 65, 64, 62], int(np.ceil(len(t) / 8)))[:len(t)]
+    f0 = 440.0 * 2 ** ((melody - 69) / 12)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    voice = sum(np.sin(k * phase) / k for k in range(1, 5)) * (1 + 0.05 * np.sin(2 * np.pi * 5 * t))
+    bass = 0.5 * np.sin(2 * np.pi * 55.0 * t)
+    clicks = np.zeros_like(t)
+    clicks[::sr // 2] = 1.0
+
+    mix = 0.3 * voice + 0.3 * bass + 0.4 * clicks
+    mix = 0.8 * mix / np.max(np.abs(mix))
+    sf.write(path, np.stack([mix, mix]).T, sr, subtype='PCM_16')
+    return path
+
+
+def run_warmup(temp_dir: str, state: WarmupState) -> None:
+    """
+    Push a synthetic clip through the whole pipeline once
+    This pays for the heavy imports, model downloads/loads and numba JIT compilation
+    (pYIN, Viterbi) before the first real request
+    """
+    state.set(WarmupState.WARMING)
+    try:
+        os.makedirs(temp_dir, exist_ok=True)
+
+        start = time.perf_counter()
+        from song_features_retriever import SongFeaturesRetriever
+        processor = SongFeaturesRetriever(temp_dir)
+        state.record('imports', time.perf_counter() - start)
+
+        start = time.perf_counter()
+        clip_path = synthesize_clip(os.path.join(temp_dir, 'warmup.wav'))
+        state.record('synthesize', time.perf_counter() - start)
+
+        start = time.perf_counter()
+        processor.process_song(clip_path)
+        state.record('pipeline', time.perf_counter() - start)
+
+        state.set(WarmupState.READY)
+        logger.info(f"Warm-up completed: {state.to_dict()}")
+    except Exception as e:
+        logger.error(f"Warm-up failed: {e}\n{traceback.format_exc()}")
+        state.set(WarmupState.FAILED, str(e))
+
+
+def start_warmup(temp_dir: str, state: WarmupState) -> threading.Thread:
+    """Run the warm-up in a background thread so the server can already answer /ready"""
+    thread = threading.Thread(target=run_warmup, args=(temp_dir, state), name='warmup', daemon=True)
+    thread.start()
+    return thread
@@ -17,6 +17,7 @@ import { useState } from 'react';
 import * as Tone from 'tone';
 import AudioVisualizerWrapper from './AudioVisualizerWrapper';
 
+const API_BASE = 'http://localhost:5000';
 
 interface Recommendation {
   title: string;
@@ -32,7 +33,8 @@ interface AudioProcessingResponse {
   tempo: number;
   midi_url: string;
   json_url: string,
-  melody: number[];
+  contour_url: string;
+  melody?: number[];
   stems: {
     vocals: string;
     drums: string;
@@ -41,6 +43,29 @@ interface AudioProcessingResponse {
   };
 }
 
+interface StageEvent {
+  event: string;
+  data: any;
+}
+
+// Splits a Server-Sent Events buffer into complete events and the unfinished remainder
+const parseStageEvents = (buffer: string): [StageEvent[], string] => {
+  const blocks = buffer.split('\n\n');
+  const rest = blocks.pop() ?? '';
+  const events = blocks
+    .map((block) => {
+      let event = 'message';
+      let data = '';
+      block.split('\n').forEach((line) => {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      });
+      return data ? { event, data: JSON.parse(data) } : null;
+    })
+    .filter((event): event is StageEvent => event !== null);
+  return [events, rest];
+};
+
 interface AudioProcessingStatus {
   stemData: {};
   isProcessing: boolean;
@@ -92,25 +117,66 @@ const RecommendationsList = ({ recommendations }: RecommendationsListProps) => {
       },
     }));
 
+    // The melody isn't inlined in the response, it is fetched from the contour's JSON URL once done
+    let melodyUrl = null as string | null;
+
+    // Merge partial results into the item's status as pipeline stages finish
+    const applyStage = ({ event, data }: StageEvent) => {
+      if (event === 'error') throw new Error(data.message || 'Processing failed');
+      if (event === 'done' && data.json_url) melodyUrl = data.json_url;
+
+      setAudioStatus((prev) => {
+        const current = prev[index] || {};
+        const next = { ...current };
+        if (data.stems) {
+          const stems = { ...(current.stemData || {}), ...data.stems };
+          // The raw vocals stem is replaced once it is split into lead and backing
+          if (stems.lead_vocals) delete stems.vocals;
+          next.stemData = stems;
+        }
+        if (data.midi_url) next.midiData = data.midi_url;
+        if (data.json_url) next.jsonData = data.json_url;
+        if (event === 'done') {
+          const result = data as AudioProcessingResponse;
+          next.isProcessing = false;
+          next.melodyData = result.melody ?? null;
+        }
+        return { ...prev, [index]: next };
+      });
+    };
+
     try {
-      const response = await fetch('http://localhost:5000/api/audio/process', {
+      const response = await fetch(`${API_BASE}/api/audio/process/stream`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ title, artist }),
       });
 
-      if (!response.ok) throw new Error('Failed to process audio');
+      if (!response.ok || !response.body) throw new Error('Failed to process audio');
 
-      const data: AudioProcessingResponse = await response.json();
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        const [events, rest] = parseStageEvents(buffer + decoder.decode(value, { stream: true }));
+        buffer = rest;
+        events.forEach(applyStage);
+      }
+
+      let melodyData: number[] | null = null;
+      if (melodyUrl) {
+        const melodyResponse = await fetch(`${API_BASE}${melodyUrl}`);
+        if (!melodyResponse.ok) throw new Error('Failed to load melody');
+        melodyData = await melodyResponse.json();
+      }
       setAudioStatus((prev) => ({
         ...prev,
         [index]: {
+          ...prev[index],
           isProcessing: false,
-          error: null,
-          midiData: data.midi_url,
-          jsonData:data.json_url,
-          melodyData: data.melody,
-          stemData: data.stems,
+          melodyData: prev[index]?.melodyData ?? melodyData,
         },
       }));
     } catch (error) {
@@ -245,7 +311,7 @@ const RecommendationsList = ({ recommendations }: RecommendationsListProps) => {
                 {audioStatus[index]?.isProcessing && (
                   <CircularProgress size={24} />
                 )}
-                {audioStatus[index]?.stemData && (                  
+                {audioStatus[index]?.stemData && audioStatus[index]?.midiData && (                  
                   <>
                     <Box sx={{ mb: 2 }}>
                       <Typography variant="subtitle2" gutterBottom>
@@ -261,20 +327,22 @@ const RecommendationsList = ({ recommendations }: RecommendationsListProps) => {
                 )}
               </Box>
               <Box sx={{ mt: 2, ml: 2 }}>
-                {audioStatus[index]?.midiData && (
+                {audioStatus[index]?.stemData && (
                   <Box sx={{ mb: 2 }}>
                     <Typography variant="subtitle2" gutterBottom>
                       Downloads
                     </Typography>
                     <Box sx={{ display: 'flex', gap: 1, flexWrap: 'wrap' }}>
-                      <Button
-                        size="small"
-                        variant="outlined"
-                        href={audioStatus[index].midiData}
-                        download
-                      >
-                        MIDI File
-                      </Button>
+                      {audioStatus[index].midiData && (
+                        <Button
+                          size="small"
+                          variant="outlined"
+                          href={audioStatus[index].midiData}
+                          download
+                        >
+                          MIDI File
+                        </Button>
+                      )}
                       {Object.entries(audioStatus[index].stemData || {}).map(
                         ([name, url]) => (
                           <Button
@@ -1,5 +1,5 @@
 // src/services/api/musicService.ts
-import type {  RecommendationResponse } from '../../types/audio';
+import type {  RecommendationResponse, PlaylistRecommendationResponse } from '../../types/audio';
 import type  { MusicSearchData } from '../../types/audio';
 
 const API_BASE_URL = 'http://localhost:5000/api';
@@ -37,6 +37,27 @@ class MusicService {
       throw new Error('An unknown error occurred');
     }
   }
+
+  // One request for a whole playlist: seeds share candidate lookups and are ranked together
+  async getPlaylistRecommendations(seeds: MusicSearchData[], limit = 20, genres: string[] = []): Promise<PlaylistRecommendationResponse> {
+    const response = await fetch(`${API_BASE_URL}/recommendations/batch`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({
+        seeds: seeds.map(({ title, artist }) => ({ title, artist })),
+        limit,
+        genres,
+      }),
+    });
+
+    const data = await response.json().catch(() => null);
+    if (!response.ok || data?.status === 'error') {
+      throw new Error(data?.message || `HTTP error! status: ${response.status}`);
+    }
+    return data;
+  }
 }
 
 export const musicService = new MusicService();
@@ -6,6 +6,7 @@ export interface Recommendation {
     sources: string[];
     genres?: string[];
     tags?: string[];
+    seed_matches?: number;
 }
 
 export interface MusicSearchData {
@@ -18,4 +19,18 @@ export interface RecommendationResponse {
     status: string;
     recommendations: Recommendation[];
     original_tags?: string[];
-  }
\ No newline at end of file
+  }
+
+export interface PlaylistRecommendationStats {
+    seeds: number;
+    candidates: number;
+    latency_ms: number;
+    upstream_calls: Record<string, number>;
+    upstream_calls_total: number;
+  }
+
+export interface PlaylistRecommendationResponse {
+    status: string;
+    recommendations: Recommendation[];
+    stats: PlaylistRecommendationStats;
+  }